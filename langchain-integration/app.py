@@ -1,58 +1,701 @@
 import os
-from flask import Flask, request, jsonify
+import atexit
+import json
+import math
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import openai
+from flask import Blueprint, Flask, Response, current_app, g, request, jsonify, stream_with_context, url_for
 from flask_cors import CORS # Added
-from langchain_openai import ChatOpenAI
 from langchain.schema import SystemMessage, HumanMessage
 from dotenv import load_dotenv
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+from pydantic import ValidationError
+from config import Config
+from schemas import GuidanceRequest, GuidanceResponse, TokenUsage, validate_guidance_input, validation_details
+from cache import create_response_cache_from_env, make_cache_key
+from semantic_cache import create_semantic_cache_from_env
+from singleflight import SingleFlight
+from limits import AdmissionError, UpstreamUnavailable, create_concurrency_limiter_from_env, create_rate_limiter_from_env, retry_with_backoff
+from conversation import Turn, create_conversation_store_from_env, format_transcript
+from prompts import create_prompt_builder_from_env
+from routing import create_model_router_from_env
+from storage import create_storage_from_env
+from jobs import JobWorkerPool, callback_allowed, create_job_queue_from_env, job_view
+import metrics
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize Flask app
-app = Flask(__name__)
-CORS(app) # Added: Enable CORS for all routes
+# The routes; create_app() registers them on an application
+api = Blueprint('guidance', __name__)
 
-# Initialize ChatOpenAI
-# Ensure OPENAI_API_KEY is loaded correctly
-openai_api_key = os.getenv("OPENAI_API_KEY")
-if not openai_api_key:
-    raise ValueError("OPENAI_API_KEY not found in environment variables. Make sure it's set in the .env file.")
+# Fast and standard model tiers, with fallback between them (see routing.py for configuration).
+# The model clients are only built on the first LLM call.
+model_router = create_model_router_from_env()
 
-llm = ChatOpenAI(openai_api_key=openai_api_key)
+# Cache of guidance for identical prompts (see cache.py for configuration)
+response_cache = create_response_cache_from_env()
+# Optional embedding-similarity cache for group messages (see semantic_cache.py)
+semantic_cache = create_semantic_cache_from_env()
+# Coalesces concurrent identical prompts into a single LLM call (see singleflight.py)
+llm_flight = SingleFlight()
 
-@app.route('/api/guidance', methods=['POST'])
-def get_guidance():
+# Admission control in front of the LLM (see limits.py for configuration)
+llm_limiter = create_concurrency_limiter_from_env()
+rate_limiter = create_rate_limiter_from_env()
+
+# Durable record of onboarding sessions, group messages and generated guidance, written
+# in the background (see storage.py for configuration)
+storage = create_storage_from_env()
+if storage is not None:
+    atexit.register(storage.close)
+
+# Optional persistent queue for asynchronous guidance requests (see jobs.py for configuration)
+job_queue = create_job_queue_from_env()
+
+@api.before_app_request
+def start_request_trace():
+    # Reuse the caller's request ID (the bot sends one) so a request can be traced across services
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.request_started = time.perf_counter()
+
+@api.after_app_request
+def finish_request_trace(response):
+    elapsed = time.perf_counter() - g.request_started
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.REQUEST_LATENCY.labels(endpoint, str(response.status_code)).observe(elapsed)
+    response.headers['X-Request-ID'] = g.request_id
+    current_app.logger.info(f"[{g.request_id}] {request.method} {request.path} {response.status_code} {elapsed * 1000:.1f}ms")
+    return response
+
+# Renders onboarding data into a compact prompt within a token budget (see prompts.py)
+prompt_builder = create_prompt_builder_from_env()
+
+SUMMARY_TIER = os.getenv("GUIDANCE_CONVERSATION_SUMMARY_TIER", "fast")
+SUMMARY_PROMPT = "You keep a running summary of a group chat in which you mediate a conflict. Record who said what about the dispute, what was proposed and what was agreed."
+
+def summarize_conversation(summary, turns):
+    """Folds turns that left the conversation window into the running summary."""
+    messages = [
+        SystemMessage(content=SUMMARY_PROMPT),
+        HumanMessage(content=(
+            f"Current summary: {summary or '(none yet)'}\n\n"
+            f"New messages:\n{format_transcript(turns)}\n\n"
+            f"Reply with the updated summary only, in at most {conversation_store.summary_max_tokens * 3 // 4} words."
+        )),
+    ]
+    # Not retried here: a failed summary is retried with the chat's next compaction
+    return invoke_llm(messages, model_router.tier(SUMMARY_TIER), max_retries=0, base_delay=0).content
+
+# Summaries are written in the background so compaction never delays a reply
+summary_executor = ThreadPoolExecutor(max_workers=int(os.getenv("GUIDANCE_CONVERSATION_SUMMARY_WORKERS", "2")))
+def load_conversation(key):
+    """Reloads a group chat's latest turns from storage, e.g. after a restart."""
+    group_chat_id = key.split(":", 1)[1]
+    return [Turn(author, text) for author, text in storage.recent_messages(group_chat_id, conversation_store.max_turns)]
+
+# Rolling per-chat memory of group conversations (see conversation.py for configuration)
+conversation_store = create_conversation_store_from_env(
+    summarize_conversation,
+    executor=summary_executor,
+    loader=load_conversation if storage is not None else None,
+)
+
+def conversation_key(onboarding_data):
+    """Returns the conversation memory key for group-message requests, otherwise None."""
+    if conversation_store is None or not isinstance(onboarding_data, dict):
+        return None
+    if not onboarding_data.get('user_query') or onboarding_data.get('group_chat_id') is None:
+        return None
+    return f"group:{onboarding_data['group_chat_id']}"
+
+def conversation_context(onboarding_data):
+    key = conversation_key(onboarding_data)
+    return conversation_store.context(key) if key else None
+
+def user_key(onboarding_data):
+    """The user a request is stored under: its user_id, or the user_info the bot sends."""
+    if not isinstance(onboarding_data, dict):
+        return None
+    user = onboarding_data.get('user_id') or onboarding_data.get('user_info')
+    return str(user) if user else None
+
+def remember_exchange(onboarding_data, guidance):
+    """
+    Adds a group message and the guidance given for it to the chat's conversation
+    memory, and queues the request and its guidance for storage.
+    """
+    is_group_message = (isinstance(onboarding_data, dict) and onboarding_data.get('user_query')
+                        and onboarding_data.get('group_chat_id') is not None)
+    if not is_group_message:
+        if storage is not None:
+            storage.record_session(user_key(onboarding_data), onboarding_data)
+        return
+
+    author = str(onboarding_data.get('user_info') or "user")
+    user_query = str(onboarding_data['user_query'])
+    key = conversation_key(onboarding_data)
+    if key:
+        conversation_store.record(key, Turn(author, user_query), Turn("Mediator", guidance))
+    if storage is not None:
+        storage.record_messages(onboarding_data['group_chat_id'], [(author, user_query), ("Mediator", guidance)])
+
+def semantic_cache_query(onboarding_data):
+    """Returns (group_chat_id, user_query) for group-message requests, otherwise None."""
+    if not isinstance(onboarding_data, dict):
+        return None
+    user_query = onboarding_data.get('user_query')
+    group_chat_id = onboarding_data.get('group_chat_id')
+    if not user_query or group_chat_id is None:
+        return None
+    return group_chat_id, user_query
+
+def get_cached_guidance(onboarding_data, cache_key):
+    """
+    Looks guidance up in the exact-match cache, then in the semantic cache, then
+    in storage (which outlives restarts; a hit there is put back into the cache).
+    """
+    guidance = response_cache.get(cache_key)
+    if guidance is None and semantic_cache is not None:
+        query = semantic_cache_query(onboarding_data)
+        if query:
+            guidance = semantic_cache.lookup(*query)
+    if guidance is None and storage is not None and response_cache.enabled:
+        guidance = storage.find_guidance(cache_key, max_age=response_cache.ttl)
+        if guidance is not None:
+            response_cache.set(cache_key, guidance)
+    return guidance
+
+def store_guidance(onboarding_data, cache_key, guidance, tier=None):
+    """Stores freshly generated guidance in the caches and queues it for storage."""
+    response_cache.set(cache_key, guidance)
+    if storage is not None:
+        group_chat_id = onboarding_data.get('group_chat_id') if isinstance(onboarding_data, dict) else None
+        storage.record_guidance(cache_key, guidance, user_id=user_key(onboarding_data),
+                                group_chat_id=group_chat_id, model=tier.model if tier else None)
+    if semantic_cache is not None:
+        query = semantic_cache_query(onboarding_data)
+        if query:
+            semantic_cache.store(*query, guidance)
+
+def check_rate_limit(onboarding_data):
+    """Raises RateLimited when the group chat (or, failing that, the client address) is over its rate."""
+    if rate_limiter is None:
+        return
+    if isinstance(onboarding_data, dict) and onboarding_data.get('group_chat_id') is not None:
+        rate_limiter.check(f"group:{onboarding_data['group_chat_id']}")
+    else:
+        rate_limiter.check(f"client:{request.remote_addr}")
+
+def is_retryable_llm_error(error):
+    """Upstream rate limits, timeouts and server errors are worth retrying."""
+    return isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError))
+
+@contextmanager
+def llm_slot(count=1):
+    """Holds `count` LLM concurrency slots, recording how long it took to get them; yields the number held."""
+    waiting_since = time.perf_counter()
+    with llm_limiter.slot(count) as held:
+        metrics.QUEUE_WAIT.observe(time.perf_counter() - waiting_since)
+        yield held
+
+@contextmanager
+def timed_llm_call(operation, tier):
+    """Records the duration and outcome of an LLM call."""
+    started = time.perf_counter()
+    outcome = "error"
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "No data provided"}), 400
-        
-        onboarding_data = data.get('onboarding_data')
-        if not onboarding_data:
-            return jsonify({"error": "Missing 'onboarding_data' in request"}), 400
-
-        # For now, just convert the whole onboarding_data dict to a string for the prompt
-        # We can refine this later to be more specific.
-        prompt_data_str = str(onboarding_data)
-
-        # Create a simple prompt
-        messages = [
-            SystemMessage(content="You are a helpful assistant for conflict resolution. Your role is to provide initial guidance based on user's onboarding information."),
-            HumanMessage(content=f"The user provided the following onboarding data: {prompt_data_str}. Based on this, suggest a concise next step or piece of advice for them to consider.")
-        ]
+        yield
+        outcome = "success"
+    finally:
+        metrics.LLM_LATENCY.labels(operation, tier.name, outcome).observe(time.perf_counter() - started)
 
+def invoke_llm(messages, tier, max_retries, base_delay):
+    """
+    Calls the tier's model inside a concurrency slot, falling back to the tier's
+    fallback model on upstream errors and retrying with jittered backoff when both fail.
+    """
+    def call(model_tier):
+        with llm_slot(), timed_llm_call("invoke", model_tier):
+            return model_tier.llm.invoke(messages)
+
+    def attempt():
+        llm_response = model_router.call(tier, call, is_retryable_llm_error)
+        metrics.observe_token_usage(llm_response)
+        return llm_response
+
+    return retry_with_backoff(attempt, is_retryable_llm_error, max_retries=max_retries, base_delay=base_delay)
+
+def batch_llm(inputs, tier, max_concurrency, max_retries, base_delay):
+    """
+    Runs a batch on the tier's model (falling back per item like invoke_llm) with
+    one concurrency slot per call in flight. Items that still fail with upstream
+    errors are retried with jittered backoff. Returns one response or exception per input.
+    """
+    responses = [None] * len(inputs)
+    pending = list(range(len(inputs)))
+
+    def attempt():
+        nonlocal pending
+        with llm_slot(min(len(pending), max_concurrency)) as concurrency, timed_llm_call("batch", tier):
+            results = model_router.batch(
+                tier, [inputs[i] for i in pending], is_retryable_llm_error,
+                config={"max_concurrency": concurrency},
+            )
+        for i, response in zip(pending, results):
+            responses[i] = response
+        pending = [i for i in pending if isinstance(responses[i], Exception) and is_retryable_llm_error(responses[i])]
+        if pending:
+            raise responses[pending[0]]
+
+    try:
+        retry_with_backoff(attempt, is_retryable_llm_error, max_retries=max_retries, base_delay=base_delay)
+    except UpstreamUnavailable:
+        pass  # Items that never succeeded keep their last error
+    return responses
+
+def admission_error_response(error):
+    """Builds the 429/503 response, with a Retry-After header, for a refused request."""
+    response = jsonify({"error": str(error), "retry_after": error.retry_after})
+    response.status_code = error.status_code
+    response.headers['Retry-After'] = str(max(1, math.ceil(error.retry_after)))
+    return response
+
+def read_guidance_body():
+    """
+    Reads the request's JSON body and checks it has 'onboarding_data'.
+    Returns a tuple (body, error_response); exactly one of them is None.
+    """
+    if request.is_json:
+        try:
+            data = request.get_json()
+        except RequestEntityTooLarge:
+            return None, (jsonify({"error": "Request body too large", "max_bytes": current_app.config['MAX_CONTENT_LENGTH']}), 413)
+        except BadRequest as e:
+            return None, (jsonify({"error": "Failed to decode JSON object", "details": e.description}), 400)
+    else:
+        data = None
+
+    if not data:
+        return None, (jsonify({"error": "No data provided"}), 400)
+    if not isinstance(data, dict):
+        return None, (jsonify({"error": "Request body must be a JSON object"}), 400)
+
+    if not data.get('onboarding_data'):
+        return None, (jsonify({"error": "Missing 'onboarding_data' in request"}), 400)
+
+    return data, None
+
+def invalid_request_response(error):
+    return jsonify({"error": "Invalid request", "details": validation_details(error)}), 400
+
+def parse_guidance_request():
+    """
+    Validates the body of a single guidance request (see schemas.py) before any LLM work.
+    Returns a tuple (GuidanceRequest, error_response); exactly one of them is None.
+    """
+    body, error_response = read_guidance_body()
+    if error_response:
+        return None, error_response
+    try:
+        return GuidanceRequest.model_validate(body), None
+    except ValidationError as e:
+        current_app.logger.info(f"[{g.request_id}] Rejected invalid guidance request: {e.error_count()} errors")
+        return None, invalid_request_response(e)
+
+def format_sse(data, event=None):
+    """Formats a JSON-serialisable payload as a Server-Sent Events message."""
+    message = f"data: {json.dumps(data)}\n\n"
+    if event:
+        message = f"event: {event}\n{message}"
+    return message
+
+def generate_guidance(onboarding_data, max_retries, base_delay, before_llm_call=None):
+    """
+    Returns a GuidanceResponse for the onboarding data from the caches or, failing
+    that, from the routed model tier, and records the exchange in the chat's memory.
+    `before_llm_call` runs only when the LLM is actually needed (e.g. a rate limit check).
+    """
+    tier = model_router.route(onboarding_data)
+    messages = prompt_builder.build(onboarding_data, conversation_context(onboarding_data))
+    cache_key = make_cache_key(messages, tier.cache_params())
+
+    cached_guidance = get_cached_guidance(onboarding_data, cache_key)
+    if cached_guidance is not None:
+        remember_exchange(onboarding_data, cached_guidance)
+        return GuidanceResponse(guidance=cached_guidance, cached=True)
+
+    if before_llm_call is not None:
+        before_llm_call()
+
+    def generate():
         # Get response from LLM
-        llm_response = llm.invoke(messages)
-        
+        llm_response = invoke_llm(messages, tier, max_retries, base_delay)
+
         # Extract content from the response
         response_content = llm_response.content if hasattr(llm_response, 'content') else str(llm_response)
+        store_guidance(onboarding_data, cache_key, response_content, tier)
+        remember_exchange(onboarding_data, response_content)
+        return GuidanceResponse(guidance=response_content, model=response_model(llm_response, tier), usage=token_usage(llm_response))
+
+    # Identical requests arriving while this one is in flight share its LLM call
+    return llm_flight.do(cache_key, generate)
 
-        return jsonify({"guidance": response_content})
+def response_model(llm_response, tier):
+    """The model that answered, as reported by the provider (it differs from the tier's after a fallback)."""
+    metadata = getattr(llm_response, 'response_metadata', None) or {}
+    return metadata.get('model_name') or tier.model
 
+def token_usage(llm_response):
+    usage = getattr(llm_response, 'usage_metadata', None)
+    if not usage:
+        return None
+    return TokenUsage(input_tokens=usage.get('input_tokens', 0), output_tokens=usage.get('output_tokens', 0),
+                      total_tokens=usage.get('total_tokens', 0))
+
+def run_guidance_job(onboarding_data):
+    """Job handler for the worker pool; runs inside an application context."""
+    result = generate_guidance(onboarding_data, current_app.config['LLM_MAX_RETRIES'], current_app.config['LLM_RETRY_BASE_DELAY'])
+    return result.model_dump(exclude={"latency_ms"})
+
+def enqueue_guidance_job(onboarding_data, callback_url=None):
+    """Queues a guidance request and returns the 202 response pointing at its status."""
+    if job_queue is None:
+        return jsonify({"error": "Asynchronous guidance jobs are not enabled"}), 400
+    if callback_url and not callback_allowed(callback_url, current_app.config['JOBS_CALLBACK_HOSTS']):
+        return jsonify({"error": "'callback_url' is not an allowed callback address"}), 400
+
+    # Refuse over-limit chats now rather than queueing work for them
+    check_rate_limit(onboarding_data)
+    job_id = job_queue.enqueue(onboarding_data, callback_url=callback_url, request_id=g.request_id)
+    status_url = url_for('guidance.get_guidance_job', job_id=job_id)
+    response = jsonify({"job_id": job_id, "status": "queued", "status_url": status_url})
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
+
+@api.route('/api/guidance', methods=['POST'])
+def get_guidance():
+    """
+    Returns guidance for an onboarding submission or group message as a
+    GuidanceResponse: the guidance, the model that wrote it, token usage, whether
+    it came from a cache and the request's latency. With "async": true in the
+    body the request is queued instead: the response is a 202 with the job ID, and
+    the result is fetched from GET /api/guidance/<job_id> or POSTed to "callback_url".
+    """
+    try:
+        guidance_request, error_response = parse_guidance_request()
+        if error_response:
+            return error_response
+        onboarding_data = guidance_request.onboarding_data.payload()
+
+        if guidance_request.run_async:
+            return enqueue_guidance_job(onboarding_data, guidance_request.callback_url)
+
+        result = generate_guidance(
+            onboarding_data,
+            current_app.config['LLM_MAX_RETRIES'],
+            current_app.config['LLM_RETRY_BASE_DELAY'],
+            before_llm_call=lambda: check_rate_limit(onboarding_data),
+        )
+        # Coalesced requests share one result object, so copy before adding this request's latency
+        latency_ms = round((time.perf_counter() - g.request_started) * 1000, 1)
+        return jsonify(result.model_copy(update={"latency_ms": latency_ms}).model_dump())
+
+    except AdmissionError as e:
+        current_app.logger.warning(f"[{g.request_id}] Refused /api/guidance request: {str(e)}")
+        return admission_error_response(e)
     except Exception as e:
         # Log the error for debugging
-        app.logger.error(f"Error in /api/guidance: {str(e)}")
+        current_app.logger.error(f"[{g.request_id}] Error in /api/guidance: {str(e)}")
         return jsonify({"error": "An internal error occurred", "details": str(e)}), 500
 
+@api.route('/api/guidance/<job_id>', methods=['GET'])
+def get_guidance_job(job_id):
+    """Returns the status of an asynchronous guidance job, with the guidance once it succeeded."""
+    job = job_queue.get(job_id) if job_queue is not None else None
+    if job is None:
+        return jsonify({"error": "Unknown guidance job"}), 404
+    return jsonify(job_view(job))
+
+@api.route('/api/guidance/stream', methods=['POST'])
+def stream_guidance():
+    """
+    Streams guidance as Server-Sent Events while the LLM generates it.
+    Each chunk is sent as {"delta": ...}; a final "done" event carries the full guidance.
+    """
+    guidance_request, error_response = parse_guidance_request()
+    if error_response:
+        return error_response
+    onboarding_data = guidance_request.onboarding_data.payload()
+
+    tier = model_router.route(onboarding_data)
+    messages = prompt_builder.build(onboarding_data, conversation_context(onboarding_data))
+    cache_key = make_cache_key(messages, tier.cache_params())
+
+    def stream_result(guidance):
+        yield format_sse({"delta": guidance})
+        yield format_sse({"guidance": guidance}, event="done")
+
+    def sse_response(events):
+        return Response(
+            events,
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        )
+
+    cached_guidance = get_cached_guidance(onboarding_data, cache_key)
+    if cached_guidance is not None:
+        remember_exchange(onboarding_data, cached_guidance)
+        return sse_response(stream_result(cached_guidance))
+
+    try:
+        check_rate_limit(onboarding_data)
+    except AdmissionError as e:
+        current_app.logger.warning(f"[{g.request_id}] Refused /api/guidance/stream request: {str(e)}")
+        return admission_error_response(e)
+
+    call, is_leader = llm_flight.join(cache_key)
+    if not is_leader:
+        # An identical prompt is already being generated; wait for its result
+        def follow():
+            try:
+                guidance = call.wait().guidance
+            except Exception as e:
+                current_app.logger.error(f"[{g.request_id}] Error in /api/guidance/stream: {str(e)}")
+                yield format_sse({"error": "An internal error occurred", "details": str(e)}, event="error")
+                return
+            yield from stream_result(guidance)
+
+        return sse_response(stream_with_context(follow()))
+
+    # Take the LLM slot before sending headers, so overload is still reported as a 503.
+    # The slot is held for the whole stream.
+    waiting_since = time.perf_counter()
+    try:
+        llm_limiter.acquire()
+        metrics.QUEUE_WAIT.observe(time.perf_counter() - waiting_since)
+    except AdmissionError as e:
+        llm_flight.complete(call, error=e)
+        current_app.logger.warning(f"[{g.request_id}] Refused /api/guidance/stream request: {str(e)}")
+        return admission_error_response(e)
+
+    # The result shared with coalesced requests is a GuidanceResponse, as in generate_guidance
+    outcome = {"result": None, "error": None, "finished": False}
+    request_started = g.request_started
+    llm_started = time.perf_counter()
+
+    def finish():
+        # Runs when the stream ends and again when the response is closed (which
+        # also covers clients disconnecting before or during the stream)
+        if outcome["finished"]:
+            return
+        outcome["finished"] = True
+        llm_limiter.release()
+        now = time.perf_counter()
+        metrics.LLM_LATENCY.labels("stream", tier.name, "success" if outcome["result"] is not None else "error").observe(now - llm_started)
+        metrics.STREAM_DURATION.observe(now - request_started)
+        if outcome["result"] is None and outcome["error"] is None:
+            outcome["error"] = RuntimeError("Guidance stream was aborted")
+        llm_flight.complete(call, result=outcome["result"], error=outcome["error"])
+
+    def generate():
+        parts = []
+        model, usage = None, None
+        try:
+            for chunk in model_router.stream(tier, messages, is_retryable_llm_error):
+                metrics.observe_token_usage(chunk)  # Only the final chunk carries usage
+                usage = token_usage(chunk) or usage
+                model = (getattr(chunk, 'response_metadata', None) or {}).get('model_name') or model
+                delta = chunk.content if hasattr(chunk, 'content') else str(chunk)
+                if delta:
+                    parts.append(delta)
+                    yield format_sse({"delta": delta})
+            guidance = "".join(parts)
+            store_guidance(onboarding_data, cache_key, guidance, tier)
+            remember_exchange(onboarding_data, guidance)
+            outcome["result"] = GuidanceResponse(guidance=guidance, model=model or tier.model, usage=usage)
+            yield format_sse({"guidance": guidance}, event="done")
+        except Exception as e:
+            outcome["error"] = e
+            # Headers are already sent, so report the failure in-band
+            current_app.logger.error(f"[{g.request_id}] Error in /api/guidance/stream: {str(e)}")
+            yield format_sse({"error": "An internal error occurred", "details": str(e)}, event="error")
+        finally:
+            finish()
+
+    response = sse_response(stream_with_context(generate()))
+    response.call_on_close(finish)
+    return response
+
+@api.route('/api/guidance/batch', methods=['POST'])
+def get_guidance_batch():
+    """
+    Generates guidance for a list of onboarding_data items in one request.
+    Uncached items go through llm.batch of their model tier with bounded concurrency; each item gets
+    either {"guidance": ...} or {"error": ..., "details": ...}, in request order.
+    Items are independent, so conversation memory isn't used or updated.
+    """
+    try:
+        body, error_response = read_guidance_body()
+        if error_response:
+            return error_response
+        items = body['onboarding_data']
+        if not isinstance(items, list):
+            return jsonify({"error": "'onboarding_data' must be a list for batch requests"}), 400
+        max_items = current_app.config['BATCH_MAX_ITEMS']
+        if len(items) > max_items:
+            return jsonify({"error": f"Batch too large: at most {max_items} items are allowed"}), 400
+
+        results = [None] * len(items)
+        pending = {}  # tier name -> {cache_key: (messages, onboarding_data, [item indexes])}
+        for i, onboarding_data in enumerate(items):
+            if not onboarding_data:
+                results[i] = {"error": "Empty 'onboarding_data' item"}
+                continue
+            try:
+                onboarding_data = validate_guidance_input(onboarding_data).payload()
+            except ValidationError as e:
+                results[i] = {"error": "Invalid 'onboarding_data' item", "details": validation_details(e)}
+                continue
+            tier = model_router.route(onboarding_data)
+            messages = prompt_builder.build(onboarding_data)
+            cache_key = make_cache_key(messages, tier.cache_params())
+            tier_pending = pending.setdefault(tier.name, {})
+            if cache_key in tier_pending:
+                # Duplicate of an earlier item in this batch; generate it once
+                tier_pending[cache_key][2].append(i)
+                continue
+            cached_guidance = get_cached_guidance(onboarding_data, cache_key)
+            if cached_guidance is not None:
+                results[i] = {"guidance": cached_guidance}
+            else:
+                tier_pending[cache_key] = (messages, onboarding_data, [i])
+
+        if any(pending.values()):
+            check_rate_limit(None)
+        generated = []
+        # Each tier's part of the batch counts as one LLM slot; llm.batch bounds its own concurrency
+        for tier_name, tier_pending in pending.items():
+            if not tier_pending:
+                continue
+            tier = model_router.tier(tier_name)
+            llm_responses = batch_llm(
+                [messages for messages, _, _ in tier_pending.values()], tier,
+                current_app.config['BATCH_MAX_CONCURRENCY'],
+                current_app.config['LLM_MAX_RETRIES'], current_app.config['LLM_RETRY_BASE_DELAY'],
+            )
+            generated.extend((tier, item, llm_response) for item, llm_response in zip(tier_pending.items(), llm_responses))
+
+        for tier, (cache_key, (_, onboarding_data, indexes)), llm_response in generated:
+            if isinstance(llm_response, Exception):
+                current_app.logger.error(f"[{g.request_id}] Error in /api/guidance/batch item: {str(llm_response)}")
+                result = {"error": "An internal error occurred", "details": str(llm_response)}
+            else:
+                metrics.observe_token_usage(llm_response)
+                guidance = llm_response.content if hasattr(llm_response, 'content') else str(llm_response)
+                store_guidance(onboarding_data, cache_key, guidance, tier)
+                result = {"guidance": guidance}
+            for i in indexes:
+                results[i] = result
+
+        failed = sum(1 for result in results if "error" in result)
+        return jsonify({"results": results, "succeeded": len(results) - failed, "failed": failed})
+
+    except AdmissionError as e:
+        current_app.logger.warning(f"[{g.request_id}] Refused /api/guidance/batch request: {str(e)}")
+        return admission_error_response(e)
+    except Exception as e:
+        current_app.logger.error(f"[{g.request_id}] Error in /api/guidance/batch: {str(e)}")
+        return jsonify({"error": "An internal error occurred", "details": str(e)}), 500
+
+def service_stats():
+    """Collects counters of the guidance caches, the request coalescer, admission control, routing, conversation memory, storage and jobs."""
+    stats = response_cache.stats()
+    if semantic_cache is not None:
+        stats["semantic"] = semantic_cache.stats()
+    stats["coalescing"] = llm_flight.stats()
+    stats["admission"] = llm_limiter.stats()
+    if rate_limiter is not None:
+        stats["rate_limit"] = rate_limiter.stats()
+    stats["routing"] = model_router.stats()
+    if conversation_store is not None:
+        stats["conversations"] = conversation_store.stats()
+    if storage is not None:
+        stats["storage"] = storage.stats()
+    if job_queue is not None:
+        stats["jobs"] = job_queue.stats()
+    return stats
+
+metrics.register_stats_collector(service_stats)
+
+@api.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Returns counters of the guidance caches, the request coalescer, admission control, routing, conversation memory, storage and jobs."""
+    return jsonify(service_stats())
+
+@api.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Exposes latency histograms and service counters in the Prometheus text format."""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+@api.route('/healthz', methods=['GET'])
+def health():
+    """Liveness probe: the worker is up and serving requests."""
+    return jsonify({"status": "ok"})
+
+@api.route('/readyz', methods=['GET'])
+def readiness():
+    """
+    Readiness probe: the worker is configured and has capacity for more LLM calls.
+    Checks local state only; it never calls the LLM.
+    """
+    admission = llm_limiter.stats()
+    checks = {
+        "openai_api_key": bool(current_app.config['OPENAI_API_KEY']),
+        "cache": response_cache.ping(),
+        # A new request would get a slot or a place in the queue
+        "llm_capacity": admission["active"] < admission["max_concurrent"] or admission["waiting"] < admission["max_queue"],
+    }
+    ready = all(checks.values())
+    return jsonify({"status": "ready" if ready else "not ready", "checks": checks}), 200 if ready else 503
+
+def create_app(config=None):
+    """
+    Creates the guidance API application. Settings come from `config` (a
+    Config instance or class), by default from the environment.
+    """
+    config = config or Config.from_env()
+    app = Flask(__name__)
+    app.config.from_object(config)
+    if not app.config['OPENAI_API_KEY']:
+        app.logger.warning("OPENAI_API_KEY is not set; LLM calls will fail and /readyz reports not ready")
+    CORS(app) # Added: Enable CORS for all routes
+    app.register_blueprint(api)
+    if job_queue is not None and app.config['JOBS_WORKERS'] > 0:
+        start_job_workers(app)
+    return app
+
+def start_job_workers(app):
+    """Starts the threads that process queued guidance jobs for the app, one pool per process."""
+    def handler(onboarding_data):
+        with app.app_context():
+            return run_guidance_job(onboarding_data)
+
+    pool = JobWorkerPool(
+        job_queue,
+        handler,
+        workers=app.config['JOBS_WORKERS'],
+        poll_interval=app.config['JOBS_POLL_INTERVAL'],
+        retry_base_delay=app.config['JOBS_RETRY_BASE_DELAY'],
+    )
+    pool.start()
+    app.extensions['guidance_job_workers'] = pool
+    return pool
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5001)
+    create_app().run(debug=True, port=5001)
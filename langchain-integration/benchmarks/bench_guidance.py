@@ -0,0 +1,192 @@
+"""
+Load benchmark for the guidance API.
+
+Runs the real Flask app on a local port with ChatOpenAI swapped for
+FakeChatModel (configurable latency, token rate and error injection), drives
+/api/guidance and /api/guidance/stream at increasing concurrency and reports
+p50/p95/p99 latency, requests/s, errors and peak memory. Results are written
+as JSON so runs of different versions can be compared:
+
+    python benchmarks/bench_guidance.py --latency 0.2 --output before.json
+    python benchmarks/bench_guidance.py --latency 0.2 --compare before.json
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import httpx
+from werkzeug.serving import make_server
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("OPENAI_API_KEY", "benchmark-dummy-key")
+# Nothing is persisted by default: rows left by earlier runs would be served as
+# cache hits, and the fake guidance must not end up in the service's database
+os.environ.setdefault("GUIDANCE_STORAGE_BACKEND", "none")
+
+import app as guidance_app
+from fake_llm import FakeChatModel
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_payload(args, i):
+    # Unique prompts unless --repeat-ratio asks for a share of repeats (cache hits)
+    if args.repeat_ratio and (i % 100) < args.repeat_ratio * 100:
+        story = "A repeated conflict about the kitchen."
+    else:
+        story = f"Conflict {uuid.uuid4().hex} about the kitchen."
+    return {"onboarding_data": {"conflict_description": story, "mediator_preference": "neutral"}}
+
+
+def send_guidance(client, base_url, payload):
+    started = time.perf_counter()
+    response = client.post(f"{base_url}/api/guidance", json=payload)
+    return {"status": response.status_code, "latency": time.perf_counter() - started, "ttft": None}
+
+
+def send_stream(client, base_url, payload):
+    started = time.perf_counter()
+    ttft = None
+    failed = False
+    with client.stream("POST", f"{base_url}/api/guidance/stream", json=payload) as response:
+        for line in response.iter_lines():
+            if ttft is None and line.startswith("data: "):
+                ttft = time.perf_counter() - started
+            if line == "event: error":
+                failed = True
+        status = 500 if failed else response.status_code
+    return {"status": status, "latency": time.perf_counter() - started, "ttft": ttft}
+
+
+def run_level(base_url, endpoint, concurrency, args):
+    send = send_stream if endpoint == "stream" else send_guidance
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    with httpx.Client(timeout=120, limits=limits) as client, ThreadPoolExecutor(concurrency) as pool:
+        started = time.perf_counter()
+        outcomes = list(pool.map(lambda i: send(client, base_url, make_payload(args, i)), range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    ok = sorted(o["latency"] for o in outcomes if o["status"] == 200)
+    ttfts = sorted(o["ttft"] for o in outcomes if o["status"] == 200 and o["ttft"] is not None)
+    status_counts = {}
+    for o in outcomes:
+        status_counts[str(o["status"])] = status_counts.get(str(o["status"]), 0) + 1
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 1)
+
+    result = {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(outcomes),
+        "errors": len(outcomes) - len(ok),
+        "status_counts": status_counts,
+        "requests_per_s": round(len(outcomes) / elapsed, 1),
+        "p50_ms": ms(percentile(ok, 50)),
+        "p95_ms": ms(percentile(ok, 95)),
+        "p99_ms": ms(percentile(ok, 99)),
+        "mean_ms": ms(statistics.fmean(ok)) if ok else None,
+        "max_rss_mb": max_rss_mb(),
+    }
+    if endpoint == "stream":
+        result["ttft_p50_ms"] = ms(percentile(ttfts, 50))
+        result["ttft_p95_ms"] = ms(percentile(ttfts, 95))
+    return result
+
+
+def compare(results, baseline_path):
+    """Prints the change in p95 latency and throughput against an earlier run."""
+    with open(baseline_path) as f:
+        baseline = {(r["endpoint"], r["concurrency"]): r for r in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        before = baseline.get((result["endpoint"], result["concurrency"]))
+        if not before or not before["p95_ms"] or not result["p95_ms"]:
+            continue
+        p95_change = (result["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+        rps_change = (result["requests_per_s"] - before["requests_per_s"]) / before["requests_per_s"] * 100
+        print(f"  {result['endpoint']:>8} x{result['concurrency']:<4} p95 {p95_change:+6.1f}%  req/s {rps_change:+6.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,4,16,64", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    parser.add_argument("--endpoints", default="guidance,stream", help="comma-separated: guidance, stream")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake LLM time to first token, seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="fake LLM token rate; 0 = instant")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake LLM calls that fail")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="share of requests repeating one prompt")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    app = guidance_app.create_app()
+    app.logger.setLevel(logging.CRITICAL)  # injected errors would flood the output
+    for tier in guidance_app.model_router.tiers.values():
+        tier.llm = FakeChatModel(
+            latency=args.latency, tokens_per_second=args.tokens_per_second, error_rate=args.error_rate, seed=0,
+        )
+    # Every request comes from one address; per-client rate limiting would reject most of them
+    guidance_app.rate_limiter = None
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    results = []
+    try:
+        for endpoint in args.endpoints.split(","):
+            for concurrency in (int(c) for c in args.concurrency.split(",")):
+                result = run_level(base_url, endpoint, concurrency, args)
+                results.append(result)
+                print(json.dumps(result))
+    finally:
+        server.shutdown()
+
+    report = {
+        "benchmark": "guidance",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def canonical_json(data):
+    """Serialises data as compact JSON with sorted keys, so equal dicts give equal strings."""
+    return json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def make_cache_key(messages, model_params):
+    """
+    Builds a cache key from the prompt messages and the model parameters.
+    The key is a SHA-256 hash of the canonical JSON of both.
+    """
+    normalized = {
+        "messages": [[getattr(m, "type", type(m).__name__), m.content] for m in messages],
+        "model": model_params,
+    }
+    return hashlib.sha256(canonical_json(normalized).encode("utf-8")).hexdigest()
+
+
+class InMemoryCacheBackend:
+    """Thread-safe in-process cache with per-entry TTL and size-bounded LRU eviction."""
+
+    def __init__(self, max_size=1024, clock=time.monotonic):
+        self.max_size = max_size
+        self.clock = clock
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (self.clock() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCacheBackend:
+    """
+    Shared cache backend storing entries in Redis, so all workers see the same cache.
+    Expiry is left to Redis; eviction follows the server's maxmemory policy.
+    """
+
+    def __init__(self, client, prefix="guidance:cache:"):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis  # Optional dependency, only needed for the shared backend
+
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(ttl)))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def ping(self):
+        try:
+            return bool(self.client.ping())
+        except Exception:
+            return False
+
+
+class ResponseCache:
+    """Caches LLM responses by prompt key and counts hits and misses."""
+
+    def __init__(self, backend, ttl=3600, enabled=True):
+        self.backend = backend
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if self.enabled:
+            self.backend.set(key, value, self.ttl)
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def ping(self):
+        """Returns whether the backend is reachable; the in-memory backend always is."""
+        ping = getattr(self.backend, "ping", None)
+        return ping() if ping is not None else True
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": getattr(self.backend, "evictions", None),
+        }
+
+
+def create_response_cache_from_env():
+    """
+    Creates the response cache from environment variables:
+    GUIDANCE_CACHE_ENABLED, GUIDANCE_CACHE_TTL, GUIDANCE_CACHE_MAX_SIZE,
+    GUIDANCE_CACHE_BACKEND ("memory" or "redis") and GUIDANCE_CACHE_REDIS_URL.
+    """
+    enabled = os.getenv("GUIDANCE_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+    ttl = float(os.getenv("GUIDANCE_CACHE_TTL", "3600"))
+    backend_name = os.getenv("GUIDANCE_CACHE_BACKEND", "memory").lower()
+
+    if backend_name == "redis":
+        backend = RedisCacheBackend.from_url(os.getenv("GUIDANCE_CACHE_REDIS_URL", "redis://localhost:6379/0"))
+    elif backend_name == "memory":
+        backend = InMemoryCacheBackend(max_size=int(os.getenv("GUIDANCE_CACHE_MAX_SIZE", "1024")))
+    else:
+        raise ValueError(f"Unknown GUIDANCE_CACHE_BACKEND: {backend_name}")
+
+    return ResponseCache(backend, ttl=ttl, enabled=enabled)
@@ -0,0 +1,54 @@
+import os
+
+
+class Config:
+    """
+    Settings of the guidance API, loaded into `app.config` by create_app().
+    The class attributes are the defaults; from_env() overrides them from
+    the environment. The caches, limiters and model tiers read their own
+    settings (see their create_*_from_env functions).
+    """
+
+    TESTING = False
+    OPENAI_API_KEY = None
+    # Retries of upstream rate-limit and transient errors (see invoke_llm)
+    LLM_MAX_RETRIES = 3
+    LLM_RETRY_BASE_DELAY = 0.5
+    # Limits for /api/guidance/batch
+    BATCH_MAX_ITEMS = 100
+    BATCH_MAX_CONCURRENCY = 8
+    # Larger request bodies are refused with 413 before they are parsed (Flask setting)
+    MAX_CONTENT_LENGTH = 256 * 1024
+    # Asynchronous guidance jobs, when GUIDANCE_JOBS_ENABLED is set (see jobs.py)
+    JOBS_WORKERS = 2
+    JOBS_POLL_INTERVAL = 0.5
+    JOBS_RETRY_BASE_DELAY = 2.0
+    # Hosts that job results may be POSTed to
+    JOBS_CALLBACK_HOSTS = ("localhost", "127.0.0.1")
+
+    @classmethod
+    def from_env(cls):
+        config = cls()
+        config.OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+        config.LLM_MAX_RETRIES = int(os.getenv("GUIDANCE_LLM_MAX_RETRIES", str(cls.LLM_MAX_RETRIES)))
+        config.LLM_RETRY_BASE_DELAY = float(os.getenv("GUIDANCE_LLM_RETRY_BASE_DELAY", str(cls.LLM_RETRY_BASE_DELAY)))
+        config.BATCH_MAX_ITEMS = int(os.getenv("GUIDANCE_BATCH_MAX_ITEMS", str(cls.BATCH_MAX_ITEMS)))
+        config.BATCH_MAX_CONCURRENCY = int(os.getenv("GUIDANCE_BATCH_MAX_CONCURRENCY", str(cls.BATCH_MAX_CONCURRENCY)))
+        config.MAX_CONTENT_LENGTH = int(os.getenv("GUIDANCE_MAX_REQUEST_BYTES", str(cls.MAX_CONTENT_LENGTH)))
+        config.JOBS_WORKERS = int(os.getenv("GUIDANCE_JOBS_WORKERS", str(cls.JOBS_WORKERS)))
+        config.JOBS_POLL_INTERVAL = float(os.getenv("GUIDANCE_JOBS_POLL_INTERVAL", str(cls.JOBS_POLL_INTERVAL)))
+        config.JOBS_RETRY_BASE_DELAY = float(os.getenv("GUIDANCE_JOBS_RETRY_BASE_DELAY", str(cls.JOBS_RETRY_BASE_DELAY)))
+        callback_hosts = os.getenv("GUIDANCE_JOBS_CALLBACK_HOSTS")
+        if callback_hosts is not None:
+            config.JOBS_CALLBACK_HOSTS = tuple(host.strip() for host in callback_hosts.split(",") if host.strip())
+        return config
+
+
+class TestingConfig(Config):
+    """Settings for the test suite: no real API key is needed and retries don't sleep."""
+
+    TESTING = True
+    OPENAI_API_KEY = "dummy_test_key"
+    LLM_RETRY_BASE_DELAY = 0.001
+    # Tests run queued jobs themselves
+    JOBS_WORKERS = 0
@@ -0,0 +1,239 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List
+
+from prompts import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def truncate_summary(text, max_tokens):
+    """Cuts a summary down to roughly max_tokens tokens, keeping the end (the most recent part)."""
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    return "…" + text[-(max_chars - 1):]
+
+
+@dataclass
+class Turn:
+    """One message of a conversation: a participant's message or the mediator's guidance."""
+    author: str
+    text: str
+    tokens: int = 0
+
+    def __post_init__(self):
+        if not self.tokens:
+            self.tokens = estimate_tokens(self.format())
+
+    def format(self):
+        return f"{self.author}: {self.text}"
+
+
+def format_transcript(turns):
+    return "\n".join(turn.format() for turn in turns)
+
+
+@dataclass
+class ConversationContext:
+    """What the prompt gets to see of a conversation: the summary of older turns and the recent ones."""
+    summary: str = ""
+    turns: List[Turn] = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.summary or self.turns)
+
+    def format(self):
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of the earlier conversation: {self.summary}")
+        if self.turns:
+            parts.append(f"Recent messages:\n{format_transcript(self.turns)}")
+        return "\n\n".join(parts)
+
+
+class Conversation:
+    def __init__(self, now):
+        self.summary = ""
+        self.turns = []  # rolling window, oldest first
+        self.pending = []  # turns pushed out of the window, not summarized yet
+        self.compacting = False
+        self.updated_at = now
+
+    def window_tokens(self):
+        return sum(turn.tokens for turn in self.turns)
+
+
+class ConversationStore:
+    """
+    Keeps a bounded memory of each group chat's conversation with the mediator.
+
+    The newest turns are kept verbatim in a rolling window of at most
+    `max_turns` turns and `max_tokens` tokens. Turns pushed out of the window
+    are folded into a running summary by `summarizer(summary, turns)`, which
+    gets the previous summary and only the new turns, so no call re-reads the
+    whole history. The summary is capped at `summary_max_tokens`, so the
+    context of a prompt stays bounded however long a dispute goes on.
+
+    Summaries are produced on `executor` when one is given (so compaction
+    doesn't delay the reply), otherwise inline. Until a summary lands, the
+    pushed-out turns are simply left out of the context. Conversations idle
+    for `idle_ttl` seconds are forgotten, as are the least recently active
+    ones beyond `max_conversations`.
+
+    With a `loader(key)` returning a conversation's stored turns, a conversation
+    that isn't in memory (after a restart, or once it was evicted) is reloaded
+    from storage the next time its context is needed.
+    """
+
+    def __init__(self, summarizer, max_turns=20, max_tokens=1500, summary_max_tokens=300,
+                 idle_ttl=6 * 3600, max_conversations=10000, executor=None, loader=None, clock=time.monotonic):
+        self.summarizer = summarizer
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.idle_ttl = idle_ttl
+        self.max_conversations = max_conversations
+        self.executor = executor
+        self.loader = loader
+        self.clock = clock
+        self.reloads = 0
+        self.compactions = 0
+        self.compaction_failures = 0
+        self.evictions = 0
+        self._conversations = OrderedDict()  # key -> Conversation, least recently active first
+        self._lock = threading.Lock()
+
+    def _evict_idle(self, now):
+        while self._conversations:
+            key, conversation = next(iter(self._conversations.items()))
+            if conversation.updated_at + self.idle_ttl > now and len(self._conversations) <= self.max_conversations:
+                break
+            del self._conversations[key]
+            self.evictions += 1
+
+    def context(self, key):
+        """Returns the ConversationContext to include in the next prompt for the conversation."""
+        with self._lock:
+            self._evict_idle(self.clock())
+            conversation = self._conversations.get(key)
+            if conversation is not None:
+                return ConversationContext(conversation.summary, list(conversation.turns))
+        if self.loader is None:
+            return ConversationContext()
+
+        # Load outside the lock; storage reads must not hold up other chats
+        try:
+            turns = self.loader(key)
+        except Exception:
+            logger.exception(f"Failed to reload conversation {key}")
+            turns = []
+        if not turns:
+            return ConversationContext()
+        with self._lock:
+            if key not in self._conversations:
+                self.reloads += 1
+                conversation = self._conversations[key] = Conversation(self.clock())
+                # Reloaded turns beyond the window are dropped, not summarized
+                conversation.turns.extend(turns)
+                self._trim(conversation)
+                conversation.pending.clear()
+            conversation = self._conversations[key]
+            return ConversationContext(conversation.summary, list(conversation.turns))
+
+    def _trim(self, conversation):
+        # Keep at least the newest turn, even if it alone is over the token budget
+        while len(conversation.turns) > 1 and (
+            len(conversation.turns) > self.max_turns or conversation.window_tokens() > self.max_tokens
+        ):
+            conversation.pending.append(conversation.turns.pop(0))
+
+    def record(self, key, *turns):
+        """Appends turns to the conversation, compacting the window if it went over budget."""
+        with self._lock:
+            now = self.clock()
+            conversation = self._conversations.get(key)
+            if conversation is None:
+                conversation = self._conversations[key] = Conversation(now)
+            conversation.updated_at = now
+            self._conversations.move_to_end(key)
+            conversation.turns.extend(turns)
+            self._trim(conversation)
+            self._evict_idle(now)
+
+            if not conversation.pending or conversation.compacting:
+                return
+            conversation.compacting = True
+
+        if self.executor is not None:
+            self.executor.submit(self._compact, key, conversation)
+        else:
+            self._compact(key, conversation)
+
+    def _compact(self, key, conversation):
+        # Summarize in rounds until no turns are waiting, since more may be pushed
+        # out of the window while the summarizer runs
+        while True:
+            with self._lock:
+                summary, turns = conversation.summary, list(conversation.pending)
+                if not turns:
+                    conversation.compacting = False
+                    return
+            try:
+                new_summary = self.summarizer(summary, turns)
+            except Exception:
+                logger.exception(f"Failed to summarize conversation {key}")
+                with self._lock:
+                    self.compaction_failures += 1
+                    # The turns stay pending for the next attempt, within the same budget as the window
+                    while sum(turn.tokens for turn in conversation.pending) > self.max_tokens:
+                        conversation.pending.pop(0)
+                    conversation.compacting = False
+                return
+            with self._lock:
+                conversation.summary = truncate_summary(new_summary.strip(), self.summary_max_tokens)
+                del conversation.pending[:len(turns)]
+                self.compactions += 1
+
+    def clear(self):
+        with self._lock:
+            self._conversations.clear()
+            self.compactions = 0
+            self.compaction_failures = 0
+            self.evictions = 0
+            self.reloads = 0
+
+    def stats(self):
+        return {
+            "conversations": len(self._conversations),
+            "compactions": self.compactions,
+            "compaction_failures": self.compaction_failures,
+            "evictions": self.evictions,
+            "reloads": self.reloads,
+        }
+
+
+def create_conversation_store_from_env(summarizer, executor=None, loader=None):
+    """
+    Creates the conversation memory from environment variables, or returns None
+    when GUIDANCE_CONVERSATION_MEMORY_ENABLED is false. Other settings:
+    GUIDANCE_CONVERSATION_MAX_TURNS, GUIDANCE_CONVERSATION_MAX_TOKENS,
+    GUIDANCE_CONVERSATION_SUMMARY_MAX_TOKENS, GUIDANCE_CONVERSATION_IDLE_TTL
+    and GUIDANCE_CONVERSATION_MAX_CONVERSATIONS.
+    """
+    if os.getenv("GUIDANCE_CONVERSATION_MEMORY_ENABLED", "true").lower() in ("0", "false", "no"):
+        return None
+    return ConversationStore(
+        summarizer,
+        max_turns=int(os.getenv("GUIDANCE_CONVERSATION_MAX_TURNS", "20")),
+        max_tokens=int(os.getenv("GUIDANCE_CONVERSATION_MAX_TOKENS", "1500")),
+        summary_max_tokens=int(os.getenv("GUIDANCE_CONVERSATION_SUMMARY_MAX_TOKENS", "300")),
+        idle_ttl=float(os.getenv("GUIDANCE_CONVERSATION_IDLE_TTL", str(6 * 3600))),
+        max_conversations=int(os.getenv("GUIDANCE_CONVERSATION_MAX_CONVERSATIONS", "10000")),
+        executor=executor,
+        loader=loader,
+    )
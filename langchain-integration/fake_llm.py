@@ -0,0 +1,87 @@
+import random
+import time
+from typing import Any, Iterator, List, Optional
+
+import httpx
+import openai
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Local stand-in for ChatOpenAI used by benchmarks and load tests. It
+    answers after `latency` seconds (time to first token), then produces
+    `response` word by word at `tokens_per_second`, and fails a share
+    `error_rate` of calls with an upstream-style error. Token usage is
+    reported like the real client does, so the metrics stay meaningful.
+    """
+
+    response: str = (
+        "Try to describe the situation from the other person's point of view, "
+        "then propose one small, concrete change you could both agree on this week."
+    )
+    latency: float = 0.0
+    tokens_per_second: float = 0.0  # 0 produces the whole response at once
+    error_rate: float = 0.0
+    error_type: str = "rate_limit"  # "rate_limit" or "server"
+    seed: Optional[int] = None
+    model_name: str = "fake-chat-model"
+    temperature: float = 0.7
+    max_tokens: Optional[int] = None
+
+    _rng: random.Random = PrivateAttr()
+
+    def model_post_init(self, __context: Any) -> None:
+        self._rng = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _tokens(self) -> List[str]:
+        words = self.response.split(" ")
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+    def _maybe_fail(self) -> None:
+        if self.error_rate and self._rng.random() < self.error_rate:
+            request = httpx.Request("POST", "https://fake-llm.local/v1/chat/completions")
+            if self.error_type == "rate_limit":
+                raise openai.RateLimitError(
+                    "Injected rate limit", response=httpx.Response(429, request=request), body=None
+                )
+            raise openai.InternalServerError(
+                "Injected server error", response=httpx.Response(500, request=request), body=None
+            )
+
+    def _usage(self, messages: List[BaseMessage], output_tokens: int) -> dict:
+        # Roughly one token per word, which is close enough for load testing
+        input_tokens = sum(len(str(m.content).split()) for m in messages)
+        return {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        self._maybe_fail()
+        tokens = self._tokens()
+        duration = self.latency + (len(tokens) / self.tokens_per_second if self.tokens_per_second else 0)
+        time.sleep(duration)
+        message = AIMessage(content=self.response, usage_metadata=self._usage(messages, len(tokens)))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        self._maybe_fail()
+        time.sleep(self.latency)
+        tokens = self._tokens()
+        for token in tokens:
+            if self.tokens_per_second:
+                time.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        # Like ChatOpenAI with stream_usage=True, the last chunk carries the usage
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, len(tokens))))
@@ -0,0 +1,28 @@
+"""
+Gunicorn settings for serving the guidance API.
+
+By default this uses gevent workers: every request runs in its own greenlet,
+so while one request is waiting on the LLM the worker keeps serving others.
+A single process can then hold hundreds of in-flight LLM calls and open
+/api/guidance/stream responses instead of one per thread. Set
+GUIDANCE_WORKER_CLASS=gthread (with GUIDANCE_THREADS) for plain threaded
+workers instead.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Workers import the app without touching the LLM (model clients are built on
+first use), so they start and restart quickly; scale out by adding workers or
+containers behind a load balancer that polls /readyz.
+"""
+import os
+
+bind = os.getenv("GUIDANCE_BIND", "0.0.0.0:5001")
+workers = int(os.getenv("GUIDANCE_WORKERS", "2"))
+worker_class = os.getenv("GUIDANCE_WORKER_CLASS", "gevent")
+# Maximum number of simultaneous requests per gevent worker
+worker_connections = int(os.getenv("GUIDANCE_WORKER_CONNECTIONS", "1000"))
+# Threads per gthread worker
+threads = int(os.getenv("GUIDANCE_THREADS", "8"))
+# Streamed completions can take a while; don't kill workers mid-response
+timeout = int(os.getenv("GUIDANCE_WORKER_TIMEOUT", "120"))
+keepalive = 5
@@ -0,0 +1,272 @@
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    callback_url TEXT,
+    request_id TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    lease_expires_at REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available_at);
+"""
+
+
+class JobQueue:
+    """
+    Persistent guidance job queue in a SQLite database, shared by every
+    worker process that opens the same file.
+
+    A claimed job is leased for `lease_seconds`; if its worker dies (or the
+    service restarts) the lease runs out and another worker picks the job up
+    again, so accepted jobs are never lost. Failed attempts are retried up to
+    `max_attempts` times.
+    """
+
+    def __init__(self, path, max_attempts=3, lease_seconds=300, clock=time.time):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+        self._local = threading.local()
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        # One connection per thread; SQLite connections can't be shared across threads
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            # WAL lets readers (status polls) proceed while a worker writes
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    def enqueue(self, payload, callback_url=None, request_id=None):
+        """Adds a job and returns its ID."""
+        job_id = uuid.uuid4().hex
+        now = self.clock()
+        self._connect().execute(
+            "INSERT INTO jobs (id, status, payload, callback_url, request_id, max_attempts, available_at, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, QUEUED, json.dumps(payload), callback_url, request_id, self.max_attempts, now, now, now),
+        )
+        return job_id
+
+    def claim(self):
+        """Leases the oldest job that is ready to run (or whose lease ran out). Returns it as a dict, or None."""
+        db = self._connect()
+        now = self.clock()
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can't claim the same job
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                "SELECT * FROM jobs WHERE (status = ? AND available_at <= ?) OR (status = ? AND lease_expires_at <= ?)"
+                " ORDER BY created_at LIMIT 1",
+                (QUEUED, now, RUNNING, now),
+            ).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            db.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_expires_at = ?, updated_at = ? WHERE id = ?",
+                (RUNNING, now + self.lease_seconds, now, row["id"]),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        job = self._to_dict(row)
+        job["attempts"] += 1
+        job["status"] = RUNNING
+        return job
+
+    def complete(self, job_id, result):
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = NULL, lease_expires_at = NULL, updated_at = ? WHERE id = ?",
+            (SUCCEEDED, json.dumps(result), self.clock(), job_id),
+        )
+
+    def fail(self, job_id, error, retry_after=None):
+        """
+        Records a failed attempt. The job is queued again after `retry_after`
+        seconds, unless that was its last attempt or retry_after is None.
+        Returns the job's new status.
+        """
+        db = self._connect()
+        now = self.clock()
+        row = db.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        if retry_after is not None and row["attempts"] < row["max_attempts"]:
+            status, available_at = QUEUED, now + retry_after
+        else:
+            status, available_at = FAILED, now
+        db.execute(
+            "UPDATE jobs SET status = ?, error = ?, available_at = ?, lease_expires_at = NULL, updated_at = ? WHERE id = ?",
+            (status, str(error), available_at, now, job_id),
+        )
+        return status
+
+    def get(self, job_id):
+        """Returns the job as a dict, or None if there is no such job."""
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def purge(self, older_than):
+        """Deletes finished jobs last updated more than `older_than` seconds ago. Returns how many."""
+        cursor = self._connect().execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+            (SUCCEEDED, FAILED, self.clock() - older_than),
+        )
+        return cursor.rowcount
+
+    def stats(self):
+        counts = {status: 0 for status in (QUEUED, RUNNING, SUCCEEDED, FAILED)}
+        for row in self._connect().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+            counts[row["status"]] = row["n"]
+        return counts
+
+    @staticmethod
+    def _to_dict(row):
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+
+def job_view(job):
+    """The public representation of a job, as returned by the API and sent to callbacks."""
+    view = {"job_id": job["id"], "status": job["status"]}
+    if job["status"] == SUCCEEDED:
+        # Handlers return the guidance, or a dict with the guidance and details about it
+        result = job["result"]
+        view.update(result if isinstance(result, dict) else {"guidance": result})
+    elif job["status"] == FAILED:
+        view["error"] = job["error"]
+    return view
+
+
+class JobWorkerPool:
+    """
+    Threads that take jobs from the queue and run `handler(payload)`.
+
+    `handler` returns the result or raises. An error with a `retry_after`
+    attribute (the admission errors) is retried after that many seconds;
+    other errors after an exponential backoff from `retry_base_delay`.
+    When a job finishes, its callback URL (if any) is sent the job_view.
+    """
+
+    def __init__(self, queue, handler, workers=2, poll_interval=0.5, retry_base_delay=2.0,
+                 purge_after=24 * 3600, notify=None):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.retry_base_delay = retry_base_delay
+        self.purge_after = purge_after
+        self.notify = notify or send_callback
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"guidance-job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5.0):
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        last_purge = 0.0
+        while not self._stopping.is_set():
+            try:
+                if time.monotonic() - last_purge > 3600:
+                    last_purge = time.monotonic()
+                    self.queue.purge(self.purge_after)
+                if not self.run_once():
+                    self._stopping.wait(self.poll_interval)
+            except Exception:
+                logger.exception("Error in guidance job worker")
+                self._stopping.wait(self.poll_interval)
+
+    def run_once(self):
+        """Runs one job if one is ready. Returns whether there was one."""
+        job = self.queue.claim()
+        if job is None:
+            return False
+        try:
+            result = self.handler(job["payload"])
+        except Exception as e:
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after is None:
+                retry_after = self.retry_base_delay * 2 ** (job["attempts"] - 1) * random.uniform(0.5, 1.5)
+            status = self.queue.fail(job["id"], e, retry_after)
+            logger.warning(f"[{job['request_id']}] Guidance job {job['id']} attempt {job['attempts']} failed ({status}): {e}")
+            if status != FAILED:
+                return True
+        else:
+            self.queue.complete(job["id"], result)
+        if job["callback_url"]:
+            self.notify(job["callback_url"], job_view(self.queue.get(job["id"])), job["request_id"])
+        return True
+
+
+def send_callback(url, body, request_id=None, attempts=3):
+    """POSTs a finished job to its callback URL, retrying a few times. Failures are only logged."""
+    headers = {"X-Request-ID": request_id} if request_id else {}
+    for attempt in range(attempts):
+        try:
+            httpx.post(url, json=body, headers=headers, timeout=10).raise_for_status()
+            return True
+        except httpx.HTTPError as e:
+            logger.warning(f"[{request_id}] Callback to {url} failed (attempt {attempt + 1}): {e}")
+            time.sleep(2 ** attempt)
+    return False
+
+
+def callback_allowed(url, allowed_hosts):
+    """Callbacks only go to http(s) URLs on allowed hosts, so clients can't make the service call arbitrary addresses."""
+    parsed = urlparse(url)
+    return parsed.scheme in ("http", "https") and parsed.hostname in allowed_hosts
+
+
+def create_job_queue_from_env():
+    """
+    Creates the job queue from environment variables, or returns None when
+    GUIDANCE_JOBS_ENABLED isn't set. Other settings: GUIDANCE_JOBS_DB_PATH
+    and GUIDANCE_JOBS_MAX_ATTEMPTS.
+    """
+    if os.getenv("GUIDANCE_JOBS_ENABLED", "false").lower() not in ("1", "true", "yes"):
+        return None
+    return JobQueue(
+        os.getenv("GUIDANCE_JOBS_DB_PATH", "guidance_jobs.sqlite3"),
+        max_attempts=int(os.getenv("GUIDANCE_JOBS_MAX_ATTEMPTS", "3")),
+    )
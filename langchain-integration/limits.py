@@ -0,0 +1,213 @@
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+
+class AdmissionError(Exception):
+    """A request was refused before reaching the LLM; clients should retry after `retry_after` seconds."""
+
+    status_code = 503
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Overloaded(AdmissionError):
+    """All LLM slots are busy and the wait queue is full (or the wait timed out)."""
+
+    status_code = 503
+
+
+class RateLimited(AdmissionError):
+    """The client or group chat has exceeded its request rate."""
+
+    status_code = 429
+
+
+class UpstreamUnavailable(AdmissionError):
+    """The LLM provider kept failing (timeouts, connection or server errors) after all retries."""
+
+    status_code = 503
+
+
+class UpstreamRateLimited(UpstreamUnavailable):
+    """The LLM provider kept rate limiting the request after all retries."""
+
+
+class ConcurrencyLimiter:
+    """
+    Caps the number of concurrent LLM calls. Callers beyond the cap wait in a
+    bounded queue; when the queue is full, or a wait exceeds `queue_timeout`,
+    the call is rejected right away with Overloaded instead of piling up.
+    Waiters are served in arrival order, so a caller that just released a slot
+    can't take it again ahead of them. A caller making several calls at once
+    (a batch) asks for up to that many slots; it waits like any other caller
+    for the first one and takes as many as are free then.
+    """
+
+    def __init__(self, max_concurrent=16, max_queue=64, queue_timeout=10.0, retry_after=1.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+        self._queue = deque()  # tickets of waiting callers, oldest first
+
+    def acquire(self, count=1):
+        """Takes between one and `count` slots, waiting for the first if needed; returns the number taken."""
+        with self._cond:
+            # Queue behind existing waiters so they are served first
+            if self.active < self.max_concurrent and self.waiting == 0:
+                taken = min(count, self.max_concurrent - self.active)
+                self.active += taken
+                return taken
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise Overloaded("Too many requests are waiting for the LLM", self.retry_after)
+
+            ticket = object()
+            self._queue.append(ticket)
+            self.waiting += 1
+            try:
+                has_slot = self._cond.wait_for(
+                    lambda: self._queue[0] is ticket and self.active < self.max_concurrent,
+                    timeout=self.queue_timeout,
+                )
+            finally:
+                self._queue.remove(ticket)
+                self.waiting -= 1
+                # The next waiter may be at the head of the queue now
+                self._cond.notify_all()
+            if not has_slot:
+                self.rejected += 1
+                raise Overloaded("Timed out waiting for an LLM slot", self.retry_after)
+            taken = min(count, self.max_concurrent - self.active)
+            self.active += taken
+            return taken
+
+    def release(self, count=1):
+        with self._cond:
+            self.active -= count
+            # Only the oldest waiter may take a slot, so wake them all to find it
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, count=1):
+        """Holds between one and `count` slots; yields the number held."""
+        count = self.acquire(count)
+        try:
+            yield count
+        finally:
+            self.release(count)
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+        }
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+
+    def try_acquire(self):
+        """Takes a token if one is available. Returns (allowed, seconds until the next token)."""
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, 0.0
+        return False, (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Keeps one token bucket per key (client address or group chat), dropping the least recently used keys."""
+
+    def __init__(self, rate=0.5, burst=10, max_keys=10000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self.limited = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, key):
+        """Raises RateLimited if `key` has no request budget left."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, clock=self.clock)
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(key)
+            allowed, retry_after = bucket.try_acquire()
+            if not allowed:
+                self.limited += 1
+                raise RateLimited(f"Rate limit exceeded for {key}", retry_after)
+
+    def stats(self):
+        return {"limited": self.limited, "tracked_keys": len(self._buckets)}
+
+
+def retry_with_backoff(fn, is_retryable, max_retries=3, base_delay=0.5, max_delay=8.0, sleep=time.sleep):
+    """
+    Calls fn(), retrying errors accepted by is_retryable with exponential
+    backoff and full jitter. When the retries are used up on a retryable
+    error, raises UpstreamRateLimited (for an HTTP 429) or UpstreamUnavailable
+    so the client gets a Retry-After.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt)
+            if attempt == max_retries:
+                if getattr(e, "status_code", None) == 429:
+                    raise UpstreamRateLimited(f"LLM provider is rate limiting requests: {e}", delay) from e
+                raise UpstreamUnavailable(f"LLM provider is unavailable: {e}", delay) from e
+            sleep(random.uniform(0, delay))
+
+
+def create_concurrency_limiter_from_env():
+    """
+    Creates the LLM concurrency limiter from GUIDANCE_MAX_CONCURRENT_LLM_CALLS,
+    GUIDANCE_MAX_QUEUED_LLM_CALLS, GUIDANCE_LLM_QUEUE_TIMEOUT and GUIDANCE_RETRY_AFTER.
+    """
+    return ConcurrencyLimiter(
+        max_concurrent=int(os.getenv("GUIDANCE_MAX_CONCURRENT_LLM_CALLS", "16")),
+        max_queue=int(os.getenv("GUIDANCE_MAX_QUEUED_LLM_CALLS", "64")),
+        queue_timeout=float(os.getenv("GUIDANCE_LLM_QUEUE_TIMEOUT", "10")),
+        retry_after=float(os.getenv("GUIDANCE_RETRY_AFTER", "1")),
+    )
+
+
+def create_rate_limiter_from_env():
+    """
+    Creates the per-client rate limiter from GUIDANCE_RATE_LIMIT_PER_SECOND and
+    GUIDANCE_RATE_LIMIT_BURST, or returns None when the rate is 0.
+    """
+    rate = float(os.getenv("GUIDANCE_RATE_LIMIT_PER_SECOND", "0.5"))
+    if rate <= 0:
+        return None
+    return RateLimiter(rate=rate, burst=int(os.getenv("GUIDANCE_RATE_LIMIT_BURST", "10")))
@@ -0,0 +1,118 @@
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Buckets in seconds, from cache hits (sub-millisecond) up to slow completions
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+REQUEST_LATENCY = Histogram(
+    "guidance_request_duration_seconds",
+    "Time to handle an API request (to the response headers for streams)",
+    ["endpoint", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+STREAM_DURATION = Histogram(
+    "guidance_stream_duration_seconds",
+    "Time from request to the end of a streamed guidance response",
+    buckets=LATENCY_BUCKETS,
+)
+LLM_LATENCY = Histogram(
+    "guidance_llm_call_duration_seconds",
+    "Duration of calls to the LLM",
+    ["operation", "tier", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+QUEUE_WAIT = Histogram(
+    "guidance_llm_queue_wait_seconds",
+    "Time spent waiting for an LLM concurrency slot",
+    buckets=LATENCY_BUCKETS,
+)
+PROMPT_TOKENS = Histogram("guidance_prompt_tokens", "Prompt tokens per LLM call", buckets=TOKEN_BUCKETS)
+COMPLETION_TOKENS = Histogram("guidance_completion_tokens", "Completion tokens per LLM call", buckets=TOKEN_BUCKETS)
+
+
+def observe_token_usage(llm_response):
+    """Records prompt/completion token counts reported on an LLM response, when present."""
+    usage = getattr(llm_response, "usage_metadata", None)
+    if not isinstance(usage, dict):
+        return
+    if isinstance(usage.get("input_tokens"), int):
+        PROMPT_TOKENS.observe(usage["input_tokens"])
+    if isinstance(usage.get("output_tokens"), int):
+        COMPLETION_TOKENS.observe(usage["output_tokens"])
+
+
+class ServiceStatsCollector:
+    """
+    Exports the counters kept by the caches, the request coalescer, admission
+    control, model routing, conversation memory, storage and the job queue. `get_stats` returns the same dict as
+    /api/cache/stats and is read at scrape time, so the hot path records
+    nothing extra.
+    """
+
+    def __init__(self, get_stats):
+        self.get_stats = get_stats
+
+    def collect(self):
+        stats = self.get_stats()
+
+        hits = CounterMetricFamily("guidance_cache_hits", "Guidance cache hits", labels=["cache"])
+        misses = CounterMetricFamily("guidance_cache_misses", "Guidance cache misses", labels=["cache"])
+        hit_ratio = GaugeMetricFamily("guidance_cache_hit_ratio", "Share of cache lookups that were hits", labels=["cache"])
+        for cache, cache_stats in (("exact", stats), ("semantic", stats.get("semantic"))):
+            if cache_stats:
+                hits.add_metric([cache], cache_stats["hits"])
+                misses.add_metric([cache], cache_stats["misses"])
+                hit_ratio.add_metric([cache], cache_stats["hit_ratio"])
+        yield hits
+        yield misses
+        yield hit_ratio
+
+        coalescing = stats["coalescing"]
+        yield CounterMetricFamily("guidance_llm_calls", "LLM calls started for uncached requests", value=coalescing["calls"])
+        yield CounterMetricFamily("guidance_coalesced_requests", "Requests that joined an identical in-flight LLM call", value=coalescing["coalesced"])
+
+        admission = stats["admission"]
+        yield GaugeMetricFamily("guidance_llm_slots_active", "LLM concurrency slots in use", value=admission["active"])
+        yield GaugeMetricFamily("guidance_llm_slots_waiting", "Requests queued for an LLM slot", value=admission["waiting"])
+        rejected = CounterMetricFamily("guidance_rejected_requests", "Requests refused by admission control", labels=["reason"])
+        rejected.add_metric(["overloaded"], admission["rejected"])
+        rejected.add_metric(["rate_limited"], stats.get("rate_limit", {}).get("limited", 0))
+        yield rejected
+
+        routing = stats["routing"]
+        routed = CounterMetricFamily("guidance_routed_requests", "Requests routed to each model tier", labels=["tier"])
+        for tier, count in routing["routed"].items():
+            routed.add_metric([tier], count)
+        yield routed
+        fallbacks = CounterMetricFamily("guidance_model_fallbacks", "LLM calls that failed on a tier and fell back", labels=["tier"])
+        for tier, count in routing["fallbacks"].items():
+            fallbacks.add_metric([tier], count)
+        yield fallbacks
+
+        conversations = stats.get("conversations")
+        if conversations:
+            yield GaugeMetricFamily("guidance_conversations", "Group conversations held in memory", value=conversations["conversations"])
+            yield CounterMetricFamily("guidance_conversation_compactions", "Conversation windows folded into the summary", value=conversations["compactions"])
+
+        storage = stats.get("storage")
+        if storage:
+            yield GaugeMetricFamily("guidance_storage_pending_rows", "Rows waiting for the storage writer", value=storage["pending"])
+            yield CounterMetricFamily("guidance_storage_written_rows", "Rows written to storage", value=storage["written"])
+            yield CounterMetricFamily("guidance_storage_dropped_rows", "Rows dropped because the storage queue was full", value=storage["dropped"])
+
+        jobs = stats.get("jobs")
+        if jobs:
+            queued = GaugeMetricFamily("guidance_jobs", "Asynchronous guidance jobs in the queue database", labels=["status"])
+            for status, count in jobs.items():
+                queued.add_metric([status], count)
+            yield queued
+
+
+def register_stats_collector(get_stats):
+    REGISTRY.register(ServiceStatsCollector(get_stats))
+
+
+def render():
+    """Returns (body, content type) of all metrics in the Prometheus text format."""
+    return generate_latest(), CONTENT_TYPE_LATEST
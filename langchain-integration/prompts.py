@@ -0,0 +1,146 @@
+import math
+import os
+import re
+
+from langchain.schema import HumanMessage, SystemMessage
+
+from cache import canonical_json
+
+# Everything up to the onboarding details is identical for every request, so
+# providers that cache prompt prefixes (OpenAI does automatically) can reuse it
+SYSTEM_PROMPT = "You are a helpful assistant for conflict resolution. Your role is to provide initial guidance based on user's onboarding information."
+INSTRUCTIONS = (
+    "Based on the details below, suggest a concise next step or piece of advice "
+    "for them to consider."
+)
+
+# (field, label, token budget), in the order they appear in the prompt. When the
+# total budget runs out, fields further down the list are shortened first.
+KNOWN_FIELDS = (
+    ("user_query", "Message", 500),
+    ("user_info", "From", 20),
+    ("conflict_description", "Conflict", 300),
+    ("parties_involved", "Parties involved", 80),
+    ("relationship_with_parties", "Relationship between the parties", 80),
+    ("attempts_made", "Attempts made so far", 200),
+    ("mediator_preference", "Preferred mediator style", 20),
+    ("desired_outcome", "Desired outcome", 150),
+    ("willing_to_compromise", "Willing to compromise on", 100),
+    ("ideal_resolution_timeframe", "Ideal resolution timeframe", 30),
+)
+# Routing and storage fields that mean nothing to the model. user_id also stays out
+# so user identifiers aren't sent to the provider and identical submissions from
+# different users share cache entries.
+IGNORED_FIELDS = {"context", "group_chat_id", "user_id"}
+# Fields holding a chat transcript (the bot batches group messages one per line,
+# oldest first): line breaks are kept and, when too long, the oldest text is cut
+TRANSCRIPT_FIELDS = {"user_query"}
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (about four characters per token for English text)."""
+    return max(1, math.ceil(len(text) / 4))
+
+
+def truncate_to_tokens(text, max_tokens, keep_end=False):
+    """
+    Cuts text down to roughly max_tokens tokens at a word boundary, marking the cut
+    with an ellipsis. With keep_end the end of the text is kept instead of the start.
+    """
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    if keep_end:
+        cut = text[len(text) - (max_chars - 1):]
+        if " " in cut:
+            cut = cut.split(" ", 1)[1]
+        return "…" + cut
+    cut = text[:max_chars - 1]
+    if " " in cut:
+        cut = cut.rsplit(" ", 1)[0]
+    return cut + "…"
+
+
+def snake_case(name):
+    """Maps the mini app's camelCase keys (conflictDescription) onto the snake_case fields."""
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", name).lower()
+
+
+def render_value(value, multiline=False):
+    """Renders a field value as one compact line, or with multiline as compact non-empty lines."""
+    if isinstance(value, list) and all(isinstance(v, (str, int, float)) for v in value):
+        text = ", ".join(str(v) for v in value)
+    elif isinstance(value, (dict, list)):
+        text = canonical_json(value)
+    else:
+        text = str(value)
+    if multiline:
+        lines = (" ".join(line.split()) for line in text.splitlines())
+        return "\n".join(line for line in lines if line)
+    return " ".join(text.split())
+
+
+class PromptBuilder:
+    """
+    Renders onboarding data into the guidance prompt.
+
+    Known fields become labelled lines in a fixed order, each shortened to
+    its own token budget (transcripts keep their line breaks and newest text); any other fields are collected into one "Other
+    details" line with a budget of `extra_fields_max_tokens`. The details
+    together never exceed `max_tokens`. The system message and the
+    instructions come first and never change, so the variable part of the
+    prompt sits at the end.
+    """
+
+    def __init__(self, max_tokens=1200, extra_fields_max_tokens=150, fields=KNOWN_FIELDS):
+        self.max_tokens = max_tokens
+        self.extra_fields_max_tokens = extra_fields_max_tokens
+        self.fields = fields
+        self.system_message = SystemMessage(content=SYSTEM_PROMPT)
+
+    def render_details(self, onboarding_data):
+        """Returns the onboarding details as labelled lines within the token budgets."""
+        if not isinstance(onboarding_data, dict):
+            onboarding_data = {"details": onboarding_data}
+
+        values = {}
+        for key, value in onboarding_data.items():
+            field = snake_case(str(key))
+            if field in IGNORED_FIELDS or value is None or value == "":
+                continue
+            values[field] = render_value(value, multiline=field in TRANSCRIPT_FIELDS)
+
+        fields = [(field, label, values.pop(field), budget) for field, label, budget in self.fields if field in values]
+        if values:
+            extra = "; ".join(f"{field}: {values[field]}" for field in sorted(values))
+            fields.append((None, "Other details", extra, self.extra_fields_max_tokens))
+
+        lines = []
+        remaining = self.max_tokens
+        for field, label, value, budget in fields:
+            budget = min(budget, remaining - estimate_tokens(f"{label}: "))
+            if budget <= 0:
+                break
+            line = f"{label}: {truncate_to_tokens(value, budget, keep_end=field in TRANSCRIPT_FIELDS)}"
+            lines.append(line)
+            remaining -= estimate_tokens(line)
+        return "\n".join(lines)
+
+    def build(self, onboarding_data, conversation=None):
+        """
+        Builds the chat messages sent to the LLM for the given onboarding data and,
+        for group messages, the ConversationContext of the chat so far.
+        """
+        parts = [INSTRUCTIONS]
+        if conversation:
+            parts.append(f"Earlier in this group chat:\n{conversation.format()}")
+        parts.append(f"Details:\n{self.render_details(onboarding_data)}")
+        return [self.system_message, HumanMessage(content="\n\n".join(parts))]
+
+
+def create_prompt_builder_from_env():
+    """Creates the prompt builder from GUIDANCE_PROMPT_MAX_TOKENS and GUIDANCE_PROMPT_EXTRA_FIELDS_MAX_TOKENS."""
+    return PromptBuilder(
+        max_tokens=int(os.getenv("GUIDANCE_PROMPT_MAX_TOKENS", "1200")),
+        extra_fields_max_tokens=int(os.getenv("GUIDANCE_PROMPT_EXTRA_FIELDS_MAX_TOKENS", "150")),
+    )
@@ -0,0 +1,236 @@
+import logging
+import os
+import threading
+from collections import Counter
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# ChatOpenAI's default model, used by tiers that don't configure one
+DEFAULT_MODEL = "gpt-3.5-turbo"
+
+
+class ModelTier:
+    """
+    A configured chat model that requests can be routed to. With `llm_factory`
+    the model client is only built on first use, so importing the app and
+    starting workers never waits on (or fails for) the LLM client.
+    """
+
+    def __init__(self, name, llm=None, model=None, temperature=None, max_tokens=None, fallback=None, llm_factory=None):
+        self.name = name
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.fallback = fallback  # tier to use when this one times out or fails
+        self.llm_factory = llm_factory
+        self._llm = llm
+        self._lock = threading.Lock()
+
+    @property
+    def llm(self):
+        """The LangChain chat model of the tier, built on first use."""
+        if self._llm is None:
+            with self._lock:
+                if self._llm is None:
+                    self._llm = self.llm_factory()
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm):
+        self._llm = llm
+
+    def cache_params(self):
+        """Model parameters that change the completion; they are part of every cache key."""
+        return {"model": self.model, "temperature": self.temperature, "max_tokens": self.max_tokens}
+
+
+class ModelRouter:
+    """
+    Picks a model tier for each request and falls back to the tier's
+    `fallback` when a call to it fails with an upstream error.
+
+    Group messages of at most `group_max_chars` characters go to
+    `group_tier`; requests whose `mediator_preference` is listed in
+    `mediator_tiers` go to that tier; everything else (full onboarding
+    submissions, long messages) goes to `default_tier`.
+    """
+
+    def __init__(self, tiers, default_tier="standard", group_tier="fast", group_max_chars=500, mediator_tiers=None):
+        self.tiers = {tier.name: tier for tier in tiers}
+        for name in [default_tier, group_tier, *(mediator_tiers or {}).values()]:
+            if name not in self.tiers:
+                raise ValueError(f"Unknown model tier: {name}")
+        for tier in tiers:
+            if tier.fallback is not None and tier.fallback not in self.tiers:
+                raise ValueError(f"Unknown fallback tier {tier.fallback} for model tier {tier.name}")
+        self.default_tier = default_tier
+        self.group_tier = group_tier
+        self.group_max_chars = group_max_chars
+        self.mediator_tiers = mediator_tiers or {}
+        self.routed = Counter()
+        self.fallbacks = Counter()
+        self._lock = threading.Lock()
+
+    def tier(self, name):
+        return self.tiers[name]
+
+    def route(self, onboarding_data):
+        """Returns the ModelTier to generate guidance for the onboarding data with."""
+        name = self.default_tier
+        if isinstance(onboarding_data, dict):
+            user_query = onboarding_data.get('user_query')
+            preference = onboarding_data.get('mediator_preference') or onboarding_data.get('mediatorPreference')
+            if user_query and len(str(user_query)) <= self.group_max_chars:
+                name = self.group_tier
+            elif isinstance(preference, str) and preference.lower() in self.mediator_tiers:
+                name = self.mediator_tiers[preference.lower()]
+        with self._lock:
+            self.routed[name] += 1
+        return self.tiers[name]
+
+    def _fallback_for(self, tier, error, should_fall_back):
+        fallback = self.tiers.get(tier.fallback) if tier.fallback else None
+        if fallback is None or not should_fall_back(error):
+            return None
+        with self._lock:
+            self.fallbacks[tier.name] += 1
+        logger.warning(f"Model tier {tier.name} failed ({error}), falling back to {fallback.name}")
+        return fallback
+
+    def call(self, tier, fn, should_fall_back):
+        """Returns fn(tier), or fn(fallback tier) if that raised an error accepted by should_fall_back."""
+        try:
+            return fn(tier)
+        except Exception as e:
+            fallback = self._fallback_for(tier, e, should_fall_back)
+            if fallback is None:
+                raise
+            return fn(fallback)
+
+    def stream(self, tier, messages, should_fall_back):
+        """
+        Streams the tier's response to messages. Falls back only if the tier fails
+        before producing its first chunk, so a client never gets two half answers.
+        """
+        try:
+            chunks = iter(tier.llm.stream(messages))
+            first = next(chunks)
+        except StopIteration:
+            return
+        except Exception as e:
+            fallback = self._fallback_for(tier, e, should_fall_back)
+            if fallback is None:
+                raise
+            yield from fallback.llm.stream(messages)
+            return
+        yield first
+        yield from chunks
+
+    def batch(self, tier, inputs, should_fall_back, **kwargs):
+        """
+        Runs llm.batch on the tier with return_exceptions=True, then re-runs the
+        items that failed with an error accepted by should_fall_back on the fallback tier.
+        """
+        responses = list(tier.llm.batch(inputs, return_exceptions=True, **kwargs))
+        fallback = self.tiers.get(tier.fallback) if tier.fallback else None
+        failed = [i for i, response in enumerate(responses)
+                  if isinstance(response, Exception) and should_fall_back(response)]
+        if fallback is None or not failed:
+            return responses
+        with self._lock:
+            self.fallbacks[tier.name] += len(failed)
+        logger.warning(f"{len(failed)} batch items failed on model tier {tier.name}, falling back to {fallback.name}")
+        retried = fallback.llm.batch([inputs[i] for i in failed], return_exceptions=True, **kwargs)
+        for i, response in zip(failed, retried):
+            responses[i] = response
+        return responses
+
+    def stats(self):
+        return {
+            "routed": dict(self.routed),
+            "fallbacks": dict(self.fallbacks),
+        }
+
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def shared_http_client():
+    """
+    Returns the HTTP client (and so the connection pool) shared by the model
+    clients of this process, sized by GUIDANCE_LLM_MAX_CONNECTIONS and
+    GUIDANCE_LLM_MAX_KEEPALIVE_CONNECTIONS. It's created on first use, which
+    is after gunicorn forked the worker, so workers never share sockets.
+    """
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = httpx.Client(limits=httpx.Limits(
+                max_connections=int(os.getenv("GUIDANCE_LLM_MAX_CONNECTIONS", "100")),
+                max_keepalive_connections=int(os.getenv("GUIDANCE_LLM_MAX_KEEPALIVE_CONNECTIONS", "20")),
+            ))
+        return _http_client
+
+
+def _tier_from_env(name, defaults):
+    def setting(key, cast):
+        value = os.getenv(f"GUIDANCE_{name.upper()}_{key}", defaults.get(key))
+        return cast(value) if value not in (None, "") else None
+
+    kwargs = {}
+    for key, param, cast in (("MODEL", "model", str), ("TEMPERATURE", "temperature", float),
+                             ("MAX_TOKENS", "max_tokens", int), ("TIMEOUT", "timeout", float)):
+        value = setting(key, cast)
+        if value is not None:
+            kwargs[param] = value
+
+    def create_llm():
+        from langchain_openai import ChatOpenAI
+
+        openai_api_key = os.getenv("OPENAI_API_KEY")
+        if not openai_api_key:
+            raise ValueError("OPENAI_API_KEY not found in environment variables. Make sure it's set in the .env file.")
+        # Retries are done by the app (see invoke_llm), not inside the client, so a
+        # rate-limited call doesn't hold its concurrency slot while backing off.
+        # stream_usage makes streamed responses report token usage too, for the metrics
+        return ChatOpenAI(openai_api_key=openai_api_key, max_retries=0, stream_usage=True,
+                          http_client=shared_http_client(), **kwargs)
+
+    return ModelTier(
+        name,
+        # Without a configured model the client's default is used
+        model=kwargs.get("model", DEFAULT_MODEL),
+        temperature=kwargs.get("temperature"),
+        max_tokens=kwargs.get("max_tokens"),
+        fallback=setting("FALLBACK", str),
+        llm_factory=create_llm,
+    )
+
+
+def create_model_router_from_env():
+    """
+    Creates the "fast" and "standard" model tiers and the router between them.
+    Each tier reads GUIDANCE_<TIER>_MODEL, _TEMPERATURE, _MAX_TOKENS, _TIMEOUT
+    and _FALLBACK (the other tier by default; empty disables fallback).
+    Routing is configured by GUIDANCE_FAST_TIER_MAX_CHARS (longest group message
+    sent to the fast tier) and GUIDANCE_MEDIATOR_TIERS, a comma-separated list of
+    mediator_preference=tier pairs, e.g. "direct=fast,empathetic=standard".
+    """
+    tiers = [
+        _tier_from_env("fast", {"MODEL": "gpt-4o-mini", "MAX_TOKENS": "400", "TIMEOUT": "15", "FALLBACK": "standard"}),
+        # The escalation target: a more capable model than the fast tier's
+        _tier_from_env("standard", {"MODEL": "gpt-4o", "TIMEOUT": "60", "FALLBACK": "fast"}),
+    ]
+    mediator_tiers = {}
+    for pair in os.getenv("GUIDANCE_MEDIATOR_TIERS", "").split(","):
+        if pair.strip():
+            preference, _, tier = pair.partition("=")
+            mediator_tiers[preference.strip().lower()] = tier.strip()
+    return ModelRouter(
+        tiers,
+        group_max_chars=int(os.getenv("GUIDANCE_FAST_TIER_MAX_CHARS", "500")),
+        mediator_tiers=mediator_tiers,
+    )
@@ -0,0 +1,150 @@
+import json
+import os
+from typing import Any, Dict, List, Literal, Optional, Union
+
+from pydantic import (
+    AliasChoices,
+    AliasGenerator,
+    BaseModel,
+    ConfigDict,
+    Discriminator,
+    Field,
+    Tag,
+    TypeAdapter,
+    ValidationError,
+    model_validator,
+)
+from pydantic.alias_generators import to_camel
+from typing_extensions import Annotated
+
+# Size limits, checked before any prompt is built or LLM call made
+MAX_FIELD_CHARS = int(os.getenv("GUIDANCE_MAX_FIELD_CHARS", "4000"))
+MAX_MESSAGE_CHARS = int(os.getenv("GUIDANCE_MAX_MESSAGE_CHARS", "8000"))
+MAX_EXTRA_FIELDS = int(os.getenv("GUIDANCE_MAX_EXTRA_FIELDS", "30"))
+
+FieldText = Annotated[str, Field(max_length=MAX_FIELD_CHARS)]
+ShortText = Annotated[str, Field(max_length=200)]
+# The bot sends the names of everyone in a batch of up to GROUP_BATCH_MAX_MESSAGES
+# messages, and Telegram names can be 64 characters long
+ParticipantsText = Annotated[str, Field(max_length=1000)]
+
+
+class OnboardingData(BaseModel):
+    """
+    An onboarding submission from the mini app. The known fields are accepted
+    in snake_case or camelCase; other details are allowed too, up to
+    MAX_EXTRA_FIELDS of them and MAX_FIELD_CHARS (as JSON) each.
+    """
+
+    model_config = ConfigDict(
+        extra="allow",
+        alias_generator=AliasGenerator(validation_alias=lambda name: AliasChoices(name, to_camel(name))),
+    )
+
+    kind: Literal["onboarding"] = "onboarding"
+    # Telegram user IDs are integers
+    user_id: Optional[Union[int, ShortText]] = None
+    conflict_description: Optional[FieldText] = None
+    parties_involved: Optional[FieldText] = None
+    relationship_with_parties: Optional[FieldText] = None
+    attempts_made: Optional[FieldText] = None
+    mediator_preference: Optional[ShortText] = None
+    desired_outcome: Optional[FieldText] = None
+    willing_to_compromise: Optional[FieldText] = None
+    ideal_resolution_timeframe: Optional[ShortText] = None
+
+    @model_validator(mode="after")
+    def check_details(self):
+        extra = self.model_extra or {}
+        if len(extra) > MAX_EXTRA_FIELDS:
+            raise ValueError(f"at most {MAX_EXTRA_FIELDS} additional fields are allowed")
+        for name, value in extra.items():
+            if len(name) > 100:
+                raise ValueError("field names may be at most 100 characters long")
+            size = len(value) if isinstance(value, str) else len(json.dumps(value, default=str))
+            if size > MAX_FIELD_CHARS:
+                raise ValueError(f"field '{name}' is longer than {MAX_FIELD_CHARS} characters")
+        if not self.payload():
+            raise ValueError("onboarding_data has no details")
+        return self
+
+    def payload(self) -> Dict[str, Any]:
+        """The fields that were sent, as the dict the prompt, routing and caches work on."""
+        return self.model_dump(exclude_unset=True, exclude={"kind"})
+
+
+class GroupMessage(BaseModel):
+    """A group chat message (or transcript of several) forwarded by the bot."""
+
+    model_config = ConfigDict(extra="forbid")
+
+    kind: Literal["group_message"] = "group_message"
+    user_query: Annotated[str, Field(min_length=1, max_length=MAX_MESSAGE_CHARS)]
+    user_info: Optional[ParticipantsText] = None
+    group_chat_id: Union[int, ShortText]
+    # Sent by older bot versions; carries no information
+    context: Optional[ShortText] = None
+
+    def payload(self) -> Dict[str, Any]:
+        return self.model_dump(exclude_unset=True, exclude={"kind"})
+
+
+def request_kind(data):
+    """
+    The discriminator of guidance requests: an explicit "kind", or else a group
+    message when the data has both user_query and group_chat_id.
+    """
+    if isinstance(data, dict):
+        if data.get("kind"):
+            return data["kind"]
+        return "group_message" if data.get("user_query") is not None and data.get("group_chat_id") is not None else "onboarding"
+    return getattr(data, "kind", None)
+
+
+GuidanceInput = Annotated[
+    Union[Annotated[OnboardingData, Tag("onboarding")], Annotated[GroupMessage, Tag("group_message")]],
+    Discriminator(request_kind),
+]
+guidance_input_adapter = TypeAdapter(GuidanceInput)
+
+
+class GuidanceRequest(BaseModel):
+    """Body of POST /api/guidance and /api/guidance/stream."""
+
+    model_config = ConfigDict(populate_by_name=True)
+
+    onboarding_data: GuidanceInput
+    # Job mode (see jobs.py)
+    run_async: bool = Field(False, alias="async")
+    callback_url: Optional[Annotated[str, Field(max_length=2000)]] = None
+
+
+class TokenUsage(BaseModel):
+    input_tokens: int = 0
+    output_tokens: int = 0
+    total_tokens: int = 0
+
+
+class GuidanceResponse(BaseModel):
+    """Body of a successful POST /api/guidance."""
+
+    guidance: str
+    # Model that generated the guidance; unknown for cached answers
+    model: Optional[str] = None
+    # Tokens spent on this request; None when no LLM call was made
+    usage: Optional[TokenUsage] = None
+    cached: bool = False
+    latency_ms: float = 0.0
+
+
+def validate_guidance_input(data) -> Union[OnboardingData, GroupMessage]:
+    """Validates one onboarding_data item, raising ValidationError."""
+    return guidance_input_adapter.validate_python(data)
+
+
+def validation_details(error: ValidationError) -> List[Dict[str, str]]:
+    """A compact, JSON-serialisable description of what failed validation."""
+    return [
+        {"field": ".".join(str(part) for part in e["loc"]), "message": e["msg"]}
+        for e in error.errors(include_url=False, include_input=False)
+    ]
@@ -0,0 +1,243 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class HashingEmbeddings:
+    """
+    Deterministic local embeddings using the hashing trick over words and
+    character trigrams. Needs no network or model download, which makes it
+    suitable for tests and as a cheap default; paraphrases that share most of
+    their words land close together.
+    """
+
+    def __init__(self, dimensions=512):
+        self.dimensions = dimensions
+
+    def _features(self, text):
+        words = re.findall(r"\w+", text.lower())
+        for word in words:
+            yield word, 1.0
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], 0.5
+
+    def embed_query(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature, weight in self._features(text):
+            digest = hashlib.md5(feature.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimensions
+            sign = 1.0 if digest[4] & 1 else -1.0
+            vector[index] += sign * weight
+        return vector
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class BruteForceIndex:
+    """Exact cosine-similarity search over all stored vectors, oldest entries evicted first."""
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # id -> (vector, payload)
+        self._next_id = 0
+        self._matrix = None
+        self._ids = None
+
+    def add(self, vector, payload):
+        self._entries[self._next_id] = (_normalize(vector), payload)
+        self._next_id += 1
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        self._matrix = None
+
+    def search(self, vector):
+        """Returns (similarity, payload) of the closest stored vector, or None if empty."""
+        if not self._entries:
+            return None
+        if self._matrix is None:
+            self._ids = list(self._entries)
+            self._matrix = np.vstack([self._entries[i][0] for i in self._ids])
+        similarities = self._matrix @ _normalize(vector)
+        best = int(np.argmax(similarities))
+        return float(similarities[best]), self._entries[self._ids[best]][1]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LSHIndex:
+    """
+    Approximate cosine-similarity search using random-hyperplane locality
+    sensitive hashing. Only vectors sharing a bucket in at least one table are
+    compared, so lookups stay fast as the index grows, at the cost of
+    occasionally missing a match. When `dimensions` is None the hyperplanes
+    are drawn on the first add, sized to that vector.
+    """
+
+    def __init__(self, dimensions=None, max_size=1000, num_tables=4, num_planes=12, seed=0):
+        self.max_size = max_size
+        self.num_planes = num_planes
+        self.seed = seed
+        self._planes = None
+        self._tables = [dict() for _ in range(num_tables)]  # bucket -> set of ids
+        self._entries = OrderedDict()  # id -> (vector, payload, buckets)
+        self._next_id = 0
+        if dimensions is not None:
+            self._make_planes(dimensions)
+
+    def _make_planes(self, dimensions):
+        rng = np.random.default_rng(self.seed)
+        shape = (len(self._tables), self.num_planes, dimensions)
+        self._planes = rng.standard_normal(shape).astype(np.float32)
+
+    def _buckets(self, vector):
+        bits = (self._planes @ vector) > 0
+        return [row.tobytes() for row in np.packbits(bits, axis=1)]
+
+    def add(self, vector, payload):
+        vector = _normalize(vector)
+        if self._planes is None:
+            self._make_planes(len(vector))
+        buckets = self._buckets(vector)
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (vector, payload, buckets)
+        for table, bucket in zip(self._tables, buckets):
+            table.setdefault(bucket, set()).add(entry_id)
+        while len(self._entries) > self.max_size:
+            self._remove_oldest()
+
+    def _remove_oldest(self):
+        entry_id, (_, _, buckets) = self._entries.popitem(last=False)
+        for table, bucket in zip(self._tables, buckets):
+            ids = table[bucket]
+            ids.discard(entry_id)
+            if not ids:
+                del table[bucket]
+
+    def search(self, vector):
+        """Returns (similarity, payload) of the closest candidate vector, or None if none found."""
+        if self._planes is None:
+            return None
+        vector = _normalize(vector)
+        candidates = set()
+        for table, bucket in zip(self._tables, self._buckets(vector)):
+            candidates |= table.get(bucket, set())
+        if not candidates:
+            return None
+        best_id = max(candidates, key=lambda i: float(self._entries[i][0] @ vector))
+        best_vector, payload, _ = self._entries[best_id]
+        return float(best_vector @ vector), payload
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SemanticCache:
+    """
+    Caches guidance by embedding similarity, with a separate index per scope
+    (the group chat), so a paraphrase of a recent message reuses its answer.
+    """
+
+    def __init__(self, embeddings, index_factory, threshold=0.9, ttl=3600, max_scopes=1000, clock=time.monotonic):
+        self.embeddings = embeddings
+        self.index_factory = index_factory
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_scopes = max_scopes
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._indexes = OrderedDict()  # scope -> index, least recently used first
+        self._lock = threading.Lock()
+
+    def lookup(self, scope, text):
+        """Returns cached guidance for text similar to an earlier query in the scope, or None."""
+        vector = self.embeddings.embed_query(text)
+        with self._lock:
+            index = self._indexes.get(scope)
+            match = index.search(vector) if index is not None else None
+            if match is not None:
+                self._indexes.move_to_end(scope)
+                similarity, (expires_at, guidance) = match
+                if similarity >= self.threshold and expires_at > self.clock():
+                    self.hits += 1
+                    return guidance
+            self.misses += 1
+            return None
+
+    def store(self, scope, text, guidance):
+        vector = self.embeddings.embed_query(text)
+        with self._lock:
+            index = self._indexes.get(scope)
+            if index is None:
+                index = self._indexes[scope] = self.index_factory()
+                while len(self._indexes) > self.max_scopes:
+                    self._indexes.popitem(last=False)
+            self._indexes.move_to_end(scope)
+            index.add(vector, (self.clock() + self.ttl, guidance))
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "scopes": len(self._indexes),
+        }
+
+
+def create_semantic_cache_from_env():
+    """
+    Creates the semantic cache from environment variables, or returns None when
+    GUIDANCE_SEMANTIC_CACHE_ENABLED isn't set. Other settings:
+    GUIDANCE_SEMANTIC_CACHE_EMBEDDINGS ("hashing" or "openai"),
+    GUIDANCE_SEMANTIC_CACHE_INDEX ("bruteforce" or "lsh"),
+    GUIDANCE_SEMANTIC_CACHE_THRESHOLD, GUIDANCE_SEMANTIC_CACHE_TTL and
+    GUIDANCE_SEMANTIC_CACHE_MAX_SIZE (entries per group chat).
+    """
+    if os.getenv("GUIDANCE_SEMANTIC_CACHE_ENABLED", "false").lower() not in ("1", "true", "yes"):
+        return None
+
+    embeddings_name = os.getenv("GUIDANCE_SEMANTIC_CACHE_EMBEDDINGS", "hashing").lower()
+    if embeddings_name == "openai":
+        from langchain_openai import OpenAIEmbeddings
+
+        embeddings = OpenAIEmbeddings()
+    elif embeddings_name == "hashing":
+        embeddings = HashingEmbeddings()
+    else:
+        raise ValueError(f"Unknown GUIDANCE_SEMANTIC_CACHE_EMBEDDINGS: {embeddings_name}")
+
+    max_size = int(os.getenv("GUIDANCE_SEMANTIC_CACHE_MAX_SIZE", "1000"))
+    index_name = os.getenv("GUIDANCE_SEMANTIC_CACHE_INDEX", "bruteforce").lower()
+    if index_name == "bruteforce":
+        index_factory = lambda: BruteForceIndex(max_size=max_size)
+    elif index_name == "lsh":
+        # Sized from the first stored vector, so startup makes no embedding call
+        index_factory = lambda: LSHIndex(max_size=max_size)
+    else:
+        raise ValueError(f"Unknown GUIDANCE_SEMANTIC_CACHE_INDEX: {index_name}")
+
+    return SemanticCache(
+        embeddings,
+        index_factory,
+        threshold=float(os.getenv("GUIDANCE_SEMANTIC_CACHE_THRESHOLD", "0.9")),
+        ttl=float(os.getenv("GUIDANCE_SEMANTIC_CACHE_TTL", "3600")),
+    )
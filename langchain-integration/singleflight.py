@@ -0,0 +1,76 @@
+import threading
+
+
+class Call:
+    """An in-flight call whose result is shared by every request that joined it."""
+
+    def __init__(self, key):
+        self.key = key
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        """Blocks until the leader completes the call, then returns its result or raises its error."""
+        if not self.done.wait(timeout):
+            raise TimeoutError(f"Timed out waiting for in-flight call {self.key!r}")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller (the leader)
+    does the work and every caller that arrives while it runs receives the
+    leader's result instead of starting a duplicate call.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight = {}  # key -> Call
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        """
+        Returns (call, is_leader). The leader must finish the call with
+        complete(); followers get the outcome from call.wait().
+        """
+        with self._lock:
+            call = self._in_flight.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return call, False
+            call = self._in_flight[key] = Call(key)
+            self.calls += 1
+            return call, True
+
+    def complete(self, call, result=None, error=None):
+        """Publishes the leader's outcome to the waiting followers."""
+        with self._lock:
+            if self._in_flight.get(call.key) is call:
+                del self._in_flight[call.key]
+        call.result = result
+        call.error = error
+        call.done.set()
+
+    def do(self, key, fn):
+        """Runs fn() unless a call with the same key is already in flight, and returns its result."""
+        call, is_leader = self.join(key)
+        if not is_leader:
+            return call.wait()
+        try:
+            result = fn()
+        except Exception as e:
+            self.complete(call, error=e)
+            raise
+        self.complete(call, result=result)
+        return result
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+        }
@@ -0,0 +1,301 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT,
+    onboarding_data TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_by_user ON sessions (user_id, created_at);
+CREATE INDEX IF NOT EXISTS sessions_by_age ON sessions (created_at);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    group_chat_id TEXT NOT NULL,
+    author TEXT NOT NULL,
+    text TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_group ON messages (group_chat_id, id);
+CREATE INDEX IF NOT EXISTS messages_by_age ON messages (created_at);
+
+CREATE TABLE IF NOT EXISTS guidance (
+    id INTEGER PRIMARY KEY,
+    cache_key TEXT NOT NULL,
+    user_id TEXT,
+    group_chat_id TEXT,
+    model TEXT,
+    guidance TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS guidance_by_key ON guidance (cache_key, created_at);
+CREATE INDEX IF NOT EXISTS guidance_by_user ON guidance (user_id, created_at);
+CREATE INDEX IF NOT EXISTS guidance_by_group ON guidance (group_chat_id, created_at);
+CREATE INDEX IF NOT EXISTS guidance_by_age ON guidance (created_at);
+"""
+
+
+class SQLiteStorageBackend:
+    """
+    Stores onboarding sessions, group messages and generated guidance in a
+    SQLite database, indexed by user, group chat and cache key.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self):
+        # One connection per thread; the file is only created on first use
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            with self._schema_lock:
+                if not self._schema_ready:
+                    db.executescript(SCHEMA)
+                    self._schema_ready = True
+            self._local.db = db
+        return db
+
+    def write_batch(self, sessions, messages, guidance):
+        """Inserts rows (as tuples in column order, without id) into the three tables in one transaction."""
+        db = self._connect()
+        db.execute("BEGIN")
+        try:
+            if sessions:
+                db.executemany("INSERT INTO sessions (user_id, onboarding_data, created_at) VALUES (?, ?, ?)", sessions)
+            if messages:
+                db.executemany("INSERT INTO messages (group_chat_id, author, text, created_at) VALUES (?, ?, ?, ?)", messages)
+            if guidance:
+                db.executemany(
+                    "INSERT INTO guidance (cache_key, user_id, group_chat_id, model, guidance, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    guidance,
+                )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def find_guidance(self, cache_key, since):
+        """Returns the newest guidance stored for the cache key after `since`, or None."""
+        row = self._connect().execute(
+            "SELECT guidance FROM guidance WHERE cache_key = ? AND created_at >= ? ORDER BY created_at DESC LIMIT 1",
+            (cache_key, since),
+        ).fetchone()
+        return row["guidance"] if row is not None else None
+
+    def recent_messages(self, group_chat_id, limit):
+        """Returns the group's newest messages as (author, text) pairs, oldest first."""
+        rows = self._connect().execute(
+            "SELECT author, text FROM messages WHERE group_chat_id = ? ORDER BY id DESC LIMIT ?",
+            (str(group_chat_id), limit),
+        ).fetchall()
+        return [(row["author"], row["text"]) for row in reversed(rows)]
+
+    def recent_sessions(self, user_id, limit):
+        """Returns the user's newest onboarding submissions, newest first."""
+        rows = self._connect().execute(
+            "SELECT onboarding_data, created_at FROM sessions WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
+            (str(user_id), limit),
+        ).fetchall()
+        return [{"onboarding_data": json.loads(row["onboarding_data"]), "created_at": row["created_at"]} for row in rows]
+
+    def recent_guidance(self, limit, user_id=None, group_chat_id=None):
+        """Returns the newest guidance given to a user or in a group chat, newest first."""
+        column, value = ("user_id", user_id) if user_id is not None else ("group_chat_id", group_chat_id)
+        rows = self._connect().execute(
+            f"SELECT guidance, model, created_at FROM guidance WHERE {column} = ? ORDER BY created_at DESC LIMIT ?",
+            (str(value), limit),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def purge(self, before):
+        """Deletes everything created before `before`. Returns the number of rows deleted."""
+        db = self._connect()
+        deleted = 0
+        for table in ("sessions", "messages", "guidance"):
+            deleted += db.execute(f"DELETE FROM {table} WHERE created_at < ?", (before,)).rowcount
+        return deleted
+
+    def ping(self):
+        try:
+            self._connect().execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+
+class GuidanceStorage:
+    """
+    Persists what the service sees and generates, without slowing requests down.
+
+    The record_* methods only put the row on an in-process queue; a writer
+    thread inserts queued rows in batches of up to `batch_size`, at least every
+    `flush_interval` seconds. When more than `max_pending` rows are waiting the
+    new ones are dropped (and counted), so a slow disk never backs up into
+    requests. Rows older than `retention` seconds are purged by the writer.
+    With `autostart=False` no writer thread is started and flush() must be called.
+    """
+
+    def __init__(self, backend, batch_size=200, flush_interval=0.5, max_pending=10000,
+                 retention=30 * 24 * 3600, purge_interval=3600, autostart=True, clock=time.time):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self.purge_interval = purge_interval
+        self.autostart = autostart
+        self.clock = clock
+        self.written = 0
+        self.dropped = 0
+        self.write_failures = 0
+        self.store_hits = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._writer = None
+        self._last_purge = None
+
+    def _put(self, table, row):
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((table, row))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def record_session(self, user_id, onboarding_data):
+        self._put("sessions", (user_id, json.dumps(onboarding_data, default=str), self.clock()))
+
+    def record_messages(self, group_chat_id, turns):
+        """Stores (author, text) pairs of a group chat, in order."""
+        now = self.clock()
+        for author, text in turns:
+            self._put("messages", (str(group_chat_id), author, text, now))
+
+    def record_guidance(self, cache_key, guidance, user_id=None, group_chat_id=None, model=None):
+        group = str(group_chat_id) if group_chat_id is not None else None
+        self._put("guidance", (cache_key, user_id, group, model, guidance, self.clock()))
+
+    def find_guidance(self, cache_key, max_age):
+        """Returns stored guidance for the cache key at most max_age seconds old, or None."""
+        try:
+            guidance = self.backend.find_guidance(cache_key, self.clock() - max_age)
+        except Exception:
+            logger.exception("Failed to look up stored guidance")
+            return None
+        if guidance is not None:
+            with self._lock:
+                self.store_hits += 1
+        return guidance
+
+    def recent_messages(self, group_chat_id, limit):
+        try:
+            return self.backend.recent_messages(group_chat_id, limit)
+        except Exception:
+            logger.exception(f"Failed to load stored messages of group {group_chat_id}")
+            return []
+
+    def _ensure_writer(self):
+        if self._writer is None and self.autostart:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._run, name="guidance-storage-writer", daemon=True)
+                    self._writer.start()
+
+    def _run(self):
+        while True:
+            self.flush(timeout=self.flush_interval)
+            self.purge_expired()
+
+    def flush(self, timeout=0.0):
+        """
+        Writes one batch of queued rows, waiting up to `timeout` seconds for the
+        first one. Returns the number of rows taken from the queue.
+        """
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        if batch:
+            tables = {"sessions": [], "messages": [], "guidance": []}
+            for table, row in batch:
+                tables[table].append(row)
+            try:
+                self.backend.write_batch(tables["sessions"], tables["messages"], tables["guidance"])
+                with self._lock:
+                    self.written += len(batch)
+            except Exception:
+                logger.exception(f"Failed to store {len(batch)} rows")
+                with self._lock:
+                    self.write_failures += len(batch)
+        return len(batch)
+
+    def purge_expired(self):
+        """Deletes rows older than the retention period, at most once every `purge_interval` seconds."""
+        now = self.clock()
+        if not self.retention or (self._last_purge is not None and now - self._last_purge < self.purge_interval):
+            return
+        self._last_purge = now
+        try:
+            self.backend.purge(now - self.retention)
+        except Exception:
+            logger.exception("Failed to purge expired rows")
+
+    def close(self):
+        """Writes every row still queued; called at exit so a graceful shutdown loses nothing."""
+        while self.flush():
+            pass
+
+    def ping(self):
+        return self.backend.ping()
+
+    def stats(self):
+        return {
+            "backend": type(self.backend).__name__,
+            "pending": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "write_failures": self.write_failures,
+            "store_hits": self.store_hits,
+        }
+
+
+def create_storage_from_env():
+    """
+    Creates the storage layer from environment variables, or returns None when
+    GUIDANCE_STORAGE_BACKEND is "none". Other settings: GUIDANCE_STORAGE_PATH,
+    GUIDANCE_STORAGE_RETENTION_DAYS, GUIDANCE_STORAGE_BATCH_SIZE,
+    GUIDANCE_STORAGE_FLUSH_INTERVAL and GUIDANCE_STORAGE_MAX_PENDING.
+    """
+    backend_name = os.getenv("GUIDANCE_STORAGE_BACKEND", "sqlite").lower()
+    if backend_name == "none":
+        return None
+    if backend_name == "sqlite":
+        backend = SQLiteStorageBackend(os.getenv("GUIDANCE_STORAGE_PATH", "guidance.sqlite3"))
+    else:
+        raise ValueError(f"Unknown GUIDANCE_STORAGE_BACKEND: {backend_name}")
+
+    return GuidanceStorage(
+        backend,
+        batch_size=int(os.getenv("GUIDANCE_STORAGE_BATCH_SIZE", "200")),
+        flush_interval=float(os.getenv("GUIDANCE_STORAGE_FLUSH_INTERVAL", "0.5")),
+        max_pending=int(os.getenv("GUIDANCE_STORAGE_MAX_PENDING", "10000")),
+        retention=float(os.getenv("GUIDANCE_STORAGE_RETENTION_DAYS", "30")) * 24 * 3600,
+    )
@@ -0,0 +1,127 @@
+import pytest
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from langchain_core.messages import SystemMessage, HumanMessage
+from cache import (
+    InMemoryCacheBackend,
+    RedisCacheBackend,
+    ResponseCache,
+    canonical_json,
+    create_response_cache_from_env,
+    make_cache_key,
+)
+
+
+class FakeClock:
+    """Manually advanced clock for TTL tests."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRedis:
+    """Minimal in-memory stand-in for the redis client methods the backend uses."""
+
+    def __init__(self):
+        self.store = {}
+        self.expiry = {}
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, value, ex=None):
+        self.store[key] = value.encode()
+        self.expiry[key] = ex
+
+    def scan_iter(self, match):
+        prefix = match.rstrip("*")
+        return [k for k in self.store if k.startswith(prefix)]
+
+    def delete(self, *keys):
+        for key in keys:
+            self.store.pop(key, None)
+
+
+def test_canonical_json_ignores_key_order():
+    assert canonical_json({"b": 1, "a": {"d": 2, "c": 3}}) == canonical_json({"a": {"c": 3, "d": 2}, "b": 1})
+
+
+def test_cache_key_depends_on_prompt_and_model():
+    messages = [SystemMessage(content="system"), HumanMessage(content="hello")]
+    params = {"model": "gpt-3.5-turbo", "temperature": 0.7}
+
+    assert make_cache_key(messages, params) == make_cache_key(list(messages), dict(params))
+    assert make_cache_key(messages, params) != make_cache_key(messages, {**params, "temperature": 0.2})
+    assert make_cache_key(messages, params) != make_cache_key([messages[0], HumanMessage(content="hi")], params)
+
+
+def test_in_memory_backend_expires_entries():
+    clock = FakeClock()
+    backend = InMemoryCacheBackend(clock=clock)
+    backend.set("key", "value", ttl=10)
+
+    clock.now = 9.9
+    assert backend.get("key") == "value"
+    clock.now = 10.0
+    assert backend.get("key") is None
+    assert len(backend) == 0
+
+
+def test_in_memory_backend_evicts_least_recently_used():
+    backend = InMemoryCacheBackend(max_size=2)
+    backend.set("a", 1, ttl=60)
+    backend.set("b", 2, ttl=60)
+    backend.get("a")  # "b" is now the least recently used entry
+    backend.set("c", 3, ttl=60)
+
+    assert backend.get("a") == 1
+    assert backend.get("b") is None
+    assert backend.get("c") == 3
+    assert backend.evictions == 1
+
+
+def test_response_cache_counts_hits_and_misses():
+    cache = ResponseCache(InMemoryCacheBackend(), ttl=60)
+    assert cache.get("key") is None
+    cache.set("key", "guidance")
+    assert cache.get("key") == "guidance"
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_ratio"] == 0.5
+
+
+def test_disabled_response_cache_never_stores():
+    cache = ResponseCache(InMemoryCacheBackend(), ttl=60, enabled=False)
+    cache.set("key", "guidance")
+    assert cache.get("key") is None
+    assert cache.stats()["misses"] == 0
+
+
+def test_redis_backend_round_trip():
+    client = FakeRedis()
+    backend = RedisCacheBackend(client, prefix="test:")
+    backend.set("key", "guidance", ttl=30.5)
+
+    assert backend.get("key") == "guidance"
+    assert client.expiry["test:key"] == 30
+    backend.clear()
+    assert backend.get("key") is None
+
+
+def test_create_response_cache_from_env(monkeypatch):
+    monkeypatch.setenv("GUIDANCE_CACHE_TTL", "5")
+    monkeypatch.setenv("GUIDANCE_CACHE_MAX_SIZE", "3")
+    cache = create_response_cache_from_env()
+    assert cache.ttl == 5
+    assert cache.backend.max_size == 3
+
+    monkeypatch.setenv("GUIDANCE_CACHE_BACKEND", "memcached")
+    with pytest.raises(ValueError):
+        create_response_cache_from_env()
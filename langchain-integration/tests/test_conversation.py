@@ -0,0 +1,202 @@
+import os
+import sys
+import threading
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from conversation import (
+    ConversationContext,
+    ConversationStore,
+    Turn,
+    create_conversation_store_from_env,
+    estimate_tokens,
+)
+
+
+class FakeClock:
+    """Manually advanced clock for idle-eviction tests."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class RecordingSummarizer:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, summary, turns):
+        self.calls.append((summary, [turn.text for turn in turns]))
+        return f"{summary} +{len(turns)}".strip()
+
+
+def test_context_is_empty_for_unknown_conversation():
+    store = ConversationStore(RecordingSummarizer())
+    context = store.context("group:1")
+    assert not context
+    assert context.format() == ""
+
+
+def test_record_keeps_turns_in_order():
+    store = ConversationStore(RecordingSummarizer())
+    store.record("group:1", Turn("alice", "hi"), Turn("Mediator", "hello"))
+
+    context = store.context("group:1")
+    assert [turn.format() for turn in context.turns] == ["alice: hi", "Mediator: hello"]
+    assert context.format() == "Recent messages:\nalice: hi\nMediator: hello"
+
+
+def test_window_overflow_is_summarized_incrementally():
+    summarizer = RecordingSummarizer()
+    store = ConversationStore(summarizer, max_turns=2)
+
+    store.record("group:1", Turn("alice", "one"), Turn("bob", "two"))
+    store.record("group:1", Turn("alice", "three"))
+    store.record("group:1", Turn("bob", "four"))
+
+    # Each compaction only sees the previous summary and the turns that just left the window
+    assert summarizer.calls == [("", ["one"]), ("+1", ["two"])]
+    context = store.context("group:1")
+    assert context.summary == "+1 +1"
+    assert [turn.text for turn in context.turns] == ["three", "four"]
+
+
+def test_window_is_bounded_by_tokens():
+    store = ConversationStore(RecordingSummarizer(), max_turns=100, max_tokens=20)
+    for i in range(50):
+        store.record("group:1", Turn("alice", f"message number {i}"))
+
+    context = store.context("group:1")
+    assert sum(turn.tokens for turn in context.turns) <= 20
+    assert context.turns[-1].text == "message number 49"
+
+
+def test_summary_is_capped():
+    store = ConversationStore(lambda summary, turns: "word " * 1000, max_turns=1, summary_max_tokens=10)
+    store.record("group:1", Turn("alice", "one"), Turn("bob", "two"))
+    assert estimate_tokens(store.context("group:1").summary) <= 10
+
+
+def test_failed_summary_is_retried_with_next_compaction():
+    calls = []
+
+    def flaky_summarizer(summary, turns):
+        calls.append([turn.text for turn in turns])
+        if len(calls) == 1:
+            raise RuntimeError("LLM down")
+        return "summary"
+
+    store = ConversationStore(flaky_summarizer, max_turns=1)
+    store.record("group:1", Turn("alice", "one"), Turn("bob", "two"))
+    assert store.stats()["compaction_failures"] == 1
+    assert store.context("group:1").summary == ""
+
+    store.record("group:1", Turn("alice", "three"))
+    assert calls == [["one"], ["one", "two"]]
+    assert store.context("group:1").summary == "summary"
+
+
+def test_compaction_runs_on_executor():
+    submitted = []
+
+    class DeferredExecutor:
+        def submit(self, fn, *args):
+            submitted.append((fn, args))
+
+    summarizer = RecordingSummarizer()
+    store = ConversationStore(summarizer, max_turns=1, executor=DeferredExecutor())
+    store.record("group:1", Turn("alice", "one"), Turn("bob", "two"))
+    store.record("group:1", Turn("alice", "three"))
+
+    # Only one compaction is scheduled at a time; it picks up everything pending when it runs
+    assert len(submitted) == 1
+    assert summarizer.calls == []
+    fn, args = submitted[0]
+    fn(*args)
+    assert summarizer.calls == [("", ["one", "two"])]
+    assert store.context("group:1").summary == "+2"
+
+
+def test_missing_conversation_is_reloaded_within_window():
+    summarizer = RecordingSummarizer()
+    loads = []
+
+    def loader(key):
+        loads.append(key)
+        return [Turn("alice", f"stored {i}") for i in range(5)] if key == "group:1" else []
+
+    store = ConversationStore(summarizer, max_turns=3, loader=loader)
+
+    context = store.context("group:1")
+    assert [turn.text for turn in context.turns] == ["stored 2", "stored 3", "stored 4"]
+    assert summarizer.calls == []  # reloaded turns are trimmed, not summarized
+    store.context("group:1")
+    assert loads == ["group:1"]  # only reloaded while not in memory
+
+    assert not store.context("group:2")
+    assert store.stats()["reloads"] == 1
+
+
+def test_failing_loader_gives_empty_context():
+    def loader(key):
+        raise RuntimeError("database locked")
+
+    store = ConversationStore(RecordingSummarizer(), loader=loader)
+
+    assert not store.context("group:1")
+
+
+def test_idle_conversations_are_evicted():
+    clock = FakeClock()
+    store = ConversationStore(RecordingSummarizer(), idle_ttl=60, clock=clock)
+    store.record("group:1", Turn("alice", "hi"))
+    clock.now = 30
+    store.record("group:2", Turn("bob", "hi"))
+
+    clock.now = 61
+    assert not store.context("group:1")
+    assert store.context("group:2")
+    assert store.stats()["evictions"] == 1
+
+
+def test_least_recently_active_conversations_are_evicted_beyond_max():
+    store = ConversationStore(RecordingSummarizer(), max_conversations=2)
+    for key in ("group:1", "group:2", "group:1", "group:3"):
+        store.record(key, Turn("alice", "hi"))
+
+    assert store.context("group:1")
+    assert not store.context("group:2")
+    assert store.stats()["conversations"] == 2
+
+
+def test_concurrent_records_keep_every_turn():
+    store = ConversationStore(RecordingSummarizer(), max_turns=1000, max_tokens=100000)
+
+    def worker(name):
+        for i in range(50):
+            store.record("group:1", Turn(name, str(i)))
+
+    threads = [threading.Thread(target=worker, args=(f"user{n}",)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(store.context("group:1").turns) == 200
+
+
+def test_context_format_includes_summary_first():
+    context = ConversationContext("They argue about rent.", [Turn("alice", "pay up")])
+    assert context.format() == "Summary of the earlier conversation: They argue about rent.\n\nRecent messages:\nalice: pay up"
+
+
+def test_create_conversation_store_from_env(monkeypatch):
+    monkeypatch.setenv("GUIDANCE_CONVERSATION_MAX_TURNS", "5")
+    monkeypatch.setenv("GUIDANCE_CONVERSATION_IDLE_TTL", "120")
+    store = create_conversation_store_from_env(RecordingSummarizer())
+    assert store.max_turns == 5
+    assert store.idle_ttl == 120
+
+    monkeypatch.setenv("GUIDANCE_CONVERSATION_MEMORY_ENABLED", "false")
+    assert create_conversation_store_from_env(RecordingSummarizer()) is None
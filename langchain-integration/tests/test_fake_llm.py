@@ -0,0 +1,65 @@
+import pytest
+import os
+import sys
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import openai
+from langchain.schema import HumanMessage, SystemMessage
+
+from fake_llm import FakeChatModel
+
+MESSAGES = [SystemMessage(content="Be helpful"), HumanMessage(content="How do we stop arguing")]
+
+
+def test_invoke_returns_response_with_usage():
+    model = FakeChatModel(response="Talk it through calmly")
+    result = model.invoke(MESSAGES)
+
+    assert result.content == "Talk it through calmly"
+    assert result.usage_metadata == {"input_tokens": 7, "output_tokens": 4, "total_tokens": 11}
+
+
+def test_invoke_waits_for_latency():
+    model = FakeChatModel(latency=0.05)
+    started = time.perf_counter()
+    model.invoke(MESSAGES)
+    assert time.perf_counter() - started >= 0.05
+
+
+def test_stream_yields_tokens_and_usage_last():
+    model = FakeChatModel(response="Talk it through")
+    chunks = list(model.stream(MESSAGES))
+
+    assert "".join(chunk.content for chunk in chunks) == "Talk it through"
+    assert [chunk.content for chunk in chunks[:3]] == ["Talk", " it", " through"]
+    assert chunks[-1].usage_metadata["output_tokens"] == 3
+
+
+@pytest.mark.parametrize("error_type, error_class", [
+    ("rate_limit", openai.RateLimitError),
+    ("server", openai.InternalServerError),
+])
+def test_injects_errors(error_type, error_class):
+    model = FakeChatModel(error_rate=1.0, error_type=error_type)
+    with pytest.raises(error_class):
+        model.invoke(MESSAGES)
+    with pytest.raises(error_class):
+        list(model.stream(MESSAGES))
+
+
+def test_error_rate_is_reproducible_with_seed():
+    def outcomes(seed):
+        model = FakeChatModel(error_rate=0.5, seed=seed)
+        results = []
+        for _ in range(20):
+            try:
+                model.invoke(MESSAGES)
+                results.append(True)
+            except openai.RateLimitError:
+                results.append(False)
+        return results
+
+    first = outcomes(7)
+    assert first == outcomes(7)
+    assert True in first and False in first
@@ -0,0 +1,189 @@
+import pytest
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from jobs import (
+    FAILED,
+    QUEUED,
+    RUNNING,
+    SUCCEEDED,
+    JobQueue,
+    JobWorkerPool,
+    callback_allowed,
+    create_job_queue_from_env,
+    job_view,
+)
+from limits import Overloaded
+
+
+class FakeClock:
+    """Manually advanced clock for lease and retry tests."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), max_attempts=3, lease_seconds=60, clock=clock)
+
+
+def test_enqueue_claim_complete(queue):
+    """Test that a job goes from queued to running to succeeded."""
+    job_id = queue.enqueue({"user_story": "Story"}, callback_url="http://localhost/cb", request_id="req-1")
+    assert queue.get(job_id)["status"] == QUEUED
+
+    job = queue.claim()
+    assert job["id"] == job_id
+    assert job["payload"] == {"user_story": "Story"}
+    assert job["attempts"] == 1
+    assert job["request_id"] == "req-1"
+    assert queue.get(job_id)["status"] == RUNNING
+    assert queue.claim() is None
+
+    queue.complete(job_id, "Guidance")
+
+    assert job_view(queue.get(job_id)) == {"job_id": job_id, "status": SUCCEEDED, "guidance": "Guidance"}
+    assert queue.stats() == {QUEUED: 0, RUNNING: 0, SUCCEEDED: 1, FAILED: 0}
+
+
+def test_jobs_are_claimed_oldest_first(queue, clock):
+    """Test that jobs are processed in the order they were queued."""
+    first = queue.enqueue({"n": 1})
+    clock.now += 1
+    second = queue.enqueue({"n": 2})
+
+    assert queue.claim()["id"] == first
+    assert queue.claim()["id"] == second
+
+
+def test_failed_job_is_retried_after_delay(queue, clock):
+    """Test that a failed attempt is queued again, and fails for good after max_attempts."""
+    job_id = queue.enqueue({"n": 1})
+
+    for attempt in range(1, 3):
+        job = queue.claim()
+        assert job["attempts"] == attempt
+        assert queue.fail(job_id, "Upstream error", retry_after=10) == QUEUED
+        assert queue.claim() is None  # not before the delay
+        clock.now += 10
+
+    queue.claim()
+    assert queue.fail(job_id, "Upstream error", retry_after=10) == FAILED
+    assert job_view(queue.get(job_id)) == {"job_id": job_id, "status": FAILED, "error": "Upstream error"}
+
+
+def test_expired_lease_is_reclaimed(queue, clock):
+    """Test that a job whose worker died is picked up again once its lease runs out."""
+    job_id = queue.enqueue({"n": 1})
+    queue.claim()
+
+    clock.now += 59
+    assert queue.claim() is None
+    clock.now += 1
+    job = queue.claim()
+
+    assert job["id"] == job_id
+    assert job["attempts"] == 2
+
+
+def test_jobs_survive_reopening_the_queue(tmp_path, clock):
+    """Test that queued jobs are kept in the database across restarts."""
+    path = str(tmp_path / "jobs.sqlite3")
+    job_id = JobQueue(path, clock=clock).enqueue({"n": 1})
+
+    assert JobQueue(path, clock=clock).claim()["id"] == job_id
+
+
+def test_purge_removes_old_finished_jobs(queue, clock):
+    """Test that purge deletes finished jobs only."""
+    done = queue.enqueue({"n": 1})
+    queue.claim()
+    queue.complete(done, "Guidance")
+    waiting = queue.enqueue({"n": 2})
+    clock.now += 100
+
+    assert queue.purge(older_than=50) == 1
+    assert queue.get(done) is None
+    assert queue.get(waiting) is not None
+
+
+def test_worker_runs_job_and_sends_callback(queue):
+    """Test that a worker stores the handler's result and notifies the callback URL."""
+    notified = []
+    pool = JobWorkerPool(queue, lambda payload: f"Guidance for {payload['n']}",
+                         notify=lambda url, body, request_id: notified.append((url, body, request_id)))
+    job_id = queue.enqueue({"n": 1}, callback_url="http://localhost/cb", request_id="req-1")
+
+    assert pool.run_once() is True
+    assert pool.run_once() is False
+
+    expected = {"job_id": job_id, "status": SUCCEEDED, "guidance": "Guidance for 1"}
+    assert job_view(queue.get(job_id)) == expected
+    assert notified == [("http://localhost/cb", expected, "req-1")]
+
+
+def test_worker_retries_then_fails_job(queue, clock):
+    """Test that handler errors are retried with backoff and the callback only hears the final failure."""
+    notified = []
+
+    def handler(payload):
+        raise RuntimeError("LLM down")
+
+    pool = JobWorkerPool(queue, handler, retry_base_delay=1.0,
+                         notify=lambda url, body, request_id: notified.append(body))
+    job_id = queue.enqueue({"n": 1}, callback_url="http://localhost/cb")
+
+    for _ in range(2):
+        assert pool.run_once() is True
+        assert queue.get(job_id)["status"] == QUEUED
+        assert notified == []
+        clock.now += 10
+    pool.run_once()
+
+    assert notified == [{"job_id": job_id, "status": FAILED, "error": "LLM down"}]
+
+
+def test_worker_uses_retry_after_of_admission_errors(queue, clock):
+    """Test that a job refused by admission control is retried when the limiter says so."""
+    def handler(payload):
+        raise Overloaded("Busy", retry_after=30)
+
+    pool = JobWorkerPool(queue, handler)
+    job_id = queue.enqueue({"n": 1})
+
+    pool.run_once()
+
+    assert queue.get(job_id)["available_at"] == clock.now + 30
+
+
+def test_callback_allowed():
+    """Test that callbacks only go to http(s) URLs on allowed hosts."""
+    hosts = ("localhost", "127.0.0.1")
+    assert callback_allowed("http://localhost:8080/jobs", hosts)
+    assert callback_allowed("https://127.0.0.1/jobs", hosts)
+    assert not callback_allowed("http://169.254.169.254/latest", hosts)
+    assert not callback_allowed("file:///etc/passwd", hosts)
+
+
+def test_create_job_queue_from_env(monkeypatch, tmp_path):
+    """Test that job mode is off by default and configured from the environment."""
+    monkeypatch.delenv("GUIDANCE_JOBS_ENABLED", raising=False)
+    assert create_job_queue_from_env() is None
+
+    monkeypatch.setenv("GUIDANCE_JOBS_ENABLED", "true")
+    monkeypatch.setenv("GUIDANCE_JOBS_DB_PATH", str(tmp_path / "env.sqlite3"))
+    monkeypatch.setenv("GUIDANCE_JOBS_MAX_ATTEMPTS", "5")
+    queue = create_job_queue_from_env()
+
+    assert queue.path == str(tmp_path / "env.sqlite3")
+    assert queue.max_attempts == 5
@@ -0,0 +1,197 @@
+import pytest
+import os
+import sys
+import threading
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from limits import (
+    ConcurrencyLimiter,
+    Overloaded,
+    RateLimited,
+    RateLimiter,
+    TokenBucket,
+    UpstreamRateLimited,
+    UpstreamUnavailable,
+    create_rate_limiter_from_env,
+    retry_with_backoff,
+)
+
+
+class FakeClock:
+    """Manually advanced clock for rate tests."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_limiter_rejects_when_queue_is_full():
+    limiter = ConcurrencyLimiter(max_concurrent=1, max_queue=0, retry_after=3)
+    limiter.acquire()
+    with pytest.raises(Overloaded) as excinfo:
+        limiter.acquire()
+    assert excinfo.value.retry_after == 3
+    assert excinfo.value.status_code == 503
+    limiter.release()
+    limiter.acquire()
+
+
+def test_limiter_times_out_queued_callers():
+    limiter = ConcurrencyLimiter(max_concurrent=1, max_queue=1, queue_timeout=0.01)
+    limiter.acquire()
+    with pytest.raises(Overloaded):
+        limiter.acquire()
+    assert limiter.stats()["waiting"] == 0
+    assert limiter.stats()["rejected"] == 1
+
+
+def test_limiter_takes_the_free_slots_up_to_count():
+    limiter = ConcurrencyLimiter(max_concurrent=4, max_queue=0)
+    limiter.acquire()
+
+    with limiter.slot(10) as held:
+        assert held == 3
+        assert limiter.stats()["active"] == 4
+        with pytest.raises(Overloaded):
+            limiter.acquire(2)
+    limiter.release()
+    with limiter.slot(2) as held:
+        assert held == 2
+    assert limiter.stats()["active"] == 0
+
+
+def test_multi_slot_caller_is_not_starved_by_single_calls():
+    """Test that a batch gets slots while single calls keep every slot busy."""
+    limiter = ConcurrencyLimiter(max_concurrent=4, max_queue=16, queue_timeout=2)
+    stop = threading.Event()
+
+    def single_calls():
+        while not stop.is_set():
+            with limiter.slot():
+                time.sleep(0.001)
+
+    threads = [threading.Thread(target=single_calls) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    try:
+        with limiter.slot(4) as held:
+            assert 1 <= held <= 4
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    assert limiter.stats()["rejected"] == 0
+    assert limiter.stats()["active"] == 0
+
+
+def test_limiter_hands_slot_to_queued_caller():
+    limiter = ConcurrencyLimiter(max_concurrent=1, max_queue=1, queue_timeout=5)
+    limiter.acquire()
+    acquired = threading.Event()
+
+    def waiter():
+        with limiter.slot():
+            acquired.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    deadline = time.monotonic() + 2
+    while limiter.waiting == 0 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert not acquired.is_set()
+
+    limiter.release()
+    thread.join(timeout=2)
+    assert acquired.is_set()
+    assert limiter.stats()["active"] == 0
+
+
+def test_token_bucket_refills_over_time():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+    assert bucket.try_acquire() == (True, 0.0)
+    assert bucket.try_acquire() == (True, 0.0)
+    allowed, retry_after = bucket.try_acquire()
+    assert not allowed
+    assert retry_after == pytest.approx(0.5)
+
+    clock.now = 0.5
+    assert bucket.try_acquire()[0]
+
+
+def test_rate_limiter_tracks_keys_separately():
+    limiter = RateLimiter(rate=1, burst=1, clock=FakeClock())
+    limiter.check("group:1")
+    limiter.check("group:2")
+    with pytest.raises(RateLimited) as excinfo:
+        limiter.check("group:1")
+    assert excinfo.value.status_code == 429
+    assert limiter.stats() == {"limited": 1, "tracked_keys": 2}
+
+
+def test_rate_limiter_forgets_least_recently_used_keys():
+    limiter = RateLimiter(rate=1, burst=1, max_keys=1, clock=FakeClock())
+    limiter.check("a")
+    limiter.check("b")
+    limiter.check("a")  # "a" was evicted, so it starts with a full bucket again
+
+
+def test_retry_with_backoff_retries_retryable_errors():
+    attempts = []
+    delays = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError("busy")
+        return "ok"
+
+    result = retry_with_backoff(flaky, lambda e: isinstance(e, ConnectionError), max_retries=3,
+                                base_delay=1, max_delay=1.5, sleep=delays.append)
+    assert result == "ok"
+    assert len(delays) == 2
+    assert 0 <= delays[0] <= 1
+    assert 0 <= delays[1] <= 1.5
+
+
+def test_retry_with_backoff_does_not_retry_other_errors():
+    def broken():
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        retry_with_backoff(broken, lambda e: isinstance(e, ConnectionError), sleep=lambda _: None)
+
+
+def test_retry_with_backoff_gives_up():
+    def always_busy():
+        raise ConnectionError("busy")
+
+    with pytest.raises(UpstreamUnavailable) as excinfo:
+        retry_with_backoff(always_busy, lambda e: True, max_retries=2, base_delay=1, sleep=lambda _: None)
+    assert excinfo.value.retry_after == 4
+    assert not isinstance(excinfo.value, UpstreamRateLimited)
+    assert "unavailable" in str(excinfo.value)
+
+
+def test_retry_with_backoff_reports_rate_limits():
+    class TooManyRequests(Exception):
+        status_code = 429
+
+    def rate_limited():
+        raise TooManyRequests("slow down")
+
+    with pytest.raises(UpstreamRateLimited) as excinfo:
+        retry_with_backoff(rate_limited, lambda e: True, max_retries=1, sleep=lambda _: None)
+    assert "rate limiting" in str(excinfo.value)
+
+
+def test_create_rate_limiter_from_env(monkeypatch):
+    monkeypatch.setenv("GUIDANCE_RATE_LIMIT_PER_SECOND", "0")
+    assert create_rate_limiter_from_env() is None
+    monkeypatch.setenv("GUIDANCE_RATE_LIMIT_PER_SECOND", "2")
+    monkeypatch.setenv("GUIDANCE_RATE_LIMIT_BURST", "5")
+    limiter = create_rate_limiter_from_env()
+    assert (limiter.rate, limiter.burst) == (2, 5)
@@ -0,0 +1,119 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from conversation import ConversationContext, Turn
+from prompts import PromptBuilder, create_prompt_builder_from_env, estimate_tokens, truncate_to_tokens
+
+ONBOARDING_DATA = {
+    "conflict_description": "Argument with my roommate about cleaning schedules.",
+    "mediator_preference": "neutral",
+    "desired_outcome": "A fair cleaning schedule that we both stick to.",
+}
+
+
+def test_known_fields_are_rendered_in_template_order():
+    builder = PromptBuilder()
+    details = builder.render_details({"desired_outcome": "A fair schedule", "conflict_description": "Cleaning"})
+    assert details == "Conflict: Cleaning\nDesired outcome: A fair schedule"
+
+
+def test_camel_case_keys_map_to_known_fields():
+    builder = PromptBuilder()
+    assert builder.render_details({"conflictDescription": "Cleaning"}) == builder.render_details({"conflict_description": "Cleaning"})
+
+
+def test_unknown_fields_are_collected_sorted_and_routing_fields_dropped():
+    builder = PromptBuilder()
+    details = builder.render_details({"zeta": 1, "alpha": ["a", "b"], "nested": {"k": "v"}, "group_chat_id": 42, "context": "x"})
+    assert details == 'Other details: alpha: a, b; nested: {"k":"v"}; zeta: 1'
+
+
+def test_user_id_is_not_rendered():
+    """Test that the storage key stays out of the prompt (and so out of the cache key)."""
+    builder = PromptBuilder()
+    assert builder.render_details({"user_id": "u1", "conflict_description": "Cleaning"}) == "Conflict: Cleaning"
+    assert builder.build({"userId": "u1", "conflict_description": "Cleaning"}) == builder.build({"user_id": "u2", "conflict_description": "Cleaning"})
+
+
+def test_whitespace_is_collapsed():
+    builder = PromptBuilder()
+    assert builder.render_details({"conflict_description": "  too\n\n many   spaces "}) == "Conflict: too many spaces"
+
+
+def test_fields_are_truncated_to_their_budget():
+    builder = PromptBuilder(fields=(("conflict_description", "Conflict", 10),))
+    details = builder.render_details({"conflict_description": "word " * 500})
+    assert details.endswith("…")
+    assert estimate_tokens(details) <= 13
+
+
+def test_total_budget_shortens_later_fields_first():
+    builder = PromptBuilder(max_tokens=100)
+    details = builder.render_details({
+        "user_query": "short question",
+        "conflict_description": "long " * 200,
+        "desired_outcome": "peace",
+        "extra": "x" * 1000,
+    })
+    lines = details.splitlines()
+    assert lines[0] == "Message: short question"
+    assert lines[1].startswith("Conflict: long") and lines[1].endswith("…")
+    assert all(not line.startswith(("Desired outcome", "Other details")) for line in lines)
+    assert sum(estimate_tokens(line) for line in lines) <= 100
+
+
+def test_prompt_prefix_is_stable():
+    builder = PromptBuilder()
+    first = builder.build(ONBOARDING_DATA)
+    second = builder.build({"conflict_description": "Something else entirely"})
+
+    assert first[0] is second[0]
+    first_text, second_text = first[1].content, second[1].content
+    prefix = first_text[:first_text.index("Details:")]
+    assert second_text.startswith(prefix)
+
+
+def test_build_is_independent_of_key_order():
+    builder = PromptBuilder()
+    reordered = dict(reversed(list(ONBOARDING_DATA.items())))
+    assert builder.build(ONBOARDING_DATA)[1].content == builder.build(reordered)[1].content
+
+
+def test_conversation_goes_between_instructions_and_details():
+    builder = PromptBuilder()
+    conversation = ConversationContext("They argue about chores.", [Turn("alice", "hi")])
+    content = builder.build({"user_query": "so?"}, conversation)[1].content
+
+    assert content.index("Summary of the earlier conversation") < content.index("Details:\nMessage: so?")
+    assert "Earlier in this group chat" not in builder.build({"user_query": "so?"}, ConversationContext())[1].content
+
+
+def test_non_dict_onboarding_data_is_rendered():
+    assert PromptBuilder().render_details("just text") == "Other details: details: just text"
+
+
+def test_truncate_to_tokens_leaves_short_text_alone():
+    assert truncate_to_tokens("short", 10) == "short"
+
+
+def test_create_prompt_builder_from_env(monkeypatch):
+    monkeypatch.setenv("GUIDANCE_PROMPT_MAX_TOKENS", "300")
+    assert create_prompt_builder_from_env().max_tokens == 300
+
+
+def test_transcript_keeps_lines_and_newest_messages():
+    """Test that a long batched transcript is cut from the front, so the messages being answered survive."""
+    transcript = "\n".join(f"user{i}: {'word ' * 60}END{i}" for i in range(10))
+    details = PromptBuilder().render_details({"user_query": transcript, "user_info": "user0, user1"})
+
+    message = details.split("\nFrom: ")[0]
+    assert message.startswith("Message: …")
+    assert message.endswith("END9")
+    assert "END0" not in message
+    assert "\nuser9: " in message
+    assert estimate_tokens(message) <= 502
+
+
+def test_truncate_to_tokens_can_keep_the_end():
+    assert truncate_to_tokens("one two three four five", 3, keep_end=True) == "…four five"
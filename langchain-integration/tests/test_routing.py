@@ -0,0 +1,152 @@
+import pytest
+import os
+import sys
+from unittest.mock import MagicMock
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from routing import ModelRouter, ModelTier, create_model_router_from_env
+
+
+class UpstreamError(Exception):
+    pass
+
+
+def is_upstream_error(error):
+    return isinstance(error, UpstreamError)
+
+
+def make_router(**kwargs):
+    tiers = [
+        ModelTier("fast", MagicMock(), model="small", fallback="standard"),
+        ModelTier("standard", MagicMock(), model="large", fallback="fast"),
+    ]
+    return ModelRouter(tiers, **kwargs)
+
+
+@pytest.mark.parametrize("onboarding_data, tier", [
+    ({"user_query": "who took my charger?", "group_chat_id": 1}, "fast"),
+    ({"user_query": "x" * 501, "group_chat_id": 1}, "standard"),
+    ({"conflict_description": "Chores", "mediator_preference": "neutral"}, "standard"),
+    ("free text", "standard"),
+])
+def test_route(onboarding_data, tier):
+    assert make_router().route(onboarding_data).name == tier
+
+
+def test_route_by_mediator_preference():
+    router = make_router(mediator_tiers={"direct": "fast"})
+    assert router.route({"conflict_description": "Chores", "mediator_preference": "Direct"}).name == "fast"
+    assert router.route({"conflictDescription": "Chores", "mediatorPreference": "direct"}).name == "fast"
+    assert router.stats()["routed"] == {"fast": 2}
+
+
+def test_unknown_tiers_are_rejected():
+    with pytest.raises(ValueError):
+        ModelRouter([ModelTier("standard", MagicMock())], group_tier="fast")
+    with pytest.raises(ValueError):
+        ModelRouter([ModelTier("fast", MagicMock(), fallback="missing"), ModelTier("standard", MagicMock())])
+
+
+def test_cache_params_differ_per_tier():
+    router = make_router()
+    assert router.tier("fast").cache_params() != router.tier("standard").cache_params()
+
+
+def test_call_falls_back_on_upstream_errors_only():
+    router = make_router()
+    calls = []
+
+    def fn(tier):
+        calls.append(tier.name)
+        if tier.name == "fast":
+            raise UpstreamError("timeout")
+        return tier.name
+
+    assert router.call(router.tier("fast"), fn, is_upstream_error) == "standard"
+    assert calls == ["fast", "standard"]
+    assert router.stats()["fallbacks"] == {"fast": 1}
+
+    with pytest.raises(ValueError):
+        router.call(router.tier("fast"), lambda tier: (_ for _ in ()).throw(ValueError("bug")), is_upstream_error)
+
+
+def test_call_without_fallback_raises():
+    router = ModelRouter([ModelTier("fast", MagicMock()), ModelTier("standard", MagicMock())])
+    with pytest.raises(UpstreamError):
+        router.call(router.tier("fast"), lambda tier: (_ for _ in ()).throw(UpstreamError()), is_upstream_error)
+
+
+def test_stream_doesnt_fall_back_after_first_chunk():
+    router = make_router()
+
+    def broken_stream(messages):
+        yield "partial"
+        raise UpstreamError("dropped")
+
+    router.tier("fast").llm.stream.side_effect = broken_stream
+    chunks = router.stream(router.tier("fast"), [], is_upstream_error)
+
+    assert next(chunks) == "partial"
+    with pytest.raises(UpstreamError):
+        next(chunks)
+    router.tier("standard").llm.stream.assert_not_called()
+
+
+def test_batch_retries_failed_items_on_fallback():
+    router = make_router()
+    router.tier("fast").llm.batch.return_value = ["a", UpstreamError("timeout"), ValueError("bad input")]
+    router.tier("standard").llm.batch.return_value = ["b"]
+
+    responses = router.batch(router.tier("fast"), ["in-a", "in-b", "in-c"], is_upstream_error, config={"max_concurrency": 2})
+
+    assert responses[:2] == ["a", "b"]
+    assert isinstance(responses[2], ValueError)
+    router.tier("standard").llm.batch.assert_called_once_with(["in-b"], return_exceptions=True, config={"max_concurrency": 2})
+
+
+def test_create_model_router_from_env(monkeypatch):
+    monkeypatch.setenv("GUIDANCE_FAST_MODEL", "gpt-4o-mini")
+    monkeypatch.setenv("GUIDANCE_FAST_MAX_TOKENS", "200")
+    monkeypatch.setenv("GUIDANCE_STANDARD_MODEL", "gpt-4o")
+    monkeypatch.setenv("GUIDANCE_STANDARD_FALLBACK", "")
+    monkeypatch.setenv("GUIDANCE_MEDIATOR_TIERS", "direct=fast, empathetic=standard")
+
+    router = create_model_router_from_env()
+
+    assert router.tier("fast").cache_params()["model"] == "gpt-4o-mini"
+    assert router.tier("fast").max_tokens == 200
+    assert router.tier("fast").fallback == "standard"
+    assert router.tier("standard").model == "gpt-4o"
+    assert router.tier("standard").fallback is None
+    assert router.mediator_tiers == {"direct": "fast", "empathetic": "standard"}
+
+
+def test_standard_tier_defaults_to_a_more_capable_model(monkeypatch):
+    monkeypatch.delenv("GUIDANCE_FAST_MODEL", raising=False)
+    monkeypatch.delenv("GUIDANCE_STANDARD_MODEL", raising=False)
+
+    router = create_model_router_from_env()
+
+    assert router.tier("fast").model == "gpt-4o-mini"
+    assert router.tier("standard").model == "gpt-4o"
+
+
+def test_model_clients_are_built_on_first_use(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy-key")
+    monkeypatch.setenv("GUIDANCE_FAST_TIMEOUT", "7")
+    router = create_model_router_from_env()
+    tier = router.tier("fast")
+    assert tier._llm is None
+
+    llm = tier.llm
+    assert llm is tier.llm
+    assert llm.request_timeout == 7
+    # Both tiers share one connection pool
+    assert llm.http_client is router.tier("standard").llm.http_client
+
+
+def test_missing_api_key_fails_on_first_use_only(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    router = create_model_router_from_env()
+    with pytest.raises(ValueError, match="OPENAI_API_KEY"):
+        router.tier("standard").llm
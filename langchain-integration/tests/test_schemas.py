@@ -0,0 +1,111 @@
+import pytest
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pydantic import ValidationError
+
+from schemas import (
+    MAX_EXTRA_FIELDS,
+    MAX_FIELD_CHARS,
+    MAX_MESSAGE_CHARS,
+    GroupMessage,
+    GuidanceRequest,
+    OnboardingData,
+    validate_guidance_input,
+    validation_details,
+)
+
+
+def test_onboarding_fields_accept_camel_case():
+    data = validate_guidance_input({"conflictDescription": "Dishes", "userId": "u1"})
+
+    assert isinstance(data, OnboardingData)
+    assert data.payload() == {"conflict_description": "Dishes", "user_id": "u1"}
+
+
+def test_onboarding_accepts_integer_user_id():
+    data = validate_guidance_input({"user_id": 12345, "conflict_description": "Dishes"})
+
+    assert data.payload() == {"user_id": 12345, "conflict_description": "Dishes"}
+
+
+def test_onboarding_keeps_extra_details():
+    """Test that details the schema doesn't know about still reach the prompt."""
+    data = validate_guidance_input({"user_story": "We argue", "household": {"size": 3}})
+
+    assert data.payload() == {"user_story": "We argue", "household": {"size": 3}}
+
+
+def test_group_message_is_inferred_without_kind():
+    """Test that requests from bots that don't send "kind" are still told apart."""
+    data = validate_guidance_input({
+        "user_query": "alice: You never listen",
+        "user_info": "alice",
+        "group_chat_id": -100,
+        "context": "group_message_discussion",
+    })
+
+    assert isinstance(data, GroupMessage)
+    assert data.group_chat_id == -100
+
+
+def test_group_message_accepts_largest_bot_batch():
+    """Test that a full batch from the bot (long names, a Telegram-sized message) is accepted."""
+    names = [f"participant_with_a_long_name_{i:02d}" + "x" * 30 for i in range(10)]
+    transcript = "\n".join(f"{name}: {'y' * 40}" for name in names[:-1]) + f"\n{names[-1]}: " + "z" * 4096
+
+    data = validate_guidance_input({
+        "kind": "group_message",
+        "user_query": transcript,
+        "user_info": ", ".join(names),
+        "group_chat_id": -100,
+    })
+
+    assert isinstance(data, GroupMessage)
+
+
+def test_explicit_kind_selects_schema():
+    with pytest.raises(ValidationError):
+        # A group message must have a chat ID
+        validate_guidance_input({"kind": "group_message", "user_query": "Hello"})
+    with pytest.raises(ValidationError):
+        validate_guidance_input({"kind": "unknown", "user_story": "Story"})
+
+
+def test_group_message_rejects_unknown_fields():
+    with pytest.raises(ValidationError):
+        validate_guidance_input({"kind": "group_message", "user_query": "Hi", "group_chat_id": 1, "extra": "x"})
+
+
+@pytest.mark.parametrize("data", [
+    {},
+    {"conflict_description": "x" * (MAX_FIELD_CHARS + 1)},
+    {"notes": "x" * (MAX_FIELD_CHARS + 1)},
+    {f"field_{i}": "x" for i in range(MAX_EXTRA_FIELDS + 1)},
+    {"kind": "group_message", "user_query": "x" * (MAX_MESSAGE_CHARS + 1), "group_chat_id": 1},
+    {"kind": "group_message", "user_query": "", "group_chat_id": 1},
+])
+def test_oversized_or_empty_input_is_rejected(data):
+    with pytest.raises(ValidationError):
+        validate_guidance_input(data)
+
+
+def test_guidance_request_reads_async_flag():
+    request = GuidanceRequest.model_validate({
+        "onboarding_data": {"user_story": "Story"},
+        "async": True,
+        "callback_url": "http://localhost/done",
+    })
+
+    assert request.run_async is True
+    assert request.callback_url == "http://localhost/done"
+
+
+def test_validation_details_name_the_field():
+    with pytest.raises(ValidationError) as excinfo:
+        GuidanceRequest.model_validate({"onboarding_data": {"kind": "group_message", "group_chat_id": 1}})
+
+    details = validation_details(excinfo.value)
+    assert details[0]["field"] == "onboarding_data.group_message.user_query"
+    assert "required" in details[0]["message"].lower()
@@ -0,0 +1,139 @@
+import pytest
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+from semantic_cache import (
+    BruteForceIndex,
+    HashingEmbeddings,
+    LSHIndex,
+    SemanticCache,
+    create_semantic_cache_from_env,
+)
+
+
+class FakeClock:
+    """Manually advanced clock for TTL tests."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def embeddings():
+    return HashingEmbeddings()
+
+
+def make_cache(embeddings, **kwargs):
+    return SemanticCache(embeddings, lambda: BruteForceIndex(max_size=10), threshold=0.8, **kwargs)
+
+
+def test_hashing_embeddings_are_deterministic(embeddings):
+    first = embeddings.embed_query("Who is cleaning the kitchen?")
+    second = HashingEmbeddings().embed_query("Who is cleaning the kitchen?")
+    assert np.array_equal(first, second)
+
+
+@pytest.mark.parametrize("index_factory", [
+    lambda: BruteForceIndex(),
+    lambda: LSHIndex(HashingEmbeddings().dimensions),
+])
+def test_index_finds_nearest_vector(embeddings, index_factory):
+    index = index_factory()
+    index.add(embeddings.embed_query("who is cleaning the kitchen"), "kitchen")
+    index.add(embeddings.embed_query("the rent is late again"), "rent")
+
+    similarity, payload = index.search(embeddings.embed_query("who is cleaning the kitchen?"))
+    assert payload == "kitchen"
+    assert similarity > 0.99
+
+
+def test_bruteforce_index_evicts_oldest(embeddings):
+    index = BruteForceIndex(max_size=1)
+    index.add(embeddings.embed_query("first"), "first")
+    index.add(embeddings.embed_query("second"), "second")
+    assert len(index) == 1
+    assert index.search(embeddings.embed_query("first"))[1] == "second"
+
+
+def test_lsh_index_evicts_oldest(embeddings):
+    index = LSHIndex(embeddings.dimensions, max_size=1)
+    index.add(embeddings.embed_query("first"), "first")
+    index.add(embeddings.embed_query("second"), "second")
+    assert len(index) == 1
+    assert index.search(embeddings.embed_query("second"))[1] == "second"
+
+
+def test_semantic_cache_returns_guidance_for_paraphrase(embeddings):
+    cache = make_cache(embeddings)
+    cache.store(1, "who's cleaning the kitchen?", "Make a rota.")
+
+    assert cache.lookup(1, "Who is cleaning the kitchen??") == "Make a rota."
+    assert cache.lookup(1, "I already paid the rent") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_semantic_cache_is_scoped_per_group(embeddings):
+    cache = make_cache(embeddings)
+    cache.store(1, "who's cleaning the kitchen?", "Make a rota.")
+    assert cache.lookup(2, "who's cleaning the kitchen?") is None
+
+
+def test_semantic_cache_entries_expire(embeddings):
+    clock = FakeClock()
+    cache = make_cache(embeddings, ttl=10, clock=clock)
+    cache.store(1, "who's cleaning the kitchen?", "Make a rota.")
+    clock.now = 11
+    assert cache.lookup(1, "who's cleaning the kitchen?") is None
+
+
+def test_semantic_cache_bounds_number_of_groups(embeddings):
+    cache = make_cache(embeddings, max_scopes=2)
+    for group in (1, 2, 3):
+        cache.store(group, "who's cleaning the kitchen?", f"guidance {group}")
+    assert cache.lookup(1, "who's cleaning the kitchen?") is None
+    assert cache.lookup(3, "who's cleaning the kitchen?") == "guidance 3"
+
+
+def test_create_semantic_cache_from_env(monkeypatch):
+    monkeypatch.delenv("GUIDANCE_SEMANTIC_CACHE_ENABLED", raising=False)
+    assert create_semantic_cache_from_env() is None
+
+    monkeypatch.setenv("GUIDANCE_SEMANTIC_CACHE_ENABLED", "true")
+    monkeypatch.setenv("GUIDANCE_SEMANTIC_CACHE_INDEX", "lsh")
+    monkeypatch.setenv("GUIDANCE_SEMANTIC_CACHE_THRESHOLD", "0.75")
+    cache = create_semantic_cache_from_env()
+    assert cache.threshold == 0.75
+    assert isinstance(cache.index_factory(), LSHIndex)
+
+    monkeypatch.setenv("GUIDANCE_SEMANTIC_CACHE_INDEX", "faiss")
+    with pytest.raises(ValueError):
+        create_semantic_cache_from_env()
+
+
+def test_lsh_index_is_sized_by_first_vector(embeddings):
+    index = LSHIndex()
+    assert index.search(embeddings.embed_query("hello")) is None
+
+    index.add(embeddings.embed_query("who's cleaning the kitchen?"), "guidance")
+    similarity, payload = index.search(embeddings.embed_query("who's cleaning the kitchen?"))
+    assert payload == "guidance"
+    assert similarity == pytest.approx(1.0)
+
+
+def test_openai_cache_is_created_without_embedding_calls(monkeypatch, mocker):
+    """Test that startup doesn't call the embeddings API (it may be slow, down or unconfigured)."""
+    embeddings = mocker.patch("langchain_openai.OpenAIEmbeddings")
+    monkeypatch.setenv("GUIDANCE_SEMANTIC_CACHE_ENABLED", "true")
+    monkeypatch.setenv("GUIDANCE_SEMANTIC_CACHE_EMBEDDINGS", "openai")
+    monkeypatch.setenv("GUIDANCE_SEMANTIC_CACHE_INDEX", "lsh")
+
+    cache = create_semantic_cache_from_env()
+    cache.index_factory()
+
+    embeddings.return_value.embed_query.assert_not_called()
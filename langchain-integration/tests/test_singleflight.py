@@ -0,0 +1,95 @@
+import pytest
+import os
+import sys
+import threading
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from singleflight import SingleFlight
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.001)
+
+
+def run_concurrently(flight, key, fn, count):
+    """Calls flight.do(key, fn) from `count` threads and returns their outcomes."""
+    outcomes = [None] * count
+
+    def worker(i):
+        try:
+            outcomes[i] = ("result", flight.do(key, fn))
+        except Exception as e:
+            outcomes[i] = ("error", e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    release = threading.Event()
+    executions = []
+
+    def slow_call():
+        executions.append(1)
+        release.wait()
+        return "guidance"
+
+    threads, outcomes = run_concurrently(flight, "key", slow_call, 5)
+    wait_for(lambda: flight.coalesced == 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert executions == [1]
+    assert outcomes == [("result", "guidance")] * 5
+    assert flight.stats() == {"calls": 1, "coalesced": 4, "in_flight": 0}
+
+
+def test_error_is_shared_with_followers():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def failing_call():
+        release.wait()
+        raise ValueError("upstream failed")
+
+    threads, outcomes = run_concurrently(flight, "key", failing_call, 3)
+    wait_for(lambda: flight.coalesced == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert all(kind == "error" and str(error) == "upstream failed" for kind, error in outcomes)
+
+
+def test_sequential_calls_are_not_coalesced():
+    flight = SingleFlight()
+    assert flight.do("key", lambda: 1) == 1
+    assert flight.do("key", lambda: 2) == 2
+    assert flight.stats() == {"calls": 2, "coalesced": 0, "in_flight": 0}
+
+
+def test_different_keys_run_independently():
+    flight = SingleFlight()
+    call_a, leader_a = flight.join("a")
+    call_b, leader_b = flight.join("b")
+    assert leader_a and leader_b
+    assert call_a is not call_b
+    flight.complete(call_a, result="A")
+    flight.complete(call_b, result="B")
+    assert call_a.wait() == "A"
+    assert call_b.wait() == "B"
+
+
+def test_wait_times_out():
+    flight = SingleFlight()
+    call, _ = flight.join("key")
+    with pytest.raises(TimeoutError):
+        call.wait(timeout=0.01)
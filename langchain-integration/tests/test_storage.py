@@ -0,0 +1,130 @@
+import pytest
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from storage import GuidanceStorage, SQLiteStorageBackend, create_storage_from_env
+
+
+class FakeClock:
+    """Manually advanced clock for retention tests."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return SQLiteStorageBackend(str(tmp_path / "guidance.sqlite3"))
+
+
+@pytest.fixture
+def storage(backend, clock):
+    return GuidanceStorage(backend, batch_size=10, retention=100, autostart=False, clock=clock)
+
+
+def test_records_are_written_in_batches(storage, backend):
+    """Test that rows are only written when the writer flushes, in batches of batch_size."""
+    storage.record_messages(-100, [("alice", f"message {i}") for i in range(15)])
+
+    assert backend.recent_messages(-100, 20) == []
+    assert storage.flush() == 10
+    assert len(backend.recent_messages(-100, 20)) == 10
+    assert storage.flush() == 5
+    assert storage.stats()["written"] == 15
+    assert storage.stats()["pending"] == 0
+
+
+def test_recent_messages_are_oldest_first(storage, backend):
+    storage.record_messages(-100, [("alice", "first"), ("Mediator", "reply"), ("bob", "second")])
+    storage.record_messages(-200, [("carol", "other group")])
+    storage.close()
+
+    assert backend.recent_messages(-100, 2) == [("Mediator", "reply"), ("bob", "second")]
+    assert backend.recent_messages("-200", 5) == [("carol", "other group")]
+
+
+def test_sessions_and_guidance_are_indexed_by_user(storage, backend):
+    storage.record_session("alice", {"conflict_description": "Dishes"})
+    storage.record_guidance("key-1", "Talk it through", user_id="alice", model="gpt-4o-mini")
+    storage.record_guidance("key-2", "Group advice", user_id="bob", group_chat_id=-100)
+    storage.close()
+
+    assert backend.recent_sessions("alice", 5)[0]["onboarding_data"] == {"conflict_description": "Dishes"}
+    assert [g["guidance"] for g in backend.recent_guidance(5, user_id="alice")] == ["Talk it through"]
+    assert [g["guidance"] for g in backend.recent_guidance(5, group_chat_id=-100)] == ["Group advice"]
+
+
+def test_find_guidance_respects_max_age(storage, clock):
+    storage.record_guidance("key-1", "Stored guidance")
+    storage.close()
+
+    assert storage.find_guidance("key-1", max_age=60) == "Stored guidance"
+    assert storage.find_guidance("missing", max_age=60) is None
+    clock.now += 61
+    assert storage.find_guidance("key-1", max_age=60) is None
+    assert storage.stats()["store_hits"] == 1
+
+
+def test_full_queue_drops_rows_instead_of_blocking(backend):
+    storage = GuidanceStorage(backend, max_pending=2, autostart=False)
+
+    storage.record_messages(-100, [("alice", "1"), ("alice", "2"), ("alice", "3")])
+
+    assert storage.stats()["pending"] == 2
+    assert storage.stats()["dropped"] == 1
+
+
+def test_retention_purges_old_rows(storage, backend, clock):
+    storage.record_messages(-100, [("alice", "old")])
+    storage.close()
+    clock.now += 150
+    storage.record_messages(-100, [("alice", "new")])
+    storage.close()
+
+    storage.purge_expired()
+
+    assert backend.recent_messages(-100, 5) == [("alice", "new")]
+
+
+def test_write_failures_are_counted_not_raised(storage, mocker):
+    mocker.patch.object(storage.backend, "write_batch", side_effect=RuntimeError("disk full"))
+    storage.record_session("alice", {"a": 1})
+
+    assert storage.flush() == 1
+    assert storage.stats()["write_failures"] == 1
+
+
+def test_data_survives_reopening(tmp_path, clock):
+    """Test that a new storage on the same file sees what the previous one wrote."""
+    path = str(tmp_path / "guidance.sqlite3")
+    first = GuidanceStorage(SQLiteStorageBackend(path), autostart=False, clock=clock)
+    first.record_guidance("key-1", "Persisted")
+    first.close()
+
+    second = GuidanceStorage(SQLiteStorageBackend(path), autostart=False, clock=clock)
+    assert second.find_guidance("key-1", max_age=60) == "Persisted"
+
+
+def test_create_storage_from_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("GUIDANCE_STORAGE_BACKEND", "none")
+    assert create_storage_from_env() is None
+
+    monkeypatch.setenv("GUIDANCE_STORAGE_BACKEND", "sqlite")
+    monkeypatch.setenv("GUIDANCE_STORAGE_PATH", str(tmp_path / "env.sqlite3"))
+    monkeypatch.setenv("GUIDANCE_STORAGE_RETENTION_DAYS", "7")
+    storage = create_storage_from_env()
+    assert storage.backend.path == str(tmp_path / "env.sqlite3")
+    assert storage.retention == 7 * 24 * 3600
+
+    monkeypatch.setenv("GUIDANCE_STORAGE_BACKEND", "postgres")
+    with pytest.raises(ValueError):
+        create_storage_from_env()
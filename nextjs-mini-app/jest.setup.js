@@ -4,3 +4,7 @@
 // Used for __tests__/testing-library.js
 // Learn more: https://github.com/testing-library/jest-dom
 import '@testing-library/jest-dom'
+
+// jsdom does not provide TextEncoder/TextDecoder, which the guidance stream reader uses
+import { TextDecoder, TextEncoder } from 'util'
+Object.assign(global, { TextDecoder, TextEncoder })
@@ -76,7 +76,7 @@ describe('OnboardingPage', () => {
 
     await waitFor(() => {
       expect(mockFetch).toHaveBeenCalledTimes(1);
-      expect(mockFetch).toHaveBeenCalledWith('http://localhost:5001/api/guidance', {
+      expect(mockFetch).toHaveBeenCalledWith('http://localhost:5001/api/guidance/stream', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -102,6 +102,52 @@ describe('OnboardingPage', () => {
     expect(screen.getByRole('button', { name: /Submit Onboarding Data/i })).toBeInTheDocument();
   });
 
+  it('shows streamed guidance as it arrives', async () => {
+    const encoder = new TextEncoder();
+    const chunks = [
+      'data: {"delta": "Talk "}\n\n',
+      'data: {"delta": "calmly."}\n\nevent: done\ndata: {"guidance": "Talk calmly."}\n\n',
+    ];
+    const read = jest.fn();
+    chunks.forEach((chunk) => read.mockResolvedValueOnce({ done: false, value: encoder.encode(chunk) }));
+    read.mockResolvedValueOnce({ done: true, value: undefined });
+
+    mockFetch.mockResolvedValueOnce({
+      ok: true,
+      body: { getReader: () => ({ read }) },
+    });
+
+    render(<OnboardingPage />);
+    fireEvent.click(screen.getByRole('button', { name: /Submit Onboarding Data/i }));
+
+    await waitFor(() => {
+      expect(screen.getByText('Talk calmly.')).toBeInTheDocument();
+    });
+    expect(screen.getByRole('button', { name: /Submit Onboarding Data/i })).toBeInTheDocument();
+  });
+
+  it('shows an error event from the guidance stream', async () => {
+    const encoder = new TextEncoder();
+    const read = jest.fn()
+      .mockResolvedValueOnce({
+        done: false,
+        value: encoder.encode('event: error\ndata: {"error": "An internal error occurred", "details": "LLM down"}\n\n'),
+      })
+      .mockResolvedValueOnce({ done: true, value: undefined });
+
+    mockFetch.mockResolvedValueOnce({
+      ok: true,
+      body: { getReader: () => ({ read }) },
+    });
+
+    render(<OnboardingPage />);
+    fireEvent.click(screen.getByRole('button', { name: /Submit Onboarding Data/i }));
+
+    await waitFor(() => {
+      expect(screen.getByText(/Error: LLM down/i)).toBeInTheDocument();
+    });
+  });
+
   it('handles API error response', async () => {
     mockFetch.mockResolvedValueOnce({
       ok: false,
@@ -130,6 +176,32 @@ describe('OnboardingPage', () => {
     expect(screen.getByRole('button', { name: /Submit Onboarding Data/i })).toBeInTheDocument();
   });
 
+  it('shows validation errors as readable messages', async () => {
+    mockFetch.mockResolvedValueOnce({
+      ok: false,
+      status: 400,
+      json: async () => ({
+        error: 'Invalid request',
+        details: [
+          {
+            field: 'onboarding_data.onboarding.conflict_description',
+            message: 'String should have at most 4000 characters',
+          },
+        ],
+      }),
+    });
+
+    render(<OnboardingPage />);
+
+    fireEvent.change(screen.getByTestId('conflictDescription'), { target: { value: 'Too long' } });
+    fireEvent.click(screen.getByRole('button', { name: /Submit Onboarding Data/i }));
+
+    await waitFor(() => {
+      expect(screen.getByText('Error: String should have at most 4000 characters')).toBeInTheDocument();
+    });
+    expect(screen.queryByText(/object Object/)).not.toBeInTheDocument();
+  });
+
   it('handles network error during fetch', async () => {
     mockFetch.mockRejectedValueOnce(new TypeError('Network failed'));
 
@@ -7,6 +7,60 @@ import GoalSetting from '@/components/onboarding/GoalSetting';
 
 type SubmissionStatus = 'idle' | 'loading' | 'success' | 'error';
 
+const GUIDANCE_STREAM_URL = 'http://localhost:5001/api/guidance/stream';
+
+// Reads the Server-Sent Events sent by the guidance stream endpoint.
+// onUpdate is called with the guidance received so far after every chunk.
+async function readGuidanceStream(
+  body: ReadableStream<Uint8Array>,
+  onUpdate: (guidance: string) => void,
+): Promise<string> {
+  const reader = body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let guidance = '';
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    const rawEvents = buffer.split('\n\n');
+    buffer = rawEvents.pop() ?? '';
+    for (const rawEvent of rawEvents) {
+      let eventType = 'message';
+      let data = '';
+      for (const line of rawEvent.split('\n')) {
+        if (line.startsWith('event: ')) eventType = line.slice('event: '.length);
+        else if (line.startsWith('data: ')) data += line.slice('data: '.length);
+      }
+      if (!data) continue;
+
+      const payload = JSON.parse(data);
+      if (eventType === 'error') throw new Error(payload.details || payload.error);
+      if (eventType === 'done') return payload.guidance;
+      guidance += payload.delta ?? '';
+      onUpdate(guidance);
+    }
+  }
+  return guidance;
+}
+
+type ValidationDetail = { field: string; message: string };
+
+// Error responses carry `details` as a string, or as a list of
+// {field, message} entries when the request failed validation.
+function errorMessage(errorData: { error?: string; details?: string | ValidationDetail[] }, status: number): string {
+  const { details } = errorData;
+  if (Array.isArray(details)) {
+    const messages = details.map((detail) => detail.message).filter(Boolean);
+    if (messages.length > 0) return messages.join('; ');
+  } else if (details) {
+    return details;
+  }
+  return errorData.error || `HTTP error! status: ${status}`;
+}
+
 export default function OnboardingPage() {
   const [contextualData, setContextualData] = useState({
     conflictDescription: '',
@@ -39,7 +93,7 @@ export default function OnboardingPage() {
     };
 
     try {
-      const response = await fetch('http://localhost:5001/api/guidance', {
+      const response = await fetch(GUIDANCE_STREAM_URL, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -49,11 +103,18 @@ export default function OnboardingPage() {
 
       if (!response.ok) {
         const errorData = await response.json().catch(() => ({ details: 'Failed to parse error response.' }));
-        throw new Error(errorData.details || `HTTP error! status: ${response.status}`);
+        throw new Error(errorMessage(errorData, response.status));
       }
 
-      const result = await response.json();
-      setApiResponse(result.guidance || 'Successfully submitted! No specific guidance received.');
+      // Show partial guidance as it streams in; fall back to a plain JSON body.
+      let guidance: string;
+      if (response.body) {
+        guidance = await readGuidanceStream(response.body, setApiResponse);
+      } else {
+        const result = await response.json();
+        guidance = result.guidance;
+      }
+      setApiResponse(guidance || 'Successfully submitted! No specific guidance received.');
       setSubmissionStatus('success');
       // Optionally, reset forms here or navigate away
     } catch (error) {
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BufferedMessage:
+    """A group message waiting to be sent to the guidance service as part of a batch."""
+    message: Any  # telegram.Message, used to reply once the batch is answered
+    user_info: str
+    text: str
+    placeholder: Any = None  # reply posted when the batch started, edited with the answer
+
+
+class MessageBatcher:
+    """
+    Buffers messages per chat and hands them to `flush_callback` as one batch
+    once the chat's window elapses, or earlier when the batch reaches
+    `max_messages` messages or `max_chars` characters of text. A message that
+    would take a batch past `max_chars` starts a new batch instead, so only a
+    single (Telegram-limited) message can make a batch longer than that.
+    """
+
+    def __init__(
+        self,
+        flush_callback: Callable[[Any, List[BufferedMessage]], Awaitable[None]],
+        window: float = 5.0,
+        max_messages: int = 10,
+        max_chars: int = 4000,
+    ) -> None:
+        self.flush_callback = flush_callback
+        self.window = window
+        self.max_messages = max_messages
+        self.max_chars = max_chars
+        self._buffers: Dict[Any, List[BufferedMessage]] = {}
+        self._timers: Dict[Any, asyncio.Task] = {}
+        self._flushes = set()
+
+    async def add(self, chat_id, buffered: BufferedMessage) -> None:
+        """Adds a message to the chat's batch, starting the window for its first message."""
+        if self.pending(chat_id) and self._chars(chat_id) + len(buffered.text) > self.max_chars:
+            self._start_flush(chat_id)
+        buffer = self._buffers.setdefault(chat_id, [])
+        buffer.append(buffered)
+
+        if len(buffer) >= self.max_messages or self._chars(chat_id) >= self.max_chars:
+            self._start_flush(chat_id)
+        elif chat_id not in self._timers:
+            self._timers[chat_id] = asyncio.create_task(self._flush_after_window(chat_id))
+
+    def _chars(self, chat_id) -> int:
+        return sum(len(m.text) for m in self._buffers.get(chat_id, ()))
+
+    async def _flush_after_window(self, chat_id) -> None:
+        await asyncio.sleep(self.window)
+        self._timers.pop(chat_id, None)
+        self._start_flush(chat_id)
+
+    def _start_flush(self, chat_id) -> None:
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+        messages = self._buffers.pop(chat_id, None)
+        if not messages:
+            return
+        # Flush in the background so the handler that filled the batch isn't held up
+        task = asyncio.create_task(self._run_flush(chat_id, messages))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _run_flush(self, chat_id, messages: List[BufferedMessage]) -> None:
+        try:
+            await self.flush_callback(chat_id, messages)
+        except Exception:
+            logger.exception(f"Error flushing message batch for chat {chat_id}")
+
+    async def flush_all(self) -> None:
+        """Flushes every pending batch now and waits for all flushes to finish."""
+        for chat_id in list(self._buffers):
+            self._start_flush(chat_id)
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def pending(self, chat_id) -> int:
+        """Returns the number of messages buffered for the chat."""
+        return len(self._buffers.get(chat_id, ()))
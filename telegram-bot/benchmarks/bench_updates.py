@@ -0,0 +1,196 @@
+"""
+Benchmark for update processing in the bot.
+
+Drives synthetic group-message Updates through handle_group_message against a
+local stub of the guidance service (with a configurable latency), once with
+the library's default sequential processing and then with
+ChatOrderedUpdateProcessor at increasing concurrency. Reports throughput,
+p50/p95/p99 latency and peak memory, optionally as JSON for comparing runs:
+
+    python benchmarks/bench_updates.py --chats 20 --messages 5 --latency 0.2 --output before.json
+    python benchmarks/bench_updates.py --chats 20 --messages 5 --latency 0.2 --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import bot
+from relevance import RelevanceFilter
+from telegram import Chat, Message, Update, User
+from telegram.ext import SimpleUpdateProcessor
+from update_processing import ChatOrderedUpdateProcessor
+
+
+def start_stub_guidance_service(latency):
+    """Starts a local /api/guidance stub answering after `latency` seconds; returns (server, url)."""
+
+    class StubGuidanceHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like a real server
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            self.rfile.read(length)
+            time.sleep(latency)
+            body = json.dumps({"guidance": "Stub guidance"}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    class StubServer(ThreadingHTTPServer):
+        request_queue_size = 256  # accept bursts of concurrent connections
+
+    server = StubServer(("127.0.0.1", 0), StubGuidanceHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/api/guidance"
+
+
+class StubBot:
+    """Stands in for telegram.Bot and records replies instead of calling Telegram."""
+
+    def __init__(self):
+        self.replies = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.replies.append((chat_id, time.perf_counter()))
+
+
+def make_updates(chats, messages_per_chat, stub_bot):
+    updates = []
+    for n in range(messages_per_chat):
+        for chat_id in range(1, chats + 1):
+            update_id = len(updates)
+            message = Message(
+                message_id=update_id,
+                date=datetime.now(timezone.utc),
+                chat=Chat(id=-chat_id, type=Chat.GROUP),
+                from_user=User(id=chat_id, first_name=f"user{chat_id}", is_bot=False),
+                text=f"message {n} in chat {chat_id}",
+            )
+            message.set_bot(stub_bot)
+            updates.append(Update(update_id=update_id, message=message))
+    return updates
+
+
+async def run_scenario(processor, updates):
+    """Feeds every update to the processor at once and returns per-update latencies and wall time."""
+    latencies = []
+
+    async def handle(update, received):
+        await bot.handle_group_message(update, None)
+        latencies.append(time.perf_counter() - received)
+
+    await bot.init_http_client(None)
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(processor.process_update(u, handle(u, time.perf_counter())) for u in updates))
+        elapsed = time.perf_counter() - started
+    finally:
+        await bot.close_http_client(None)
+    return latencies, elapsed
+
+
+def summarize(name, concurrency, latencies, elapsed):
+    latencies = sorted(latencies)
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "updates": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(quantiles[49] * 1000, 1),
+        "p95_ms": round(quantiles[94] * 1000, 1),
+        "p99_ms": round(quantiles[98] * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1),
+        # ru_maxrss is in kilobytes on Linux
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def compare(results, baseline_path):
+    """Prints the change in p95 latency and throughput against an earlier run."""
+    with open(baseline_path) as f:
+        baseline = {(r["scenario"], r["concurrency"]): r for r in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        before = baseline.get((result["scenario"], result["concurrency"]))
+        if not before:
+            continue
+        p95_change = (result["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+        rate_change = (result["updates_per_s"] - before["updates_per_s"]) / before["updates_per_s"] * 100
+        print(f"  {result['scenario']:>12} x{result['concurrency']:<4} p95 {p95_change:+6.1f}%  updates/s {rate_change:+6.1f}%")
+
+
+async def main(args):
+    logging.getLogger().setLevel(logging.WARNING)  # per-message INFO logs would dominate the timings
+    server, url = start_stub_guidance_service(args.latency)
+    scenarios = [("sequential", 1, lambda: SimpleUpdateProcessor(1))]
+    for concurrency in (int(c) for c in args.concurrency.split(",")):
+        scenarios.append(("chat-ordered", concurrency, lambda c=concurrency: ChatOrderedUpdateProcessor(c)))
+
+    results = []
+    try:
+        # Every synthetic message is answered, so no update is dropped by the relevance filter,
+        # and answered in one reply, as the stub serves plain JSON and StubBot can't edit messages
+        with patch.object(bot, "LANGCHAIN_API_URL", url), \
+                patch.object(bot, "relevance_filter", RelevanceFilter(default_sensitivity="all")), \
+                patch.object(bot, "GUIDANCE_STREAM_REPLIES", False):
+            for name, concurrency, make_processor in scenarios:
+                stub_bot = StubBot()
+                updates = make_updates(args.chats, args.messages, stub_bot)
+                latencies, elapsed = await run_scenario(make_processor(), updates)
+                assert len(stub_bot.replies) == len(updates)
+                result = summarize(name, concurrency, latencies, elapsed)
+                results.append(result)
+                print(json.dumps(result))
+    finally:
+        server.shutdown()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "benchmark": "bot_updates",
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "git_commit": git_commit(),
+                "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+                "results": results,
+            }, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+def git_commit():
+    try:
+        root = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=root, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=20, help="number of group chats")
+    parser.add_argument("--messages", type=int, default=5, help="messages sent in each chat")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub guidance latency in seconds")
+    parser.add_argument("--concurrency", default="8,64", help="comma-separated max concurrent updates levels")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    asyncio.run(main(parser.parse_args()))
@@ -1,8 +1,21 @@
 import logging
-import requests # Added
+import os
 import json     # Added
+import asyncio
+import time
+import uuid
+from contextlib import asynccontextmanager
+from urllib.parse import urljoin
+import httpx
 from telegram import Update
+from telegram.constants import ChatAction
+from telegram.error import TelegramError
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from batching import BufferedMessage, MessageBatcher
+from progressive_reply import ProgressiveReply, keep_typing
+from relevance import SENSITIVITY_THRESHOLDS, create_relevance_filter_from_env
+from update_processing import ChatOrderedUpdateProcessor
+import metrics
 
 # Enable logging
 logging.basicConfig(
@@ -12,8 +25,142 @@ logger = logging.getLogger(__name__)
 
 # Define LangChain API URL (Added)
 LANGCHAIN_API_URL = "http://localhost:5001/api/guidance"
+GUIDANCE_STREAM_URL = f"{LANGCHAIN_API_URL}/stream"
+
+# Settings for the shared HTTP client used to call the LangChain API.
+# A single pooled client keeps connections alive between messages and lets
+# many guidance requests be in flight without blocking the event loop.
+HTTP_TIMEOUT = httpx.Timeout(
+    float(os.getenv("GUIDANCE_READ_TIMEOUT", "30")),
+    connect=float(os.getenv("GUIDANCE_CONNECT_TIMEOUT", "5")),
+)
+HTTP_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("GUIDANCE_MAX_CONNECTIONS", "100")),
+    max_keepalive_connections=int(os.getenv("GUIDANCE_MAX_KEEPALIVE_CONNECTIONS", "20")),
+    keepalive_expiry=float(os.getenv("GUIDANCE_KEEPALIVE_EXPIRY", "30")),
+)
+
+_http_client = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Returns the shared HTTP client, creating it on first use."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+    return _http_client
+
+async def init_http_client(application: Application) -> None:
+    """Creates the shared HTTP client when the Application starts."""
+    get_http_client()
+
+async def close_http_client(application: Application) -> None:
+    """Closes the shared HTTP client when the Application shuts down."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+# In job mode the guidance API queues each request and the bot polls for the result,
+# so no connection is held open while the LLM runs and group replies show a
+# placeholder right away (needs GUIDANCE_JOBS_ENABLED on the API).
+GUIDANCE_JOB_MODE = os.getenv("GUIDANCE_JOB_MODE", "false").lower() in ("1", "true", "yes")
+GUIDANCE_JOB_POLL_INTERVAL = float(os.getenv("GUIDANCE_JOB_POLL_INTERVAL", "0.5"))
+GUIDANCE_JOB_MAX_POLL_INTERVAL = float(os.getenv("GUIDANCE_JOB_MAX_POLL_INTERVAL", "5"))
+GUIDANCE_JOB_TIMEOUT = float(os.getenv("GUIDANCE_JOB_TIMEOUT", "120"))
+
+# Group replies are streamed: a placeholder is posted at once and edited as the guidance
+# arrives, at most once every GUIDANCE_STREAM_EDIT_INTERVAL seconds (Telegram rate-limits edits)
+GUIDANCE_STREAM_REPLIES = os.getenv("GUIDANCE_STREAM_REPLIES", "true").lower() not in ("0", "false", "no")
+GUIDANCE_STREAM_EDIT_INTERVAL = float(os.getenv("GUIDANCE_STREAM_EDIT_INTERVAL", "1.5"))
+
+class GuidanceJobError(httpx.HTTPError):
+    """A queued guidance job failed or didn't finish in time."""
+
+async def run_guidance_job(payload: dict, request_id: str) -> dict:
+    """Queues a payload as a guidance job and polls until it has finished."""
+    client = get_http_client()
+    headers = {"X-Request-ID": request_id}
+    response = await client.post(LANGCHAIN_API_URL, json={**payload, "async": True}, headers=headers)
+    response.raise_for_status()
+    job = response.json()
+    status_url = urljoin(LANGCHAIN_API_URL, job["status_url"])
+
+    deadline = time.monotonic() + GUIDANCE_JOB_TIMEOUT
+    interval = GUIDANCE_JOB_POLL_INTERVAL
+    while job["status"] not in ("succeeded", "failed"):
+        if time.monotonic() + interval > deadline:
+            raise GuidanceJobError(f"Guidance job {job['job_id']} didn't finish within {GUIDANCE_JOB_TIMEOUT:.0f}s")
+        await asyncio.sleep(interval)
+        interval = min(interval * 2, GUIDANCE_JOB_MAX_POLL_INTERVAL)
+        response = await client.get(status_url, headers=headers)
+        response.raise_for_status()
+        job = response.json()
+
+    if job["status"] == "failed":
+        raise GuidanceJobError(f"Guidance job {job['job_id']} failed: {job.get('error')}")
+    return {"guidance": job["guidance"]}
+
+@asynccontextmanager
+async def traced_guidance_request():
+    """Gives a guidance call its request ID and records its duration and outcome."""
+    # The request ID is logged by both services, so a slow reply can be traced end to end
+    request_id = uuid.uuid4().hex
+    logger.info(f"[{request_id}] Requesting guidance from LangChain API")
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield request_id
+        outcome = "success"
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.GUIDANCE_LATENCY.labels(outcome).observe(elapsed)
+        logger.info(f"[{request_id}] Guidance request finished ({outcome}) in {elapsed * 1000:.0f}ms")
+
+async def fetch_guidance(payload: dict) -> dict:
+    """Posts a payload to the LangChain API and returns the decoded JSON response."""
+    async with traced_guidance_request() as request_id:
+        logger.debug(f"[{request_id}] Payload: {payload}")
+        if GUIDANCE_JOB_MODE:
+            return await run_guidance_job(payload, request_id)
+        response = await get_http_client().post(LANGCHAIN_API_URL, json=payload, headers={"X-Request-ID": request_id})
+        response.raise_for_status()  # Raise an exception for HTTP errors
+        return response.json()
+
+class GuidanceStreamError(httpx.HTTPError):
+    """The guidance stream reported an error or ended without a result."""
+
+async def stream_guidance(payload: dict, on_text) -> str:
+    """
+    Streams guidance from the LangChain API's Server-Sent Events endpoint,
+    awaiting on_text(text so far) as chunks arrive. Returns the full guidance.
+    """
+    async with traced_guidance_request() as request_id:
+        started = time.perf_counter()
+        text = ""
+        async with get_http_client().stream(
+            "POST", GUIDANCE_STREAM_URL, json=payload, headers={"X-Request-ID": request_id}
+        ) as response:
+            response.raise_for_status()
+            event = None
+            async for line in response.aiter_lines():
+                if not line:
+                    event = None  # end of an SSE message
+                elif line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[len("data:"):])
+                    if event == "error":
+                        raise GuidanceStreamError(f"Guidance stream failed: {data.get('details') or data.get('error')}")
+                    if event == "done":
+                        return data["guidance"]
+                    if not text:
+                        metrics.GUIDANCE_FIRST_TEXT_LATENCY.observe(time.perf_counter() - started)
+                    text += data.get("delta", "")
+                    await on_text(text)
+        raise GuidanceStreamError("Guidance stream ended without a result")
 
 # Define the start command handler
+@metrics.track_handler("start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends a welcome message when the /start command is issued."""
     mini_app_url = "YOUR_MINI_APP_URL"  # Placeholder for the mini-app URL
@@ -22,6 +169,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     )
 
 # New command handler for onboarding_complete (Added)
+@metrics.track_handler("onboarding_complete")
 async def onboarding_complete(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Simulates onboarding completion and fetches guidance from LangChain API."""
     # Dummy onboarding data
@@ -39,73 +187,262 @@ async def onboarding_complete(update: Update, context: ContextTypes.DEFAULT_TYPE
     payload = {"onboarding_data": dummy_onboarding_data}
     
     try:
-        logger.info(f"Sending data to LangChain API: {payload}")
-        response = requests.post(LANGCHAIN_API_URL, json=payload, timeout=30) # Added timeout
-        response.raise_for_status()  # Raise an exception for HTTP errors
-        api_response = response.json()
+        api_response = await fetch_guidance(payload)
         guidance = api_response.get("guidance", "No guidance received.")
         await update.message.reply_text(f"Onboarding data processed.\nHere's some initial guidance for you:\n\n{guidance}")
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Error calling LangChain API: {e}")
         await update.message.reply_text("Sorry, I couldn't process your onboarding data at the moment. Please try again later.")
-    except json.JSONDecodeError:
-        logger.error(f"Error decoding JSON response from LangChain API: {response.text}")
+    except json.JSONDecodeError as e:
+        logger.error(f"Error decoding JSON response from LangChain API: {e}")
         await update.message.reply_text("Sorry, I received an invalid response from the guidance service. Please try again later.")
 
 
-# Modified handler for group messages (Updated)
-async def handle_group_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handles messages sent in group chats and gets guidance from LangChain API."""
-    user_message = update.message.text
-    user_info = update.message.from_user.username or update.message.from_user.first_name
-    
-    logger.info(f"Received message in group {update.message.chat.id} from {user_info}: {user_message}")
+def replies_use_placeholder() -> bool:
+    """Streamed and job mode replies are shown in a placeholder posted before the guidance arrives."""
+    return GUIDANCE_STREAM_REPLIES or GUIDANCE_JOB_MODE
 
-    # Construct payload for LangChain API. 
-    # For now, we'll pass it as if it's part of 'onboarding_data' or a general query.
-    # The LangChain prompt might need adjustment to handle this type of input.
+
+async def reply_with_group_guidance(message, chat_id, user_query, user_info, heading, placeholder=None) -> None:
+    """
+    Gets guidance for a group discussion from LangChain API and replies to `message`,
+    or edits `placeholder` when one was already posted.
+    """
+    # Group messages share the guidance endpoint with onboarding data; "kind"
+    # tells the LangChain API which request schema applies
     payload = {
-        "onboarding_data": { # Using the existing structure for now
-            "context": "group_message_discussion",
-            "user_query": user_message,
+        "onboarding_data": {
+            "kind": "group_message",
+            "user_query": user_query,
             "user_info": user_info,
-            "group_chat_id": update.message.chat.id
+            "group_chat_id": chat_id
         }
     }
 
+    # Post a placeholder right away and edit it as the guidance streams in (or, in
+    # job mode, once the job is done), so the group sees a reply within moments
+    if placeholder is None and replies_use_placeholder():
+        placeholder = await message.reply_text(f"{heading}:\n\n…")
+    typing = asyncio.create_task(keep_typing(message)) if placeholder is not None else None
+
+    async def respond(text):
+        if placeholder is not None:
+            await placeholder.edit_text(text)
+        else:
+            await message.reply_text(text)
+
     try:
-        logger.info(f"Sending group message data to LangChain API: {payload}")
-        response = requests.post(LANGCHAIN_API_URL, json=payload, timeout=30) # Added timeout
-        response.raise_for_status()
-        api_response = response.json()
+        if GUIDANCE_STREAM_REPLIES and not GUIDANCE_JOB_MODE:
+            reply = ProgressiveReply(placeholder, f"{heading}:\n\n", min_interval=GUIDANCE_STREAM_EDIT_INTERVAL)
+            guidance = await stream_guidance(payload, reply.update)
+            try:
+                await reply.finish(guidance)
+            except TelegramError as e:
+                # The placeholder can't be edited; post the answer as a new message instead
+                logger.error(f"Couldn't write streamed guidance into the placeholder: {e}")
+                await message.reply_text(reply.render(guidance))
+            return
+
+        api_response = await fetch_guidance(payload)
         guidance = api_response.get("guidance", "Sorry, I couldn't get a helpful suggestion right now.")
         
         # Reply in the group
-        await update.message.reply_text(f"Regarding \"{user_message}\":\n\n{guidance}")
+        await respond(f"{heading}:\n\n{guidance}")
         
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Error calling LangChain API for group message: {e}")
-        await update.message.reply_text("I'm having trouble processing that message. Please try again later.")
-    except json.JSONDecodeError:
-        logger.error(f"Error decoding JSON response from LangChain API for group message: {response.text}")
-        await update.message.reply_text("Sorry, I received an invalid response from the processing service. Please try again later.")
+        await respond("I'm having trouble processing that message. Please try again later.")
+    except json.JSONDecodeError as e:
+        logger.error(f"Error decoding JSON response from LangChain API for group message: {e}")
+        await respond("Sorry, I received an invalid response from the processing service. Please try again later.")
+    finally:
+        if typing is not None:
+            typing.cancel()
+
+
+# Scores group messages locally so chatter ("ok", emoji, off-topic talk) never reaches
+# the LLM; how readily each group gets a reply is set with /mediation_sensitivity
+relevance_filter = create_relevance_filter_from_env()
+
+
+def is_addressed_to_bot(message, context) -> bool:
+    """Replies to the bot and messages mentioning it always get an answer."""
+    bot = getattr(context, "bot", None)
+    if bot is None:
+        return False
+    reply = message.reply_to_message
+    if reply is not None and reply.from_user is not None and reply.from_user.id == bot.id:
+        return True
+    return bool(bot.username) and f"@{bot.username}".lower() in (message.text or "").lower()
+
+
+def needs_mediation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Runs the relevance filter on a group message."""
+    message = update.message
+    decision = relevance_filter.check(message.chat.id, message.text, is_addressed_to_bot(message, context))
+    if not decision.forward:
+        logger.debug(f"Filtered message in group {message.chat.id} (score {decision.score:.2f})")
+    return decision.forward
+
+
+@metrics.track_handler("mediation_sensitivity")
+async def mediation_sensitivity(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Shows or (for group admins) sets how readily the bot steps into the group's conversation."""
+    chat_id = update.message.chat.id
+    levels = ", ".join(SENSITIVITY_THRESHOLDS)
+    if not context.args:
+        stats = relevance_filter.stats(chat_id)
+        await update.message.reply_text(
+            f"Mediation sensitivity: {relevance_filter.sensitivity(chat_id)} (one of {levels}).\n"
+            f"Messages answered: {stats['forwarded']}, skipped: {stats['filtered']}."
+        )
+        return
+
+    level = context.args[0].lower()
+    if level not in SENSITIVITY_THRESHOLDS:
+        await update.message.reply_text(f"Unknown level \"{level}\". Use one of: {levels}.")
+        return
+    member = await context.bot.get_chat_member(chat_id, update.message.from_user.id)
+    if member.status not in ("administrator", "creator"):
+        await update.message.reply_text("Only group admins can change the mediation sensitivity.")
+        return
+    relevance_filter.set_sensitivity(chat_id, level)
+    await update.message.reply_text(f"Mediation sensitivity set to {level}.")
+
+
+# Modified handler for group messages (Updated)
+@metrics.track_handler("group_message")
+async def handle_group_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handles messages sent in group chats and gets guidance from LangChain API."""
+    if not needs_mediation(update, context):
+        return
+    user_message = update.message.text
+    user_info = update.message.from_user.username or update.message.from_user.first_name
+    
+    logger.info(f"Received message in group {update.message.chat.id} from {user_info}")
+
+    await reply_with_group_guidance(
+        update.message, update.message.chat.id, user_message, user_info,
+        heading=f"Regarding \"{user_message}\"",
+    )
+
+
+async def send_group_batch(chat_id, messages) -> None:
+    """Sends a batch of buffered group messages as one transcript and replies once."""
+    metrics.GROUP_BATCH_SIZE.observe(len(messages))
+    # Posted by buffer_group_message when the batch started, if replies use one
+    placeholder = messages[0].placeholder
+    if len(messages) == 1:
+        only = messages[0]
+        await reply_with_group_guidance(
+            only.message, chat_id, only.text, only.user_info,
+            heading=f"Regarding \"{only.text}\"", placeholder=placeholder,
+        )
+        return
+
+    transcript = "\n".join(f"{m.user_info}: {m.text}" for m in messages)
+    participants = ", ".join(dict.fromkeys(m.user_info for m in messages))
+    # Without a placeholder, reply to the latest message so the answer shows up at the end of the exchange
+    await reply_with_group_guidance(
+        messages[-1].message, chat_id, transcript, participants,
+        heading=f"Regarding the last {len(messages)} messages", placeholder=placeholder,
+    )
+
+
+# Group messages are buffered per chat for GROUP_BATCH_WINDOW seconds (or until
+# GROUP_BATCH_MAX_MESSAGES messages / GROUP_BATCH_MAX_CHARS characters arrive)
+# and answered with a single guidance call. A window of 0 disables batching.
+GROUP_BATCH_WINDOW = float(os.getenv("GROUP_BATCH_WINDOW", "5"))
+group_batcher = MessageBatcher(
+    send_group_batch,
+    window=GROUP_BATCH_WINDOW,
+    max_messages=int(os.getenv("GROUP_BATCH_MAX_MESSAGES", "10")),
+    max_chars=int(os.getenv("GROUP_BATCH_MAX_CHARS", "4000")),
+)
+
+
+@metrics.track_handler("buffer_group_message")
+async def buffer_group_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Adds a group message to its chat's batch instead of answering it right away."""
+    if not needs_mediation(update, context):
+        return
+    user_message = update.message.text
+    user_info = update.message.from_user.username or update.message.from_user.first_name
+
+    chat_id = update.message.chat.id
+    placeholder = None
+    if group_batcher.pending(chat_id) == 0 and replies_use_placeholder():
+        # Acknowledge the batch now rather than after the window; the answer is written into this message
+        placeholder = await update.message.reply_text("…")
+        try:
+            await update.message.reply_chat_action(ChatAction.TYPING)
+        except Exception as e:
+            logger.debug(f"Couldn't send typing indicator: {e}")
+
+    logger.info(f"Buffering message in group {chat_id} from {user_info}")
+    await group_batcher.add(chat_id, BufferedMessage(update.message, user_info, user_message, placeholder))
+
+
+async def flush_group_batches(application: Application) -> None:
+    """Answers all buffered group messages when the Application stops."""
+    await group_batcher.flush_all()
+
+
+# Update processing: updates from different chats are handled concurrently (up to
+# BOT_CONCURRENT_UPDATES at once) while each chat's updates stay in order; a flooding
+# chat keeps at most BOT_MAX_QUEUED_UPDATES_PER_CHAT pending updates.
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "64"))
+BOT_MAX_QUEUED_UPDATES_PER_CHAT = int(os.getenv("BOT_MAX_QUEUED_UPDATES_PER_CHAT", "20"))
+
+# Setting BOT_WEBHOOK_URL switches from long polling to a webhook, which delivers
+# updates as soon as Telegram has them.
+BOT_WEBHOOK_URL = os.getenv("BOT_WEBHOOK_URL")
+BOT_WEBHOOK_LISTEN = os.getenv("BOT_WEBHOOK_LISTEN", "0.0.0.0")
+BOT_WEBHOOK_PORT = int(os.getenv("BOT_WEBHOOK_PORT", "8443"))
+BOT_WEBHOOK_PATH = os.getenv("BOT_WEBHOOK_PATH", "telegram")
+BOT_WEBHOOK_SECRET = os.getenv("BOT_WEBHOOK_SECRET")
+
+# Port of the Prometheus metrics exporter; 0 disables it
+BOT_METRICS_PORT = int(os.getenv("BOT_METRICS_PORT", "9100"))
 
 
 def main() -> None:
     """Start the bot."""
+    if BOT_METRICS_PORT:
+        metrics.start_exporter(BOT_METRICS_PORT)
+
     # Create the Application and pass it your bot's token.
-    # Ensure YOUR_TELEGRAM_BOT_TOKEN is set in your environment or config
-    application = Application.builder().token("YOUR_TELEGRAM_BOT_TOKEN").build() 
+    # Ensure TELEGRAM_BOT_TOKEN is set in your environment or config
+    application = (
+        Application.builder()
+        .token(os.getenv("TELEGRAM_BOT_TOKEN", "YOUR_TELEGRAM_BOT_TOKEN"))
+        .concurrent_updates(ChatOrderedUpdateProcessor(BOT_CONCURRENT_UPDATES, BOT_MAX_QUEUED_UPDATES_PER_CHAT))
+        .post_init(init_http_client)
+        .post_stop(flush_group_batches)
+        .post_shutdown(close_http_client)
+        .build()
+    )
 
     # on different commands - answer in Telegram
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("onboarding_complete", onboarding_complete)) # Added
+    application.add_handler(CommandHandler("mediation_sensitivity", mediation_sensitivity, filters=filters.ChatType.GROUPS))
 
     # on non command i.e message - handle group messages
-    application.add_handler(MessageHandler(filters.TEXT & filters.ChatType.GROUPS & ~filters.COMMAND, handle_group_message))
+    group_handler = buffer_group_message if GROUP_BATCH_WINDOW > 0 else handle_group_message
+    application.add_handler(MessageHandler(filters.TEXT & filters.ChatType.GROUPS & ~filters.COMMAND, group_handler))
 
     # Run the bot until the user presses Ctrl-C
-    application.run_polling()
+    if BOT_WEBHOOK_URL:
+        application.run_webhook(
+            listen=BOT_WEBHOOK_LISTEN,
+            port=BOT_WEBHOOK_PORT,
+            url_path=BOT_WEBHOOK_PATH,
+            webhook_url=f"{BOT_WEBHOOK_URL.rstrip('/')}/{BOT_WEBHOOK_PATH}",
+            secret_token=BOT_WEBHOOK_SECRET,
+        )
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,60 @@
+import functools
+import time
+
+from prometheus_client import Counter, Histogram, start_http_server
+
+# Buckets in seconds; guidance calls wait on the LLM and can take tens of seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+HANDLER_LATENCY = Histogram(
+    "bot_handler_duration_seconds",
+    "End-to-end time spent in an update handler",
+    ["handler"],
+    buckets=LATENCY_BUCKETS,
+)
+GUIDANCE_LATENCY = Histogram(
+    "bot_guidance_request_duration_seconds",
+    "Duration of calls to the guidance service",
+    ["outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+GUIDANCE_FIRST_TEXT_LATENCY = Histogram(
+    "bot_guidance_first_text_seconds",
+    "Time until the first streamed guidance text arrived",
+    buckets=LATENCY_BUCKETS,
+)
+UPDATE_QUEUE_WAIT = Histogram(
+    "bot_update_queue_wait_seconds",
+    "Time an update waited behind earlier updates of the same chat",
+    buckets=LATENCY_BUCKETS,
+)
+GROUP_BATCH_SIZE = Histogram(
+    "bot_group_batch_size",
+    "Number of group messages answered by one guidance call",
+    buckets=(1, 2, 3, 5, 10, 20, 50),
+)
+DROPPED_UPDATES = Counter("bot_dropped_updates_total", "Stale updates dropped from flooding chats")
+GROUP_MESSAGES = Counter(
+    "bot_group_messages_total",
+    "Group messages forwarded for mediation or filtered out by the relevance filter",
+    ["decision"],
+)
+
+
+def track_handler(name):
+    """Decorator recording how long an async handler takes."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await handler(*args, **kwargs)
+            finally:
+                HANDLER_LATENCY.labels(name).observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def start_exporter(port):
+    """Serves the metrics for Prometheus on http://0.0.0.0:<port>/metrics."""
+    start_http_server(port)
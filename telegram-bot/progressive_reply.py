@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable
+
+from telegram.constants import ChatAction, MessageLimit
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """RetryAfter.retry_after is seconds or a timedelta, depending on the library version."""
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+
+class ProgressiveReply:
+    """
+    Shows a streamed answer by editing one placeholder message as the text grows.
+
+    Telegram limits how often a chat's messages can be edited, so update() edits
+    at most once every `min_interval` seconds and only when at least
+    `min_chars` new characters arrived; a RetryAfter from Telegram pushes the
+    next edit back by the time it asks for, and other failed edits are skipped
+    (the next one catches up). finish() always writes the final text, raising
+    TelegramError if it can't. Text is cut to Telegram's message length limit.
+    """
+
+    def __init__(
+        self,
+        message: Any,
+        prefix: str = "",
+        min_interval: float = 1.5,
+        min_chars: int = 20,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.message = message  # the placeholder, a telegram.Message
+        self.prefix = prefix
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self.clock = clock
+        self.edits = 0
+        self._shown = ""
+        self._next_edit_at = 0.0
+
+    def render(self, text: str) -> str:
+        """The message text showing `text`, cut to Telegram's limit."""
+        full = self.prefix + text
+        limit = MessageLimit.MAX_TEXT_LENGTH
+        return full if len(full) <= limit else full[:limit - 1] + "…"
+
+    async def update(self, text: str) -> None:
+        """Shows the text received so far, unless an edit now would be too soon or too small."""
+        if self.clock() < self._next_edit_at or len(text) - len(self._shown) < self.min_chars:
+            return
+        # Mark the streamed part as unfinished
+        await self._edit(text, self.render(text + " …"))
+
+    async def finish(self, text: str) -> None:
+        """Shows the complete text."""
+        if self.clock() < self._next_edit_at:
+            await asyncio.sleep(self._next_edit_at - self.clock())
+        await self._edit(text, self.render(text), final=True)
+
+    async def _edit(self, text: str, rendered: str, final: bool = False) -> None:
+        try:
+            await self.message.edit_text(rendered)
+            self.edits += 1
+            self._shown = text
+            self._next_edit_at = self.clock() + self.min_interval
+        except RetryAfter as e:
+            delay = retry_after_seconds(e)
+            logger.warning(f"Telegram asked to wait {delay:.0f}s before editing again")
+            if final:
+                # The final text must be shown; wait as long as Telegram asks and try once more
+                await asyncio.sleep(delay)
+                await self.message.edit_text(rendered)
+                self.edits += 1
+                self._shown = text
+            else:
+                self._next_edit_at = self.clock() + delay
+        except TelegramError as e:
+            # Editing to identical text is refused; nothing to show then
+            if isinstance(e, BadRequest) and "not modified" in str(e).lower():
+                return
+            if final:
+                raise
+            # Streamed edits are best effort: skip this one, a later edit or finish() shows the text
+            logger.warning(f"Couldn't edit streamed reply: {e}")
+            self._next_edit_at = self.clock() + self.min_interval
+
+
+async def keep_typing(message: Any, interval: float = 4.0) -> None:
+    """Shows "typing…" in the message's chat until cancelled; Telegram clears it after 5 seconds."""
+    while True:
+        try:
+            await message.reply_chat_action(ChatAction.TYPING)
+        except Exception as e:
+            logger.debug(f"Couldn't send typing indicator: {e}")
+        await asyncio.sleep(interval)
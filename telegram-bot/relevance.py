@@ -0,0 +1,166 @@
+import logging
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Minimum relevance score a message needs to be sent for mediation, per sensitivity level.
+# Higher sensitivity means the bot steps in on more messages; "all" answers everything.
+SENSITIVITY_THRESHOLDS = {"all": 0.0, "high": 0.2, "medium": 0.35, "low": 0.55}
+
+# Messages that never need mediation on their own
+SMALL_TALK = {
+    "ok", "okay", "k", "kk", "lol", "lmao", "haha", "hahaha", "yes", "yeah", "yep", "no", "nope",
+    "sure", "thanks", "thank you", "thx", "ty", "hi", "hello", "hey", "bye", "good morning",
+    "good night", "gn", "nice", "cool", "great", "np", "brb", "same", "true", "agreed",
+}
+# Words that point at a disagreement or at feelings about one
+CONFLICT_TERMS = {
+    "angry", "annoyed", "annoying", "argue", "arguing", "argument", "blame", "disagree", "disrespect",
+    "disrespectful", "fault", "fight", "fighting", "frustrated", "frustrating", "hate", "hurt", "ignore",
+    "ignored", "ignoring", "issue", "lied", "lying", "mad", "problem", "rude", "selfish", "sorry",
+    "unfair", "upset", "wrong", "conflict", "compromise", "apologize", "apology", "promised", "owe",
+    "owes", "rent", "chores", "cleaning", "mess", "money", "noise", "late", "again", "seriously",
+}
+# Phrases that are strong signs of a dispute, or a direct request for help
+CONFLICT_PHRASES = (
+    "you always", "you never", "not fair", "sick of", "fed up", "can't believe", "cannot believe",
+    "every time", "not my fault", "your fault", "what should we", "help us", "mediator", "we need to talk",
+)
+SECOND_PERSON = {"you", "your", "you're", "youre", "yours"}
+
+WORD_RE = re.compile(r"[\w']+")
+
+
+def score_message(text: str) -> float:
+    """
+    Scores how likely a group message needs mediation, from 0 to 1, with cheap
+    keyword and shape heuristics. Acknowledgements, emoji and short chatter
+    score 0; messages about a disagreement, addressed at someone, score high.
+    """
+    lowered = text.lower().strip()
+    words = WORD_RE.findall(lowered)
+    if not words or lowered.strip(" .!?") in SMALL_TALK:
+        return 0.0
+
+    score = 0.0
+    conflict_words = sum(1 for word in words if word in CONFLICT_TERMS)
+    score += min(0.25 * conflict_words, 0.6)
+    if any(phrase in lowered for phrase in CONFLICT_PHRASES):
+        score += 0.3
+    if conflict_words and any(word in SECOND_PERSON for word in words):
+        score += 0.1
+    if "?" in text:
+        score += 0.1
+    if "!" in text or any(len(word) > 2 and word.isupper() for word in WORD_RE.findall(text)):
+        score += 0.1
+    if len(words) >= 8:
+        score += 0.1
+    elif len(words) < 3:
+        score -= 0.2
+    return max(0.0, min(score, 1.0))
+
+
+@dataclass
+class RelevanceDecision:
+    forward: bool
+    score: float
+    reason: str
+
+
+class RelevanceFilter:
+    """
+    Decides which group messages are sent to the guidance service.
+
+    Each message is scored by `scorer` and forwarded when the score reaches the
+    threshold of its chat's sensitivity level. With a `model` (anything with a
+    scikit-learn style `predict_proba`), messages whose heuristic score is
+    within `model_band` of the threshold are scored by the model instead, so
+    the model only runs for the unclear cases. Messages addressed to the bot
+    are always forwarded.
+    """
+
+    def __init__(
+        self,
+        scorer: Callable[[str], float] = score_message,
+        default_sensitivity: str = "medium",
+        group_sensitivity: Optional[Dict[Any, str]] = None,
+        model: Any = None,
+        model_band: float = 0.15,
+    ) -> None:
+        self.scorer = scorer
+        self.default_sensitivity = self._check_level(default_sensitivity)
+        self.group_sensitivity = {chat_id: self._check_level(level) for chat_id, level in (group_sensitivity or {}).items()}
+        self.model = model
+        self.model_band = model_band
+        self.counts: Dict[Any, Counter] = {}
+
+    @staticmethod
+    def _check_level(level: str) -> str:
+        if level not in SENSITIVITY_THRESHOLDS:
+            raise ValueError(f"Unknown sensitivity level: {level} (use one of {', '.join(SENSITIVITY_THRESHOLDS)})")
+        return level
+
+    def sensitivity(self, chat_id) -> str:
+        return self.group_sensitivity.get(chat_id, self.default_sensitivity)
+
+    def set_sensitivity(self, chat_id, level: str) -> None:
+        self.group_sensitivity[chat_id] = self._check_level(level)
+
+    def check(self, chat_id, text: str, addressed: bool = False) -> RelevanceDecision:
+        """Decides whether the message should be sent for mediation, and counts the decision."""
+        threshold = SENSITIVITY_THRESHOLDS[self.sensitivity(chat_id)]
+        if addressed:
+            decision = RelevanceDecision(True, 1.0, "addressed")
+        elif threshold <= 0:
+            decision = RelevanceDecision(True, 1.0, "sensitivity")
+        else:
+            score, reason = self.scorer(text), "heuristic"
+            if self.model is not None and abs(score - threshold) <= self.model_band:
+                try:
+                    score, reason = float(self.model.predict_proba([text])[0][1]), "model"
+                except Exception:
+                    logger.exception("Relevance model failed; using the heuristic score")
+            decision = RelevanceDecision(score >= threshold, score, reason)
+
+        outcome = "forwarded" if decision.forward else "filtered"
+        self.counts.setdefault(chat_id, Counter())[outcome] += 1
+        metrics.GROUP_MESSAGES.labels(outcome).inc()
+        return decision
+
+    def stats(self, chat_id) -> Dict[str, int]:
+        counts = self.counts.get(chat_id, Counter())
+        return {"forwarded": counts["forwarded"], "filtered": counts["filtered"]}
+
+
+def create_relevance_filter_from_env() -> RelevanceFilter:
+    """
+    Creates the relevance filter from BOT_RELEVANCE_SENSITIVITY (default level),
+    BOT_RELEVANCE_GROUP_SENSITIVITY (comma-separated chat_id=level pairs) and
+    BOT_RELEVANCE_MODEL_PATH, an optional joblib-saved scikit-learn classifier
+    (needs joblib and scikit-learn installed).
+    """
+    group_sensitivity = {}
+    for pair in os.getenv("BOT_RELEVANCE_GROUP_SENSITIVITY", "").split(","):
+        if pair.strip():
+            chat_id, _, level = pair.partition("=")
+            group_sensitivity[int(chat_id.strip())] = level.strip().lower()
+
+    model = None
+    model_path = os.getenv("BOT_RELEVANCE_MODEL_PATH")
+    if model_path:
+        import joblib
+
+        model = joblib.load(model_path)
+
+    return RelevanceFilter(
+        default_sensitivity=os.getenv("BOT_RELEVANCE_SENSITIVITY", "medium").lower(),
+        group_sensitivity=group_sensitivity,
+        model=model,
+        model_band=float(os.getenv("BOT_RELEVANCE_MODEL_BAND", "0.15")),
+    )
@@ -0,0 +1,97 @@
+import pytest
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from batching import BufferedMessage, MessageBatcher
+
+
+def buffered(text, user="alice"):
+    return BufferedMessage(message=MagicMock(), user_info=user, text=text)
+
+
+@pytest.mark.asyncio
+async def test_batch_is_flushed_after_window():
+    flush = AsyncMock()
+    batcher = MessageBatcher(flush, window=0.05)
+
+    await batcher.add(1, buffered("first"))
+    await batcher.add(1, buffered("second", user="bob"))
+    flush.assert_not_called()
+    assert batcher.pending(1) == 2
+
+    await asyncio.sleep(0.1)
+    flush.assert_awaited_once()
+    chat_id, messages = flush.call_args[0]
+    assert chat_id == 1
+    assert [m.text for m in messages] == ["first", "second"]
+    assert batcher.pending(1) == 0
+
+
+@pytest.mark.asyncio
+async def test_batch_is_flushed_early_when_full():
+    flush = AsyncMock()
+    batcher = MessageBatcher(flush, window=60, max_messages=3)
+
+    for i in range(3):
+        await batcher.add(1, buffered(f"message {i}"))
+    await asyncio.sleep(0)
+
+    flush.assert_awaited_once()
+    assert len(flush.call_args[0][1]) == 3
+
+
+@pytest.mark.asyncio
+async def test_batch_is_flushed_early_when_too_long():
+    flush = AsyncMock()
+    batcher = MessageBatcher(flush, window=60, max_chars=10)
+
+    await batcher.add(1, buffered("12345"))
+    await batcher.add(1, buffered("67890"))
+    await asyncio.sleep(0)
+
+    flush.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_message_that_would_overflow_starts_a_new_batch():
+    """Test that batches stay within max_chars when a long message arrives."""
+    flush = AsyncMock()
+    batcher = MessageBatcher(flush, window=60, max_chars=10)
+
+    await batcher.add(1, buffered("1234"))
+    await batcher.add(1, buffered("x" * 9))
+    await asyncio.sleep(0)
+
+    flush.assert_awaited_once()
+    assert [m.text for m in flush.call_args[0][1]] == ["1234"]
+    assert batcher.pending(1) == 1
+
+
+@pytest.mark.asyncio
+async def test_chats_are_batched_separately():
+    flush = AsyncMock()
+    batcher = MessageBatcher(flush, window=60)
+
+    await batcher.add(1, buffered("in chat one"))
+    await batcher.add(2, buffered("in chat two"))
+    await batcher.flush_all()
+
+    assert flush.await_count == 2
+    flushed = {call.args[0]: [m.text for m in call.args[1]] for call in flush.call_args_list}
+    assert flushed == {1: ["in chat one"], 2: ["in chat two"]}
+
+
+@pytest.mark.asyncio
+async def test_flush_errors_do_not_break_the_batcher():
+    flush = AsyncMock(side_effect=[Exception("boom"), None])
+    batcher = MessageBatcher(flush, window=60, max_messages=1)
+
+    await batcher.add(1, buffered("fails"))
+    await batcher.add(1, buffered("works"))
+    await batcher.flush_all()
+
+    assert flush.await_count == 2
@@ -1,6 +1,8 @@
 import pytest
 import asyncio # Required for async functions
+from contextlib import contextmanager
 from unittest.mock import AsyncMock, MagicMock, patch # AsyncMock for async methods, MagicMock for others
+import httpx
 
 # Assuming bot.py is in the parent directory or PYTHONPATH is set up correctly
 # For testing, it's common to adjust sys.path or use relative imports if structure allows
@@ -8,13 +10,37 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from bot import start, onboarding_complete, handle_group_message, LANGCHAIN_API_URL # Import handlers and constants
+from bot import start, onboarding_complete, handle_group_message, send_group_batch, LANGCHAIN_API_URL # Import handlers and constants
+from batching import BufferedMessage
+from relevance import RelevanceFilter
 from telegram import Update, Message, User, Chat # Import necessary Telegram objects
 
 # --- Helper to run async functions ---
 def run_async(func):
     return asyncio.run(func)
 
+# --- Helper to mock the shared HTTP client ---
+@contextmanager
+def patch_http_post(**kwargs):
+    """Replaces the bot's shared HTTP client and yields its (async) post mock."""
+    client = MagicMock(spec=httpx.AsyncClient)
+    client.post = AsyncMock(**kwargs)
+    with patch('bot.get_http_client', return_value=client):
+        yield client.post
+
+# --- Relevance filter ---
+@pytest.fixture(autouse=True)
+def answer_every_group_message():
+    """These tests are about answering messages, so no message is filtered as irrelevant."""
+    with patch('bot.relevance_filter', RelevanceFilter(default_sensitivity="all")):
+        yield
+
+@pytest.fixture(autouse=True)
+def reply_without_streaming():
+    """Most tests cover the plain request/response path; the streaming tests turn streaming back on."""
+    with patch('bot.GUIDANCE_STREAM_REPLIES', False):
+        yield
+
 # --- Tests for /start command ---
 @pytest.mark.asyncio
 async def test_start_command():
@@ -42,7 +68,7 @@ async def test_onboarding_complete_success():
     mock_response.status_code = 200
     mock_response.json.return_value = {"guidance": "Test guidance from API"}
     
-    with patch('requests.post', return_value=mock_response) as mock_post:
+    with patch_http_post(return_value=mock_response) as mock_post:
         await onboarding_complete(update, None) # Context not used
 
         mock_post.assert_called_once()
@@ -58,12 +84,12 @@ async def test_onboarding_complete_success():
 
 @pytest.mark.asyncio
 async def test_onboarding_complete_api_request_exception():
-    """Test /onboarding_complete when requests.post raises an exception."""
+    """Test /onboarding_complete when the HTTP client raises an exception."""
     update = MagicMock(spec=Update)
     update.message = AsyncMock(spec=Message)
     update.message.reply_text = AsyncMock()
     
-    with patch('requests.post', side_effect=requests.exceptions.RequestException("Network Error")) as mock_post:
+    with patch_http_post(side_effect=httpx.ConnectError("Network Error")) as mock_post:
         await onboarding_complete(update, None)
         
         mock_post.assert_called_once() # Ensure it was called
@@ -80,9 +106,9 @@ async def test_onboarding_complete_api_bad_status():
     
     mock_response = MagicMock()
     mock_response.status_code = 500
-    mock_response.raise_for_status.side_effect = requests.exceptions.HTTPError("Server Error")
+    mock_response.raise_for_status.side_effect = httpx.HTTPStatusError("Server Error", request=MagicMock(), response=mock_response)
     
-    with patch('requests.post', return_value=mock_response) as mock_post:
+    with patch_http_post(return_value=mock_response) as mock_post:
         await onboarding_complete(update, None)
         
         mock_post.assert_called_once()
@@ -108,7 +134,7 @@ async def test_handle_group_message_success():
     mock_response.status_code = 200
     mock_response.json.return_value = {"guidance": "Group guidance from API"}
     
-    with patch('requests.post', return_value=mock_response) as mock_post:
+    with patch_http_post(return_value=mock_response) as mock_post:
         await handle_group_message(update, None) # Context not used
 
         mock_post.assert_called_once()
@@ -116,6 +142,7 @@ async def test_handle_group_message_success():
         called_payload = mock_post.call_args[1]['json']['onboarding_data'] # Access nested data
         
         assert called_url == LANGCHAIN_API_URL
+        assert called_payload["kind"] == "group_message"
         assert called_payload["user_query"] == "This is a test group message."
         assert called_payload["user_info"] == "testuser"
         assert called_payload["group_chat_id"] == 12345
@@ -127,7 +154,7 @@ async def test_handle_group_message_success():
 
 @pytest.mark.asyncio
 async def test_handle_group_message_api_request_exception():
-    """Test handle_group_message when requests.post raises an exception."""
+    """Test handle_group_message when the HTTP client raises an exception."""
     update = MagicMock(spec=Update)
     update.message = AsyncMock(spec=Message)
     update.message.text = "Another group message."
@@ -137,7 +164,7 @@ async def test_handle_group_message_api_request_exception():
     update.message.chat.id = 67890
     update.message.reply_text = AsyncMock()
     
-    with patch('requests.post', side_effect=requests.exceptions.RequestException("Network Failure")) as mock_post:
+    with patch_http_post(side_effect=httpx.ConnectError("Network Failure")) as mock_post:
         await handle_group_message(update, None)
         
         mock_post.assert_called_once()
@@ -159,9 +186,9 @@ async def test_handle_group_message_api_bad_status():
     
     mock_response = MagicMock()
     mock_response.status_code = 403 # Simulate a forbidden error, for example
-    mock_response.raise_for_status.side_effect = requests.exceptions.HTTPError("Client Error")
+    mock_response.raise_for_status.side_effect = httpx.HTTPStatusError("Client Error", request=MagicMock(), response=mock_response)
 
-    with patch('requests.post', return_value=mock_response) as mock_post:
+    with patch_http_post(return_value=mock_response) as mock_post:
         await handle_group_message(update, None)
         
         mock_post.assert_called_once()
@@ -169,7 +196,278 @@ async def test_handle_group_message_api_bad_status():
             "I'm having trouble processing that message. Please try again later."
         )
 
-# This is needed because bot.py imports requests, and tests mock it.
-# We need to ensure the real requests is available for the test file itself if it were to use it,
-# but more importantly, to allow mocking to work correctly on the bot's import of requests.
-import requests
+
+# --- Tests for batched group messages ---
+@pytest.mark.asyncio
+async def test_send_group_batch_sends_one_transcript():
+    """Test that a batch of group messages is sent as one transcript with one reply."""
+    messages = [
+        BufferedMessage(AsyncMock(spec=Message), "alice", "Who is cleaning the kitchen?"),
+        BufferedMessage(AsyncMock(spec=Message), "bob", "Not me, I did it last week."),
+        BufferedMessage(AsyncMock(spec=Message), "alice", "That's not true!"),
+    ]
+    mock_response = MagicMock()
+    mock_response.json.return_value = {"guidance": "Agree on a rota."}
+
+    with patch_http_post(return_value=mock_response) as mock_post:
+        await send_group_batch(12345, messages)
+
+        mock_post.assert_called_once()
+        called_payload = mock_post.call_args[1]['json']['onboarding_data']
+        assert called_payload["user_query"] == (
+            "alice: Who is cleaning the kitchen?\n"
+            "bob: Not me, I did it last week.\n"
+            "alice: That's not true!"
+        )
+        assert called_payload["user_info"] == "alice, bob"
+        assert called_payload["group_chat_id"] == 12345
+
+    messages[0].message.reply_text.assert_not_called()
+    messages[1].message.reply_text.assert_not_called()
+    messages[2].message.reply_text.assert_called_once()
+    args, _ = messages[2].message.reply_text.call_args
+    assert "Regarding the last 3 messages" in args[0]
+    assert "Agree on a rota." in args[0]
+
+@pytest.mark.asyncio
+async def test_send_group_batch_single_message_keeps_quote():
+    """Test that a batch with one message is answered like a single message."""
+    message = AsyncMock(spec=Message)
+    mock_response = MagicMock()
+    mock_response.json.return_value = {"guidance": "Talk it through."}
+
+    with patch_http_post(return_value=mock_response) as mock_post:
+        await send_group_batch(12345, [BufferedMessage(message, "alice", "Hello?")])
+
+        assert mock_post.call_args[1]['json']['onboarding_data']["user_query"] == "Hello?"
+    message.reply_text.assert_called_once()
+    assert "Regarding \"Hello?\":" in message.reply_text.call_args[0][0]
+
+# --- Tests for request tracing and metrics ---
+@pytest.mark.asyncio
+async def test_guidance_request_carries_request_id_and_is_measured():
+    """Test that guidance calls send an X-Request-ID and are recorded in the metrics."""
+    from prometheus_client import REGISTRY
+
+    def sample(name, labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    update = MagicMock(spec=Update)
+    update.message = AsyncMock(spec=Message)
+    update.message.text = "Traced message."
+    update.message.from_user = MagicMock(spec=User)
+    update.message.from_user.username = "trace_user"
+    update.message.chat = MagicMock(spec=Chat)
+    update.message.chat.id = 4242
+    update.message.reply_text = AsyncMock()
+
+    mock_response = MagicMock()
+    mock_response.json.return_value = {"guidance": "Traced guidance"}
+    guidance_calls = sample("bot_guidance_request_duration_seconds_count", {"outcome": "success"})
+    handler_calls = sample("bot_handler_duration_seconds_count", {"handler": "group_message"})
+
+    with patch_http_post(return_value=mock_response) as mock_post:
+        await handle_group_message(update, None)
+
+        request_id = mock_post.call_args[1]['headers']['X-Request-ID']
+        assert len(request_id) == 32
+
+    assert sample("bot_guidance_request_duration_seconds_count", {"outcome": "success"}) == guidance_calls + 1
+    assert sample("bot_handler_duration_seconds_count", {"handler": "group_message"}) == handler_calls + 1
+
+# --- Tests for job mode ---
+@pytest.mark.asyncio
+async def test_group_guidance_in_job_mode_edits_placeholder():
+    """Test that job mode queues the request, polls its status and edits the placeholder reply."""
+    message = AsyncMock(spec=Message)
+    placeholder = AsyncMock(spec=Message)
+    message.reply_text = AsyncMock(return_value=placeholder)
+
+    queued = MagicMock()
+    queued.json.return_value = {"job_id": "abc", "status": "queued", "status_url": "/api/guidance/abc"}
+    running = MagicMock()
+    running.json.return_value = {"job_id": "abc", "status": "running"}
+    done = MagicMock()
+    done.json.return_value = {"job_id": "abc", "status": "succeeded", "guidance": "Queued guidance"}
+    client = MagicMock(spec=httpx.AsyncClient)
+    client.post = AsyncMock(return_value=queued)
+    client.get = AsyncMock(side_effect=[running, done])
+
+    with patch('bot.get_http_client', return_value=client), \
+            patch('bot.GUIDANCE_JOB_MODE', True), \
+            patch('bot.GUIDANCE_JOB_POLL_INTERVAL', 0):
+        await send_group_batch(12345, [BufferedMessage(message, "alice", "Hello?")])
+
+    assert client.post.call_args[1]['json']['async'] is True
+    assert client.get.call_args[0][0] == "http://localhost:5001/api/guidance/abc"
+    message.reply_text.assert_called_once_with("Regarding \"Hello?\":\n\n…")
+    placeholder.edit_text.assert_called_once_with("Regarding \"Hello?\":\n\nQueued guidance")
+
+@pytest.mark.asyncio
+async def test_group_guidance_in_job_mode_reports_failed_job():
+    """Test that a failed job replaces the placeholder with an apology."""
+    message = AsyncMock(spec=Message)
+    placeholder = AsyncMock(spec=Message)
+    message.reply_text = AsyncMock(return_value=placeholder)
+
+    failed = MagicMock()
+    failed.json.return_value = {"job_id": "abc", "status": "failed", "error": "LLM down", "status_url": "/api/guidance/abc"}
+    client = MagicMock(spec=httpx.AsyncClient)
+    client.post = AsyncMock(return_value=failed)
+
+    with patch('bot.get_http_client', return_value=client), patch('bot.GUIDANCE_JOB_MODE', True):
+        await send_group_batch(12345, [BufferedMessage(message, "alice", "Hello?")])
+
+    placeholder.edit_text.assert_called_once_with("I'm having trouble processing that message. Please try again later.")
+
+# --- Tests for the relevance filter ---
+def make_group_update(text, chat_id=12345):
+    update = MagicMock(spec=Update)
+    update.message = AsyncMock(spec=Message)
+    update.message.text = text
+    update.message.from_user = MagicMock(spec=User)
+    update.message.from_user.username = "testuser"
+    update.message.from_user.id = 7
+    update.message.chat = MagicMock(spec=Chat)
+    update.message.chat.id = chat_id
+    update.message.reply_to_message = None
+    update.message.reply_text = AsyncMock()
+    return update
+
+@pytest.mark.asyncio
+async def test_irrelevant_group_message_is_not_sent():
+    """Test that chatter is filtered out before calling the guidance service."""
+    relevance = RelevanceFilter()
+    update = make_group_update("ok 👍")
+
+    with patch('bot.relevance_filter', relevance), patch_http_post() as mock_post:
+        await handle_group_message(update, None)
+
+    mock_post.assert_not_called()
+    update.message.reply_text.assert_not_called()
+    assert relevance.stats(12345) == {"forwarded": 0, "filtered": 1}
+
+@pytest.mark.asyncio
+async def test_mention_of_bot_is_always_answered():
+    """Test that a message mentioning the bot is answered whatever its score."""
+    update = make_group_update("@mediator_bot ok?")
+    context = MagicMock()
+    context.bot.id = 99
+    context.bot.username = "mediator_bot"
+    mock_response = MagicMock()
+    mock_response.json.return_value = {"guidance": "Here to help"}
+
+    with patch('bot.relevance_filter', RelevanceFilter(default_sensitivity="low")), \
+            patch_http_post(return_value=mock_response) as mock_post:
+        await handle_group_message(update, context)
+
+    mock_post.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_admin_sets_mediation_sensitivity():
+    """Test that /mediation_sensitivity changes the group's level for admins only."""
+    from bot import mediation_sensitivity
+    relevance = RelevanceFilter()
+    update = make_group_update("/mediation_sensitivity high")
+    context = MagicMock()
+    context.args = ["high"]
+    context.bot.get_chat_member = AsyncMock(return_value=MagicMock(status="member"))
+
+    with patch('bot.relevance_filter', relevance):
+        await mediation_sensitivity(update, context)
+        assert relevance.sensitivity(12345) == "medium"
+
+        context.bot.get_chat_member.return_value = MagicMock(status="administrator")
+        await mediation_sensitivity(update, context)
+
+    assert relevance.sensitivity(12345) == "high"
+    update.message.reply_text.assert_called_with("Mediation sensitivity set to high.")
+
+# --- Tests for streamed replies ---
+def sse_client(body, status_code=200):
+    """An HTTP client whose guidance stream endpoint answers with the given Server-Sent Events body."""
+    def handler(request):
+        assert request.url.path == "/api/guidance/stream"
+        return httpx.Response(status_code, content=body.encode(), headers={"Content-Type": "text/event-stream"})
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+@pytest.mark.asyncio
+async def test_group_reply_is_streamed_into_placeholder():
+    """Test that the bot posts a placeholder, edits it as chunks arrive and ends with the full guidance."""
+    message = AsyncMock(spec=Message)
+    placeholder = AsyncMock(spec=Message)
+    message.reply_text = AsyncMock(return_value=placeholder)
+    chunk = "x" * 30
+    body = (
+        f'data: {{"delta": "{chunk}"}}\n\n'
+        f'data: {{"delta": "{chunk}"}}\n\n'
+        f'event: done\ndata: {{"guidance": "{chunk * 2}"}}\n\n'
+    )
+
+    with patch('bot.get_http_client', return_value=sse_client(body)), \
+            patch('bot.GUIDANCE_STREAM_REPLIES', True), \
+            patch('bot.GUIDANCE_STREAM_EDIT_INTERVAL', 0):
+        await send_group_batch(12345, [BufferedMessage(message, "alice", "Hello?")])
+
+    message.reply_text.assert_called_once_with("Regarding \"Hello?\":\n\n…")
+    edits = [c.args[0] for c in placeholder.edit_text.call_args_list]
+    assert edits == [
+        f"Regarding \"Hello?\":\n\n{chunk} …",
+        f"Regarding \"Hello?\":\n\n{chunk * 2} …",
+        f"Regarding \"Hello?\":\n\n{chunk * 2}",
+    ]
+
+@pytest.mark.asyncio
+async def test_stream_error_replaces_placeholder():
+    """Test that an error event from the guidance service ends in an apology, not a half answer."""
+    message = AsyncMock(spec=Message)
+    placeholder = AsyncMock(spec=Message)
+    message.reply_text = AsyncMock(return_value=placeholder)
+    body = 'data: {"delta": "Par"}\n\nevent: error\ndata: {"error": "An internal error occurred", "details": "LLM down"}\n\n'
+
+    with patch('bot.get_http_client', return_value=sse_client(body)), patch('bot.GUIDANCE_STREAM_REPLIES', True):
+        await send_group_batch(12345, [BufferedMessage(message, "alice", "Hello?")])
+
+    placeholder.edit_text.assert_called_with("I'm having trouble processing that message. Please try again later.")
+
+@pytest.mark.asyncio
+async def test_batch_placeholder_is_posted_when_batch_starts():
+    """Test that a batch's placeholder is posted for its first message and receives the streamed answer."""
+    from bot import buffer_group_message
+    from batching import MessageBatcher
+    batches = []
+    async def collect(chat_id, messages):
+        batches.append(messages)
+    placeholder = AsyncMock(spec=Message)
+    first, second = make_group_update("Who is cleaning the kitchen?"), make_group_update("Not me!")
+    first.message.reply_text = AsyncMock(return_value=placeholder)
+
+    with patch('bot.group_batcher', MessageBatcher(collect, window=60)) as batcher, \
+            patch('bot.GUIDANCE_STREAM_REPLIES', True):
+        await buffer_group_message(first, None)
+        await buffer_group_message(second, None)
+        first.message.reply_text.assert_called_once_with("…")
+        second.message.reply_text.assert_not_called()
+        await batcher.flush_all()
+
+    body = 'event: done\ndata: {"guidance": "Agree on a rota."}\n\n'
+    with patch('bot.get_http_client', return_value=sse_client(body)), patch('bot.GUIDANCE_STREAM_REPLIES', True):
+        await send_group_batch(12345, batches[0])
+
+    first.message.reply_text.assert_called_once()
+    placeholder.edit_text.assert_called_with("Regarding the last 2 messages:\n\nAgree on a rota.")
+
+@pytest.mark.asyncio
+async def test_streamed_answer_is_posted_when_placeholder_cannot_be_edited():
+    """Test that the guidance still reaches the group when the placeholder's final edit fails."""
+    from telegram.error import BadRequest
+    message = AsyncMock(spec=Message)
+    placeholder = AsyncMock(spec=Message)
+    placeholder.edit_text.side_effect = BadRequest("Message to edit not found")
+    message.reply_text = AsyncMock(return_value=placeholder)
+    body = 'event: done\ndata: {"guidance": "Agree on a rota."}\n\n'
+
+    with patch('bot.get_http_client', return_value=sse_client(body)), patch('bot.GUIDANCE_STREAM_REPLIES', True):
+        await send_group_batch(12345, [BufferedMessage(message, "alice", "Hello?")])
+
+    message.reply_text.assert_called_with("Regarding \"Hello?\":\n\nAgree on a rota.")
@@ -0,0 +1,104 @@
+import pytest
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import bot
+from relevance import RelevanceFilter
+from telegram import Update, Message, User, Chat
+
+# Simulated LLM latency of the stub guidance service, in seconds
+STUB_LATENCY = 0.5
+CONCURRENT_MESSAGES = 10
+
+
+@pytest.fixture(autouse=True)
+def answer_every_group_message():
+    """These tests measure plain request/response answers, so no message is filtered or streamed."""
+    with patch('bot.relevance_filter', RelevanceFilter(default_sensitivity="all")), \
+            patch('bot.GUIDANCE_STREAM_REPLIES', False):
+        yield
+
+
+class StubGuidanceHandler(BaseHTTPRequestHandler):
+    """Answers POST /api/guidance after a fixed delay, like a slow LLM would."""
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length))
+        time.sleep(STUB_LATENCY)
+        query = payload["onboarding_data"].get("user_query", "")
+        body = json.dumps({"guidance": f"Stub guidance for {query}"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_guidance_url():
+    """Runs the stub guidance service in a background thread."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGuidanceHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/api/guidance"
+    server.shutdown()
+    server.server_close()
+
+
+def make_group_update(text, chat_id):
+    update = MagicMock(spec=Update)
+    update.message = AsyncMock(spec=Message)
+    update.message.text = text
+    update.message.from_user = MagicMock(spec=User)
+    update.message.from_user.username = "load_user"
+    update.message.chat = MagicMock(spec=Chat)
+    update.message.chat.id = chat_id
+    update.message.reply_text = AsyncMock()
+    return update
+
+
+@pytest.mark.asyncio
+async def test_group_messages_are_processed_concurrently(stub_guidance_url):
+    """Concurrent group messages should overlap instead of waiting on each other."""
+    updates = [make_group_update(f"message {i}", chat_id=i) for i in range(CONCURRENT_MESSAGES)]
+
+    with patch('bot.LANGCHAIN_API_URL', stub_guidance_url):
+        await bot.init_http_client(None)
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*(bot.handle_group_message(update, None) for update in updates))
+            elapsed = time.perf_counter() - started
+        finally:
+            await bot.close_http_client(None)
+
+    for i, update in enumerate(updates):
+        update.message.reply_text.assert_called_once()
+        args, _ = update.message.reply_text.call_args
+        assert f"Stub guidance for message {i}" in args[0]
+
+    # Serial processing would take CONCURRENT_MESSAGES * STUB_LATENCY seconds
+    assert elapsed < STUB_LATENCY * CONCURRENT_MESSAGES / 3
+
+
+@pytest.mark.asyncio
+async def test_http_client_is_shared_and_closed_on_shutdown():
+    """The Application lifecycle hooks create one pooled client and close it."""
+    await bot.init_http_client(None)
+    client = bot.get_http_client()
+    assert bot.get_http_client() is client
+
+    await bot.close_http_client(None)
+    assert client.is_closed
+    assert bot._http_client is None
@@ -0,0 +1,122 @@
+import pytest
+import asyncio
+from unittest.mock import AsyncMock
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter
+
+from progressive_reply import ProgressiveReply, keep_typing
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_reply(clock, **kwargs):
+    message = AsyncMock(spec=Message)
+    return message, ProgressiveReply(message, "Guidance:\n\n", clock=clock, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_edits_are_throttled_by_time_and_size():
+    clock = FakeClock()
+    message, reply = make_reply(clock, min_interval=1.0, min_chars=5)
+
+    await reply.update("Hello")
+    await reply.update("Hello, wor")  # too soon
+    clock.now = 1.0
+    await reply.update("Hello, wor")
+    await reply.update("Hello, world")  # too soon and too small
+    clock.now = 2.0
+    await reply.update("Hello, world")  # too small
+
+    assert [c.args[0] for c in message.edit_text.call_args_list] == [
+        "Guidance:\n\nHello …",
+        "Guidance:\n\nHello, wor …",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_finish_shows_final_text():
+    clock = FakeClock()
+    message, reply = make_reply(clock, min_interval=0)
+
+    await reply.update("Partial answer that is long enough")
+    await reply.finish("Partial answer that is long enough, completed.")
+
+    message.edit_text.assert_called_with("Guidance:\n\nPartial answer that is long enough, completed.")
+    assert reply.edits == 2
+
+
+@pytest.mark.asyncio
+async def test_retry_after_delays_next_edit():
+    clock = FakeClock()
+    message, reply = make_reply(clock, min_interval=0, min_chars=1)
+    message.edit_text.side_effect = [RetryAfter(10), None]
+
+    await reply.update("First")
+    clock.now = 5.0
+    await reply.update("First and second")
+    assert message.edit_text.call_count == 1
+    clock.now = 10.0
+    await reply.update("First and second")
+    assert message.edit_text.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_unchanged_text_is_ignored():
+    clock = FakeClock()
+    message, reply = make_reply(clock, min_interval=0)
+    message.edit_text.side_effect = BadRequest("Message is not modified")
+
+    await reply.finish("Same")
+
+
+@pytest.mark.asyncio
+async def test_long_text_is_cut_to_message_limit():
+    clock = FakeClock()
+    message, reply = make_reply(clock)
+
+    await reply.finish("x" * 5000)
+
+    shown = message.edit_text.call_args[0][0]
+    assert len(shown) == 4096
+    assert shown.endswith("…")
+
+
+@pytest.mark.asyncio
+async def test_keep_typing_repeats_until_cancelled():
+    message = AsyncMock(spec=Message)
+    message.reply_chat_action.side_effect = [None, RuntimeError("network"), None, None, None]
+
+    task = asyncio.create_task(keep_typing(message, interval=0.01))
+    await asyncio.sleep(0.035)
+    task.cancel()
+
+    assert message.reply_chat_action.call_count >= 3
+    message.reply_chat_action.assert_called_with("typing")
+
+
+@pytest.mark.asyncio
+async def test_failed_edit_is_skipped_and_final_text_still_written():
+    """Test that a Telegram error on a streamed edit doesn't abort the reply."""
+    from telegram.error import TimedOut
+    clock = FakeClock()
+    message, reply = make_reply(clock, min_interval=1.0, min_chars=1)
+    message.edit_text.side_effect = [TimedOut(), None]
+
+    await reply.update("Partial")
+    await reply.update("Partial answer")  # pushed back after the failed edit
+    clock.now = 1.0
+    await reply.finish("Partial answer, finished")
+
+    assert message.edit_text.call_args_list[-1].args[0] == "Guidance:\n\nPartial answer, finished"
+    assert reply.edits == 1
@@ -0,0 +1,98 @@
+import pytest
+from unittest.mock import MagicMock
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from relevance import RelevanceFilter, create_relevance_filter_from_env, score_message
+
+
+@pytest.mark.parametrize("text", ["ok", "OK!", "👍", "lol", "thanks", "good morning", "..."])
+def test_chatter_scores_zero(text):
+    assert score_message(text) == 0.0
+
+
+def test_disputes_score_above_chatter():
+    dispute = score_message("I'm upset that you ignored my message about the rent again")
+    complaint = score_message("You never clean the kitchen, it's not fair!")
+    chatter = score_message("Who wants pizza tonight?")
+
+    assert dispute >= 0.55
+    assert complaint >= 0.35
+    assert chatter < 0.2
+
+
+def test_sensitivity_levels_set_threshold():
+    relevance = RelevanceFilter(scorer=lambda text: 0.3, group_sensitivity={2: "high"})
+
+    assert relevance.check(1, "text").forward is False  # medium: 0.35
+    assert relevance.check(2, "text").forward is True  # high: 0.2
+    relevance.set_sensitivity(1, "all")
+    assert relevance.check(1, "ok").forward is True
+
+
+def test_unknown_sensitivity_is_rejected():
+    with pytest.raises(ValueError):
+        RelevanceFilter(default_sensitivity="extreme")
+    with pytest.raises(ValueError):
+        RelevanceFilter().set_sensitivity(1, "extreme")
+
+
+def test_addressed_messages_are_always_forwarded():
+    relevance = RelevanceFilter(default_sensitivity="low")
+
+    decision = relevance.check(1, "ok", addressed=True)
+
+    assert decision.forward is True
+    assert decision.reason == "addressed"
+
+
+def test_counts_decisions_per_group():
+    relevance = RelevanceFilter()
+    relevance.check(1, "ok")
+    relevance.check(1, "lol")
+    relevance.check(1, "You always blame me and it's not fair!")
+    relevance.check(2, "ok")
+
+    assert relevance.stats(1) == {"forwarded": 1, "filtered": 2}
+    assert relevance.stats(2) == {"forwarded": 0, "filtered": 1}
+    assert relevance.stats(3) == {"forwarded": 0, "filtered": 0}
+
+
+def test_model_only_scores_unclear_messages():
+    model = MagicMock()
+    model.predict_proba.return_value = [[0.1, 0.9]]
+    relevance = RelevanceFilter(scorer=lambda text: 0.0 if text == "ok" else 0.3, model=model)
+
+    assert relevance.check(1, "ok").forward is False
+    model.predict_proba.assert_not_called()
+
+    decision = relevance.check(1, "borderline")
+    assert decision.forward is True
+    assert decision.reason == "model"
+    model.predict_proba.assert_called_once_with(["borderline"])
+
+
+def test_failing_model_falls_back_to_heuristic():
+    model = MagicMock()
+    model.predict_proba.side_effect = RuntimeError("broken model")
+    relevance = RelevanceFilter(scorer=lambda text: 0.4, model=model)
+
+    decision = relevance.check(1, "borderline")
+
+    assert decision.forward is True
+    assert decision.reason == "heuristic"
+
+
+def test_create_relevance_filter_from_env(monkeypatch):
+    monkeypatch.setenv("BOT_RELEVANCE_SENSITIVITY", "low")
+    monkeypatch.setenv("BOT_RELEVANCE_GROUP_SENSITIVITY", "-1001=high, -1002=all")
+    monkeypatch.delenv("BOT_RELEVANCE_MODEL_PATH", raising=False)
+
+    relevance = create_relevance_filter_from_env()
+
+    assert relevance.sensitivity(42) == "low"
+    assert relevance.sensitivity(-1001) == "high"
+    assert relevance.sensitivity(-1002) == "all"
+    assert relevance.model is None
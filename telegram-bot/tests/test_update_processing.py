@@ -0,0 +1,95 @@
+import pytest
+import asyncio
+from datetime import datetime, timezone
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from telegram import Chat, Message, Update, User
+from update_processing import ChatOrderedUpdateProcessor
+
+
+def make_update(update_id, chat_id, text="hello"):
+    chat = Chat(id=chat_id, type=Chat.GROUP)
+    user = User(id=1, first_name="Test", is_bot=False)
+    message = Message(message_id=update_id, date=datetime.now(timezone.utc), chat=chat, from_user=user, text=text)
+    return Update(update_id=update_id, message=message)
+
+
+async def process_all(processor, updates, handler):
+    await asyncio.gather(*(processor.process_update(update, handler(update)) for update in updates))
+
+
+@pytest.mark.asyncio
+async def test_updates_within_a_chat_stay_in_order():
+    processor = ChatOrderedUpdateProcessor(max_concurrent_updates=8)
+    handled = []
+
+    async def handler(update):
+        # Earlier updates take longer, so any overlap would reorder them
+        await asyncio.sleep(0.01 * (5 - update.update_id))
+        handled.append(update.update_id)
+
+    await process_all(processor, [make_update(i, chat_id=1) for i in range(5)], handler)
+    assert handled == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_different_chats_run_concurrently():
+    processor = ChatOrderedUpdateProcessor(max_concurrent_updates=8)
+    running = set()
+    overlap = []
+
+    async def handler(update):
+        running.add(update.effective_chat.id)
+        overlap.append(len(running))
+        await asyncio.sleep(0.02)
+        running.discard(update.effective_chat.id)
+
+    await process_all(processor, [make_update(i, chat_id=i) for i in range(4)], handler)
+    assert max(overlap) == 4
+
+
+@pytest.mark.asyncio
+async def test_flooding_chat_drops_stale_updates():
+    processor = ChatOrderedUpdateProcessor(max_concurrent_updates=8, max_queued_per_chat=2)
+    handled = []
+
+    async def handler(update):
+        await asyncio.sleep(0.01)
+        handled.append(update.update_id)
+
+    await process_all(processor, [make_update(i, chat_id=1) for i in range(6)], handler)
+
+    # The first update was already running; of the five queued behind it only the newest two survive
+    assert handled == [0, 4, 5]
+    assert processor.dropped_updates == 3
+
+
+@pytest.mark.asyncio
+async def test_handler_errors_do_not_stop_the_chat_queue():
+    processor = ChatOrderedUpdateProcessor(max_concurrent_updates=8)
+    handled = []
+
+    async def handler(update):
+        await asyncio.sleep(0)
+        if update.update_id == 0:
+            raise RuntimeError("handler failed")
+        handled.append(update.update_id)
+
+    await process_all(processor, [make_update(i, chat_id=1) for i in range(3)], handler)
+    assert handled == [1, 2]
+    assert processor.queued_updates(1) == 0
+
+
+@pytest.mark.asyncio
+async def test_updates_without_chat_are_processed_directly():
+    processor = ChatOrderedUpdateProcessor(max_concurrent_updates=1)
+    handled = []
+
+    async def handler(update):
+        handled.append(update)
+
+    await processor.process_update("not an update", handler("not an update"))
+    assert handled == ["not an update"]
@@ -0,0 +1,89 @@
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, Tuple
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates from different chats concurrently while keeping the
+    updates of each chat in order.
+
+    The first update of a chat is processed right away and then drains that
+    chat's queue, so a chat never occupies more than one of the
+    `max_concurrent_updates` slots. When a chat floods, its queue keeps only
+    the newest `max_queued_per_chat` updates and drops the stale ones.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_queued_per_chat: int = 20) -> None:
+        super().__init__(max_concurrent_updates)
+        self.max_queued_per_chat = max_queued_per_chat
+        self.dropped_updates = 0
+        self._queues: Dict[Any, Deque[Tuple[Awaitable[Any], float]]] = {}  # chat -> (coroutine, queued at)
+
+    @staticmethod
+    def _chat_key(update: object):
+        if isinstance(update, Update) and update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        chat_id = self._chat_key(update)
+        if chat_id is None:
+            await coroutine
+            return
+
+        queue = self._queues.get(chat_id)
+        if queue is not None:
+            # This chat is already being processed; its worker will pick the update up
+            if len(queue) >= self.max_queued_per_chat:
+                self._discard(queue.popleft()[0])
+                self.dropped_updates += 1
+                metrics.DROPPED_UPDATES.inc()
+                logger.warning(f"Dropped a stale update for flooding chat {chat_id}")
+            queue.append((coroutine, time.perf_counter()))
+            return
+
+        queue = self._queues[chat_id] = deque()
+        try:
+            await self._run(coroutine)
+            while queue:
+                next_coroutine, queued_at = queue.popleft()
+                metrics.UPDATE_QUEUE_WAIT.observe(time.perf_counter() - queued_at)
+                await self._run(next_coroutine)
+        finally:
+            del self._queues[chat_id]
+            for pending, _ in queue:
+                self._discard(pending)
+
+    @staticmethod
+    async def _run(coroutine: Awaitable[Any]) -> None:
+        try:
+            await coroutine
+        except Exception:
+            logger.exception("Error while processing an update")
+
+    @staticmethod
+    def _discard(coroutine: Awaitable[Any]) -> None:
+        close = getattr(coroutine, "close", None)
+        if close is not None:
+            close()  # Avoids "coroutine was never awaited" warnings
+
+    def queued_updates(self, chat_id) -> int:
+        """Returns the number of updates waiting behind the one being processed for the chat."""
+        return len(self._queues.get(chat_id, ()))
+
+    async def initialize(self) -> None:
+        """Nothing to set up."""
+
+    async def shutdown(self) -> None:
+        """Drops updates that were still queued."""
+        for queue in self._queues.values():
+            while queue:
+                self._discard(queue.popleft()[0])